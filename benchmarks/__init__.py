@@ -0,0 +1,3 @@
+""" Offline benchmarks for flask_rdf
+    Run a single benchmark with python -m benchmarks.<name>
+"""
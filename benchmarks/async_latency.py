@@ -0,0 +1,84 @@
+""" Measures event loop latency while graphs are serialized
+    Runs a ticker coroutine next to a concurrent mix of large graph
+    responses and small text responses, and reports how late the ticker
+    woke up when serializing inline versus on thread and process pools
+    Usage: python -m benchmarks.async_latency
+"""
+from __future__ import print_function
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import FOAF
+from flask_rdf.async_decorators import AsyncViewDecorator
+
+
+TICK = 0.001
+
+
+class BenchDecorator(AsyncViewDecorator):
+	@classmethod
+	def make_new_response(cls, old_response, mimetype, serialized):
+		return serialized
+	@classmethod
+	def get_accept(cls):
+		return 'text/turtle'
+
+
+class InlineDecorator(BenchDecorator):
+	""" Serializes in the event loop, like a plain ViewDecorator would """
+	async def output_async(self, response, *args):
+		return self.output(response, *args)
+
+
+def make_graph(size):
+	graph = Graph()
+	for i in range(size):
+		person = URIRef('http://example.com/person/%s' % i)
+		graph.add((person, FOAF.name, Literal('Person %s' % i)))
+		graph.add((person, FOAF.age, Literal(i)))
+	return graph
+
+
+async def ticker(lags, stop):
+	while not stop.is_set():
+		start = time.time()
+		await asyncio.sleep(TICK)
+		lags.append(time.time() - start - TICK)
+
+
+async def load(decorator, graph, requests):
+	graph_view = decorator(lambda: graph)
+	text_view = decorator(lambda: 'text')
+	views = [graph_view if i % 4 == 0 else text_view for i in range(requests)]
+	await asyncio.gather(*[view() for view in views])
+
+
+async def measure(decorator, graph, requests):
+	lags = []
+	stop = asyncio.Event()
+	tick = asyncio.ensure_future(ticker(lags, stop))
+	start = time.time()
+	await load(decorator, graph, requests)
+	elapsed = time.time() - start
+	stop.set()
+	await tick
+	lags.sort()
+	p99 = lags[int(len(lags) * 0.99)] if lags else 0
+	return elapsed, p99, lags[-1] if lags else 0
+
+
+def main(size=5000, requests=32):
+	graph = make_graph(size)
+	print('%-10s %10s %12s %12s' % ('mode', 'total', 'p99 lag', 'max lag'))
+	with ThreadPoolExecutor(4) as threads, ProcessPoolExecutor(4) as processes:
+		for name, decorator in [
+				('inline', InlineDecorator()),
+				('threads', BenchDecorator(executor=threads)),
+				('processes', BenchDecorator(executor=processes))]:
+			elapsed, p99, worst = asyncio.run(measure(decorator, graph, requests))
+			print('%-10s %9.0fms %10.1fms %10.1fms' % (name, elapsed * 1e3, p99 * 1e3, worst * 1e3))
+
+
+if __name__ == '__main__':
+	main()
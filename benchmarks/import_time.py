@@ -0,0 +1,92 @@
+""" Tracks the cold start cost of importing flask_rdf
+    Imports each entry point in a fresh interpreter with python -X importtime,
+    reporting the median cumulative import time and whether rdflib was loaded
+    The results can be saved as JSON, and compared against a saved run to
+    flag regressions
+    Usage: python -m benchmarks.import_time [-o results.json] [--compare old.json] [--threshold 0.2]
+"""
+from __future__ import print_function
+import argparse
+import json
+import subprocess
+import sys
+
+
+# entry points, and whether they should load rdflib
+TARGETS = [
+	('flask_rdf', False),
+	('flask_rdf.format', False),
+	('flask_rdf.wsgi', False),
+	('flask_rdf.flask', False),
+	('flask_rdf.bottle', False),
+	('flask_rdf.ntriples', True),
+]
+
+
+def import_time(module):
+	""" Returns (microseconds, loads_rdflib) for importing a module in a new interpreter """
+	code = 'import sys, %s; sys.stdout.write(str("rdflib" in sys.modules))' % module
+	process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code],
+	                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	stdout, stderr = process.communicate()
+	total = 0
+	for line in stderr.decode('utf-8').splitlines():
+		# import time: self [us] | cumulative | imported package
+		parts = line.split('|')
+		if len(parts) == 3 and parts[2].strip() == module:
+			total = int(parts[1].strip())
+	return total, stdout.strip() == b'True'
+
+
+def run(repeat=7):
+	results = {}
+	print('%-22s %12s %8s' % ('module', 'import', 'rdflib'))
+	for module, expect_rdflib in TARGETS:
+		times = []
+		for i in range(repeat):
+			elapsed, loads_rdflib = import_time(module)
+			times.append(elapsed)
+		times.sort()
+		median = times[len(times) // 2]
+		results[module] = {'import_us': median, 'rdflib': loads_rdflib}
+		warning = '  unexpected' if loads_rdflib != expect_rdflib else ''
+		print('%-22s %10.1fms %8s%s' % (module, median / 1e3, loads_rdflib, warning))
+	return results
+
+
+def compare(old, new, threshold=0.2):
+	""" Returns the regressions between two runs, as readable strings """
+	regressions = []
+	for module in sorted(set(old) & set(new)):
+		before = old[module]['import_us']
+		after = new[module]['import_us']
+		if before and (after - before) / float(before) > threshold:
+			regressions.append('%s: %.1fms -> %.1fms' % (module, before / 1e3, after / 1e3))
+		if new[module]['rdflib'] and not old[module]['rdflib']:
+			regressions.append('%s: now imports rdflib' % module)
+	return regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0].strip())
+	parser.add_argument('-o', '--output', help='file to save the JSON results to')
+	parser.add_argument('--compare', help='saved JSON results to compare with')
+	parser.add_argument('--threshold', type=float, default=0.2,
+	                    help='relative slowdown that counts as a regression')
+	parser.add_argument('--repeat', type=int, default=7)
+	args = parser.parse_args(argv)
+	results = run(args.repeat)
+	if args.output:
+		with open(args.output, 'w') as output:
+			json.dump(results, output, indent=1, sort_keys=True)
+	if args.compare:
+		with open(args.compare) as old:
+			regressions = compare(json.load(old), results, args.threshold)
+		for regression in regressions:
+			print('REGRESSION', regression)
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,39 @@
+""" Compares flask_rdf's Accept negotiation against python-mimeparse
+    Usage: python -m benchmarks.negotiation
+"""
+from __future__ import print_function
+import timeit
+import mimeparse
+from flask_rdf.format import FormatSelector, best_match
+
+
+# Accept headers sent by real clients
+HEADERS = {
+	'firefox': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+	'chrome': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+	'curl': '*/*',
+	'rdflib': 'application/rdf+xml,text/rdf+n3;q=0.9,application/xhtml+xml;q=0.5,*/*;q=0.1',
+	'jena': 'text/turtle,application/n-triples;q=0.9,application/ld+json;q=0.8,application/rdf+xml;q=0.7,*/*;q=0.5',
+	'sparqlwrapper': 'application/rdf+xml,application/n-triples;q=0.9,text/turtle;q=0.8,*/*;q=0.1',
+}
+
+
+def main(number=20000):
+	selector = FormatSelector()
+	warmed = FormatSelector()
+	warmed.warm(HEADERS.values())
+	registry = selector.get_registry()
+	candidates = list(registry.candidates)
+	print('%-14s %12s %12s %8s %12s %12s' % ('client', 'mimeparse', 'native', 'speedup', 'cached', 'table'))
+	for name, accepts in sorted(HEADERS.items()):
+		assert mimeparse.best_match(candidates, accepts) == best_match(registry.ranges, accepts)
+		old = timeit.timeit(lambda: mimeparse.best_match(candidates, accepts), number=number)
+		new = timeit.timeit(lambda: best_match(registry.ranges, accepts), number=number)
+		cached = timeit.timeit(lambda: selector.decide(accepts, True), number=number)
+		table = timeit.timeit(lambda: warmed.decide(accepts, True), number=number)
+		print('%-14s %10.2fus %10.2fus %7.1fx %10.2fus %10.2fus' % (name,
+		      old / number * 1e6, new / number * 1e6, old / new, cached / number * 1e6, table / number * 1e6))
+
+
+if __name__ == '__main__':
+	main()
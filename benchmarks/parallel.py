@@ -0,0 +1,45 @@
+""" Measures the speedup of serializing big graphs across a process pool
+    Compares the single-core N-Triples serializer with ParallelSerializer
+    at several worker counts, which needs a machine with 8 or more cores
+    to show its full effect
+    Usage: python -m benchmarks.parallel [triples]
+"""
+from __future__ import print_function
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as timer
+from flask_rdf.ntriples import serialize_nt
+from flask_rdf.parallel import ParallelSerializer
+from .suite import make_graph
+
+
+def best_time(func, repeat=3):
+	times = []
+	for i in range(repeat):
+		start = timer()
+		func()
+		times.append(timer() - start)
+	return min(times)
+
+
+def main(size=1000000):
+	cpus = multiprocessing.cpu_count()
+	graph = make_graph(size)
+	expected = serialize_nt(graph)
+	single = best_time(lambda: serialize_nt(graph))
+	print('%d triples, %d cpus' % (size, cpus))
+	print('%-10s %10s %10s' % ('workers', 'time', 'speedup'))
+	print('%-10s %9.2fs %9.2fx' % ('1 (serial)', single, 1))
+	workers = 2
+	while workers <= max(cpus, 2):
+		with ProcessPoolExecutor(workers) as pool:
+			parallel = ParallelSerializer(pool, threshold=0)
+			assert parallel.serialize(graph, 'nt') == expected
+			elapsed = best_time(lambda: parallel.serialize(graph, 'nt'))
+		print('%-10s %9.2fs %9.2fx' % (workers, elapsed, single / elapsed))
+		workers *= 2
+
+
+if __name__ == '__main__':
+	main(*[int(arg) for arg in sys.argv[1:]])
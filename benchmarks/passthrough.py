@@ -0,0 +1,64 @@
+""" Measures the overhead of the Flask decorator on views that don't return graphs
+    Calls decorated views directly, inside a request context, comparing the
+    bare view, flask.Decorator and the earlier implementation that looked
+    for the graph with hasattr and len, and read the request first
+    Usage: python -m benchmarks.passthrough
+"""
+from __future__ import print_function
+import time
+from functools import wraps
+import flask
+from flask_rdf.flask import Decorator
+
+
+class LegacyDecorator(Decorator):
+	""" The previous get_graph() and decorate(), which scanned the response twice """
+	@classmethod
+	def get_graph(cls, response):
+		if cls.is_graph(response):
+			return response
+		if hasattr(response, '__getitem__'):
+			if len(response) > 0 and \
+			   cls.is_graph(response[0]):
+				return response[0]
+
+	def negotiate(self, response, *args, **kwargs):
+		if self.get_graph(response) is None:
+			return response
+		return Decorator.negotiate(self, response, *args, **kwargs)
+
+	def decorate(self, view):
+		@wraps(view)
+		def decorated(*args, **kwargs):
+			response = view(*args, **kwargs)
+			return self.output(response, *self.read_request(*args, **kwargs))
+		return decorated
+
+
+def text():
+	return 'This is a test string'
+
+def text_status():
+	return 'This is a test string', 202, {'CustomHeader': 'yes'}
+
+
+def rate(view, requests):
+	start = time.time()
+	for i in range(requests):
+		view()
+	return requests / (time.time() - start)
+
+
+def main(requests=200000):
+	application = flask.Flask(__name__)
+	with application.test_request_context('/', headers={'Accept': 'text/turtle'}):
+		print('%-12s %-10s %14s' % ('view', 'decorator', 'calls/s'))
+		for view in [text, text_status]:
+			for name, decorated in [('bare', view),
+			                        ('legacy', LegacyDecorator()(view)),
+			                        ('current', Decorator()(view))]:
+				print('%-12s %-10s %14.0f' % (view.__name__, name, rate(decorated, requests)))
+
+
+if __name__ == '__main__':
+	main()
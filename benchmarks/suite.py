@@ -0,0 +1,229 @@
+""" Runs the benchmark suite and compares its results
+    Measures FormatSelector.decide over real Accept headers, the
+    decorators end to end through the Flask, Bottle and WSGI test clients,
+    and graph.serialize for each registered format at several graph sizes
+    Every benchmark reports its throughput, latency percentiles and peak
+    memory, and the results are saved as JSON to be compared later
+    Usage:
+        python -m benchmarks.suite run [-o results.json] [--sizes 1000,100000] [--only negotiation]
+        python -m benchmarks.suite compare old.json new.json [--threshold 0.1]
+"""
+from __future__ import print_function
+import argparse
+import json
+import platform
+import sys
+import time
+from timeit import default_timer as timer
+from rdflib import ConjunctiveGraph, Graph, Literal, URIRef
+from rdflib.namespace import FOAF
+from flask_rdf.common_decorators import ViewDecorator
+from flask_rdf.format import FormatSelector, formats
+from .negotiation import HEADERS
+
+try:
+	import tracemalloc
+except ImportError:	# python 2
+	tracemalloc = None
+
+
+SIZES = (1000, 100000, 1000000)
+MIN_TIME = 1.0	# seconds to repeat each benchmark for
+MAX_CALLS = 100000
+# formats that only serialize context-aware graphs
+CONTEXT_FORMATS = ('nquads', 'trix')
+
+
+def percentile(ordered, fraction):
+	return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def peak_memory(func):
+	""" Returns the peak bytes allocated during one call, or None """
+	if tracemalloc is None:
+		return None
+	tracemalloc.start()
+	try:
+		func()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+
+def measure(func, min_time=MIN_TIME, max_calls=MAX_CALLS):
+	""" Calls func until min_time has passed, timing each call """
+	func()	# warm up any caches
+	latencies = []
+	start = timer()
+	while len(latencies) < max_calls:
+		before = timer()
+		func()
+		after = timer()
+		latencies.append(after - before)
+		if after - start >= min_time:
+			break
+	total = sum(latencies)
+	latencies.sort()
+	return {
+		'calls': len(latencies),
+		'ops_per_sec': len(latencies) / total if total else None,
+		'mean': total / len(latencies),
+		'p50': percentile(latencies, 0.5),
+		'p90': percentile(latencies, 0.9),
+		'p99': percentile(latencies, 0.99),
+		'peak_bytes': peak_memory(func),
+	}
+
+
+def make_graph(size, context_aware=False):
+	""" Builds a graph of size triples, about people """
+	if context_aware:
+		graph = ConjunctiveGraph()
+		target = graph.get_context(URIRef('http://example.com/people'))
+	else:
+		graph = target = Graph()
+	for i in range(size // 2):
+		person = URIRef('http://example.com/person/%s' % i)
+		target.add((person, FOAF.name, Literal('Person %s' % i)))
+		target.add((person, FOAF.age, Literal(i)))
+	return graph
+
+
+class BenchDecorator(ViewDecorator):
+	@classmethod
+	def make_new_response(cls, old_response, mimetype, serialized):
+		return serialized
+
+
+def negotiation_benchmarks():
+	selector = FormatSelector()
+	for name, accepts in sorted(HEADERS.items()):
+		yield 'negotiation.decide.%s' % name, lambda accepts=accepts: selector.decide(accepts, True)
+		def uncached(accepts=accepts):
+			selector.cache_clear()
+			selector.decide(accepts, True)
+		yield 'negotiation.uncached.%s' % name, uncached
+
+
+def decorator_benchmarks():
+	graph = make_graph(100)
+	accept = 'text/turtle'
+	decorator = BenchDecorator()
+	yield 'output.view_decorator', lambda: decorator.output(graph, accept)
+
+	import flask
+	from flask_rdf.flask import returns_rdf as flask_rdf
+	app = flask.Flask(__name__)
+	app.route('/')(flask_rdf(lambda: graph))
+	client = app.test_client()
+	yield 'output.flask', lambda: client.get('/', headers={'Accept': accept}).data
+
+	import webtest
+	import bottle
+	from flask_rdf.bottle import returns_rdf as bottle_rdf
+	bottle_app = bottle.Bottle()
+	bottle_app.route('/')(bottle_rdf(lambda: graph))
+	bottle_client = webtest.TestApp(bottle_app)
+	yield 'output.bottle', lambda: bottle_client.get('/', headers={'Accept': accept}).body
+
+	from flask_rdf.wsgi import returns_rdf as wsgi_rdf
+	wsgi_client = webtest.TestApp(wsgi_rdf(lambda environ, start_response: graph))
+	yield 'output.wsgi', lambda: wsgi_client.get('/', headers={'Accept': accept}).body
+
+
+def serialize_benchmarks(sizes):
+	for size in sizes:
+		graph = make_graph(size)
+		ctx_graph = make_graph(size, context_aware=True)
+		for format in sorted(set(formats.values())):
+			target = ctx_graph if format in CONTEXT_FORMATS else graph
+			yield 'serialize.%s.%d' % (format, size), lambda target=target, format=format: target.serialize(format=format)
+
+
+def run(sizes=SIZES, only=None, min_time=MIN_TIME):
+	""" Runs the benchmarks whose names start with only, printing as it goes """
+	groups = [negotiation_benchmarks(), decorator_benchmarks(), serialize_benchmarks(sizes)]
+	results = {}
+	print('%-36s %12s %10s %10s %10s %12s' % ('benchmark', 'ops/s', 'p50', 'p90', 'p99', 'peak'))
+	for group in groups:
+		for name, func in group:
+			if only and not any(name.startswith(prefix) for prefix in only):
+				continue
+			result = measure(func, min_time)
+			results[name] = result
+			print('%-36s %12.1f %8.3fms %8.3fms %8.3fms %10s' % (name, result['ops_per_sec'],
+			      result['p50'] * 1e3, result['p90'] * 1e3, result['p99'] * 1e3,
+			      '%.1fMB' % (result['peak_bytes'] / 1e6) if result['peak_bytes'] is not None else '-'))
+	return {
+		'meta': {
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'rdflib': __import__('rdflib').__version__,
+		},
+		'results': results,
+	}
+
+
+def compare(old, new, threshold=0.1):
+	""" Returns the regressions between two results, as readable strings
+	    A benchmark regresses if its throughput drops, or its p99 latency
+	    or peak memory grows, by more than threshold
+	"""
+	regressions = []
+	for name in sorted(set(old['results']) & set(new['results'])):
+		before = old['results'][name]
+		after = new['results'][name]
+		checks = [
+			('ops_per_sec', before['ops_per_sec'], after['ops_per_sec'], -1),
+			('p99', before['p99'], after['p99'], 1),
+			('peak_bytes', before['peak_bytes'], after['peak_bytes'], 1),
+		]
+		for metric, a, b, direction in checks:
+			if not a or b is None:
+				continue
+			change = (b - a) / float(a)
+			if change * direction > threshold:
+				regressions.append('%s %s: %.4g -> %.4g (%+.1f%%)' % (name, metric, a, b, change * 100))
+	return regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0].strip())
+	commands = parser.add_subparsers(dest='command')
+	run_parser = commands.add_parser('run', help='run the benchmarks')
+	run_parser.add_argument('-o', '--output', help='file to save the JSON results to')
+	run_parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES),
+	                        help='comma-separated graph sizes to serialize, in triples')
+	run_parser.add_argument('--only', action='append',
+	                        help='only run the benchmarks starting with this name, such as negotiation')
+	run_parser.add_argument('--min-time', type=float, default=MIN_TIME,
+	                        help='seconds to repeat each benchmark for')
+	compare_parser = commands.add_parser('compare', help='flag regressions between two saved results')
+	compare_parser.add_argument('old')
+	compare_parser.add_argument('new')
+	compare_parser.add_argument('--threshold', type=float, default=0.1,
+	                            help='relative change that counts as a regression')
+	args = parser.parse_args(argv)
+
+	if args.command == 'run':
+		sizes = [int(size) for size in args.sizes.split(',') if size]
+		results = run(sizes, args.only, args.min_time)
+		if args.output:
+			with open(args.output, 'w') as output:
+				json.dump(results, output, indent=1, sort_keys=True)
+		return 0
+	if args.command == 'compare':
+		with open(args.old) as old, open(args.new) as new:
+			regressions = compare(json.load(old), json.load(new), args.threshold)
+		for regression in regressions:
+			print('REGRESSION', regression)
+		if not regressions:
+			print('no regressions')
+		return 1 if regressions else 0
+	parser.print_help()
+	return 2
+
+
+if __name__ == '__main__':
+	sys.exit(main())
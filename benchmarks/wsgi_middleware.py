@@ -0,0 +1,104 @@
+""" Measures the requests per second of the WSGI middleware
+    Calls decorated WSGI apps directly, without a server, for a small
+    graph response and a plain text response, comparing wsgi.Decorator
+    with the earlier implementation that buffered every response
+    Usage: python -m benchmarks.wsgi_middleware
+"""
+from __future__ import print_function
+import itertools
+import time
+from functools import wraps
+from six import BytesIO
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import FOAF
+from flask_rdf.wsgi import Decorator
+
+
+class LegacyDecorator(Decorator):
+	""" The previous decorate(), with a BytesIO and closures per request """
+	def decorate(self, app):
+		@wraps(app)
+		def decorated(environ, start_response):
+			app_response = {}
+			app_response['status'] = "200 OK"
+			app_response['headers'] = []
+			app_response['written'] = BytesIO()
+			def custom_start_response(status, headers, *args, **kwargs):
+				app_response['status'] = status
+				app_response['headers'] = headers
+				app_response['args'] = args
+				app_response['kwargs'] = kwargs
+				return app_response['written'].write
+			returned = app(environ, custom_start_response)
+
+			def set_http_code(status):
+				app_response['status'] = str(status)
+			def set_header(header, value):
+				app_response['headers'] = [(h,v) for (h,v) in app_response['headers'] if h.lower() != header.lower()]
+				app_response['headers'].append((header, value))
+			def set_content_type(content_type):
+				set_header('Content-Type', content_type)
+
+			accept = environ.get('HTTP_ACCEPT', '')
+			new_return = self.output(returned, accept, set_http_code, set_content_type, None, set_header)
+
+			vary_headers = (v for (h,v) in app_response['headers'] if h.lower() == 'vary')
+			vary_elements = list(itertools.chain(*[v.split(',') for v in vary_headers]))
+			vary_elements = list(set([v.strip() for v in vary_elements]))
+			if '*' not in vary_elements and 'accept' not in (v.lower() for v in vary_elements):
+				vary_elements.append('Accept')
+				set_header('Vary', ', '.join(vary_elements))
+
+			parent_writer = start_response(app_response['status'],
+			                               app_response['headers'],
+			                               *app_response.get('args', []),
+			                               **app_response.get('kwargs', {}))
+			written = app_response['written'].getvalue()
+			if len(written) > 0:
+				parent_writer(written)
+			return new_return
+		return decorated
+
+
+def make_graph():
+	graph = Graph()
+	person = URIRef('http://example.com/#person')
+	graph.add((person, FOAF.name, Literal('Person')))
+	graph.add((person, FOAF.age, Literal(15)))
+	return graph
+
+
+def make_app(graph):
+	def app(environ, start_response):
+		headers = [('Cache-Control', 'max-age=60'), ('Vary', 'Cookie')]
+		if environ['PATH_INFO'] == '/graph':
+			start_response('200 OK', headers)
+			return graph
+		start_response('200 OK', headers + [('Content-Type', 'text/plain')])
+		return [b'This is a test string']
+	return app
+
+
+def start_response(status, headers, exc_info=None):
+	return None
+
+
+def rate(app, path, requests):
+	environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT': 'application/n-triples'}
+	start = time.time()
+	for i in range(requests):
+		for chunk in app(environ, start_response):
+			pass
+	return requests / (time.time() - start)
+
+
+def main(requests=20000):
+	app = make_app(make_graph())
+	print('%-8s %-10s %14s' % ('path', 'decorator', 'requests/s'))
+	for path in ['/graph', '/text']:
+		for name, decorator in [('legacy', LegacyDecorator()), ('current', Decorator())]:
+			print('%-8s %-10s %14.0f' % (path, name, rate(decorator(app), path, requests)))
+
+
+if __name__ == '__main__':
+	main()
@@ -1,8 +1,37 @@
-from . import bottle
-from . import flask
-from . import wsgi
 from . import format
 from .format import add_format, FormatSelector, wants_rdf
-from .bottle import returns_rdf as bottle_rdf
-from .flask import returns_rdf as flask_rdf
-from .wsgi import returns_rdf as wsgi_rdf
+import importlib
+import sys
+
+
+# names that are imported on first use, so that importing flask_rdf
+# doesn't load every framework decorator, and rdflib, up front
+_lazy_attributes = {
+	'bottle': ('.bottle', None),
+	'flask': ('.flask', None),
+	'wsgi': ('.wsgi', None),
+	'bottle_rdf': ('.bottle', 'returns_rdf'),
+	'flask_rdf': ('.flask', 'returns_rdf'),
+	'wsgi_rdf': ('.wsgi', 'returns_rdf'),
+}
+
+
+def __getattr__(name):
+	""" Imports the lazy attributes of the package (PEP 562) """
+	try:
+		module_name, attribute = _lazy_attributes[name]
+	except KeyError:
+		raise AttributeError("module %r has no attribute %r" % (__name__, name))
+	module = importlib.import_module(module_name, __name__)
+	value = module if attribute is None else getattr(module, attribute)
+	globals()[name] = value
+	return value
+
+
+def __dir__():
+	return sorted(set(globals()) | set(_lazy_attributes))
+
+
+if sys.version_info < (3, 7):	# no module __getattr__
+	for _name in _lazy_attributes:
+		__getattr__(_name)
@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+import asyncio
+from functools import wraps
+from .format import FormatSelector
+from .streaming import serialize_stream, DEFAULT_CHUNK_SIZE
+from .common_decorators import is_graph
+from .snapshot import resolve_graph, prerendered
+
+
+_DONE = object()	# end of the serialized chunks
+
+
+def _get_header(headers, name):
+	""" Finds a header in a list of ASGI (name, value) byte pairs """
+	for (header, value) in headers:
+		if header.lower() == name:
+			return value.decode('latin-1')
+	return None
+
+
+class Decorator(object):
+	""" Decorator for ASGI applications that return rdflib Graphs
+	    The application is called with a send() that holds back its
+	    http.response.start, so that a returned graph can be negotiated
+	    and sent with the application's status and headers
+	"""
+	def __init__(self, format_selector=None, chunk_size=DEFAULT_CHUNK_SIZE, executor=None):
+		self.format_selector = format_selector
+		if self.format_selector is None:
+			self.format_selector = FormatSelector()
+		self.chunk_size = chunk_size
+		# thread pool to serialize on, or None for the loop's default executor
+		self.executor = executor
+
+	@staticmethod
+	def _is_graph(obj):
+		return is_graph(obj)
+
+	async def output(self, output, accepts, send, status=200, headers=()):
+		""" Sends a returned RDF graph as the ASGI response
+		    The headers go out as soon as the format is negotiated, and the
+		    body follows in http.response.body chunks as it is serialized
+		    on the executor
+		"""
+		output = resolve_graph(output)
+		if output is None:
+			# a Snapshot that isn't published yet
+			await send({'type': 'http.response.start', 'status': 503,
+			            'headers': [(b'content-type', b'text/plain')]})
+			await send({'type': 'http.response.body', 'body': b'503 Service Unavailable'})
+			return
+		mimetype, format = self.format_selector.decide(accepts, output.context_aware)
+		if mimetype is None:
+			await send({'type': 'http.response.start', 'status': 406,
+			            'headers': [(b'content-type', b'text/plain')]})
+			await send({'type': 'http.response.body', 'body': b'406 Not Acceptable'})
+			return
+		# explicitly mark text mimetypes as utf-8
+		if 'text' in mimetype:
+			mimetype = mimetype + '; charset=utf-8'
+
+		# set the Content-Type and Vary headers
+		headers = [(h, v) for (h, v) in headers if h.lower() != b'content-type']
+		headers.append((b'content-type', mimetype.encode('latin-1')))
+		vary_elements = []
+		for (header, value) in headers:
+			if header.lower() == b'vary':
+				vary_elements.extend(v.strip() for v in value.decode('latin-1').split(','))
+		if '*' not in vary_elements and 'accept' not in (v.lower() for v in vary_elements):
+			vary_elements.append('Accept')
+			headers = [(h, v) for (h, v) in headers if h.lower() != b'vary']
+			headers.append((b'vary', ', '.join(vary_elements).encode('latin-1')))
+		body = prerendered(output, format)
+		if body is not None:
+			# a Snapshot's bytes are sent at once
+			headers = [(h, v) for (h, v) in headers if h.lower() != b'content-length']
+			headers.append((b'content-length', str(len(body)).encode('latin-1')))
+			await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+			await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+			return
+		await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+
+		# stream the body
+		loop = asyncio.get_event_loop()
+		chunks = serialize_stream(output, format, self.chunk_size)
+		try:
+			while True:
+				chunk = await loop.run_in_executor(self.executor, next, chunks, _DONE)
+				if chunk is _DONE:
+					break
+				await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+		finally:
+			await loop.run_in_executor(self.executor, chunks.close)
+		await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+	def decorate(self, app):
+		""" Wraps an ASGI application to return formatted RDF graphs
+		    Uses content negotiation to serialize the graph to the client-preferred format
+		    Passes other responses and scopes through unmodified
+		"""
+		@wraps(app)
+		async def decorated(scope, receive, send):
+			if scope['type'] != 'http':
+				return await app(scope, receive, send)
+
+			# hold back the app's response start until we know what it returns
+			held = []
+			async def custom_send(message):
+				if message['type'] == 'http.response.start':
+					held.append(message)
+					return
+				if held:
+					await send(held.pop())
+				await send(message)
+			returned = await app(scope, receive, custom_send)
+
+			if not self._is_graph(returned):
+				if held:
+					await send(held.pop())
+				return returned
+
+			status = 200
+			headers = []
+			if held:
+				start = held.pop()
+				status = start['status']
+				headers = list(start.get('headers', []))
+			accept = _get_header(scope.get('headers', []), b'accept') or ''
+			await self.output(returned, accept, send, status, headers)
+		return decorated
+
+	def __call__(self, app):
+		""" Enables this class to be used as the decorator directly """
+		return self.decorate(app)
+
+
+_implicit_instance = Decorator()
+
+
+def returns_rdf(app):
+	return _implicit_instance.decorate(app)
@@ -0,0 +1,188 @@
+from __future__ import absolute_import
+import asyncio
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
+from .common_decorators import ViewDecorator, ViewResponse, Negotiated
+from .snapshot import prerendered
+from .streaming import encode_body
+
+
+def serialize(graph, format, serializer=None):
+	""" Serializes a graph inside an executor
+	    Defined at the module level so that process pools can pickle it
+	"""
+	if serializer is not None:
+		return serializer(graph)
+	return graph.serialize(format=format)
+
+
+class AsyncViewDecorator(ViewDecorator):
+	""" ViewDecorator for coroutine views, such as async Flask views
+	    The decorated view is a coroutine function that awaits the view
+	    if it returns an awaitable, and runs the CPU-bound serialization
+	    and compression on a concurrent.futures executor instead of the
+	    event loop
+	"""
+	def __init__(self, *args, executor=None, **kwargs):
+		super(AsyncViewDecorator, self).__init__(*args, **kwargs)
+		# thread or process pool to serialize on, or None for the loop's default
+		self.executor = executor
+
+	async def run_in_executor(self, func, *args):
+		""" Runs a function on the executor without blocking the event loop """
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(self.executor, func, *args)
+
+	def in_process(self):
+		""" Returns whether the executor runs its work in this process """
+		return not isinstance(self.executor, ProcessPoolExecutor)
+
+	async def run_in_thread(self, func, *args):
+		""" Runs a function that uses this process's objects, such as the
+		    cache, on the executor, or on the loop's default executor if
+		    the executor is a process pool, which it can't be sent to
+		"""
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(self.executor if self.in_process() else None, func, *args)
+
+	def get_serializer(self, format):
+		""" Returns a serializer that runs on a process pool executor and
+		    waits for it
+		    It is called off the event loop, by serialize_async(), which
+		    already runs on any other executor
+		"""
+		serializer = super(AsyncViewDecorator, self).get_serializer(format)
+		if self.in_process():
+			return serializer
+		executor = self.executor
+		return lambda graph: executor.submit(serialize, graph, format, serializer).result()
+
+	async def serialize_async(self, negotiated):
+		""" Serializes the negotiated graph like serialize(), or loads it
+		    from the cache, with run_in_thread()
+		    A process pool is only sent the graph to serialize it, and not
+		    to look it up in the cache, nor to serialize a page or a stream
+		"""
+		serialized = prerendered(negotiated.graph, negotiated.format)
+		if serialized is not None:
+			negotiated.stored = True
+			return serialized
+		return await self.run_in_thread(self.serialize, negotiated)
+
+	async def output_async(self, response, accepts, cache_key=None, if_none_match=None, accept_encoding=None,
+	                       range_header=None, if_range=None, query=None):
+		""" Formats a response from a view to handle any RDF graphs, like output()
+		    Serialization and compression run on the executor, and so does
+		    the negotiation if ETags, a cache or an instrumentation may
+		    read the graph for it
+		"""
+		negotiate = partial(self.start_negotiation, response, accepts, cache_key, if_none_match,
+		                    accept_encoding, range_header, if_range, query)
+		if self.etags or self.cache is not None or self.instrumentation is not None:
+			(stats, negotiated) = await self.run_in_thread(self.in_background(negotiate))
+		else:
+			(stats, negotiated) = negotiate()
+		if negotiated is None:
+			return response
+		if not isinstance(negotiated, Negotiated):
+			return negotiated
+		serialized = await self.serialize_async(negotiated)
+		stats.lap('serialize')
+		if negotiated.encoding is not None and not self.streaming:
+			# streams are compressed as the server consumes them instead
+			serialized = self.encoded(negotiated, await self.run_in_executor(
+				encode_body, serialized, negotiated.encoding, self.compress_min_size))
+		return self.respond(response, negotiated, serialized, stats)
+
+	def run_view(self, view, args, kwargs):
+		""" Calls the view to refresh its cached serialization, running
+		    it to completion on a new event loop if it is a coroutine
+		"""
+		response = view(*args, **kwargs)
+		if inspect.isawaitable(response):
+			loop = asyncio.new_event_loop()
+			try:
+				response = loop.run_until_complete(response)
+			finally:
+				loop.close()
+		return response
+
+	async def wait_flight(self, flight):
+		""" Waits for another request to finish the flight, without
+		    blocking the event loop
+		"""
+		loop = asyncio.get_event_loop()
+		done = loop.create_future()
+		def wake():
+			if not done.done():
+				done.set_result(None)
+		def notify():
+			try:
+				loop.call_soon_threadsafe(wake)
+			except RuntimeError:	# the loop was closed
+				pass
+		self.flights.notify(flight, notify)
+		try:
+			await asyncio.wait_for(done, self.flights.timeout)
+		except asyncio.TimeoutError:
+			pass
+		return self.flights.collect(flight)
+
+	async def run_coalesced_async(self, view, args, kwargs, accepts, cache_key=None):
+		""" Like run_coalesced, awaiting the view and serializing with
+		    run_in_thread()
+		"""
+		key = self.flight_key(accepts, *args, **kwargs)
+		(flight, leader) = self.flights.begin(key)
+		if not leader:
+			shared = await self.wait_flight(flight)
+			if shared is not None:
+				return shared
+			response = view(*args, **kwargs)
+			if inspect.isawaitable(response):
+				response = await response
+			return self.classify(response) or response
+		shared = None
+		try:
+			response = view(*args, **kwargs)
+			if inspect.isawaitable(response):
+				response = await response
+			classified = self.classify(response)
+			if classified is None:
+				return response
+			shared = await self.run_in_thread(self.share, classified, accepts, cache_key)
+			return shared
+		finally:
+			self.flights.finish(key, flight, shared)
+
+	def decorate(self, view):
+		""" Wraps a view function, or coroutine function, to return formatted RDF graphs
+		    The wrapper is a coroutine function
+		"""
+		@wraps(view)
+		async def decorated(*args, **kwargs):
+			request = None
+			if self.prenegotiate or self.max_age is not None:
+				request = self.read_request(*args, **kwargs)
+				refresh = partial(self.refresh, view, args, kwargs, request[0], request[1])
+				early = self.prenegotiate_request(*request, refresh=refresh)
+				if early is not None:
+					return early
+			if self.coalesce_key is not None:
+				if request is None:
+					request = self.read_request(*args, **kwargs)
+				classified = await self.run_coalesced_async(view, args, kwargs, request[0], request[1])
+				if not isinstance(classified, ViewResponse):
+					return classified
+				return await self.output_async(classified, *request)
+			response = view(*args, **kwargs)
+			if inspect.isawaitable(response):
+				response = await response
+			classified = self.classify(response)
+			if classified is None:
+				return response
+			if request is None:
+				request = self.read_request(*args, **kwargs)
+			return await self.output_async(classified, *request)
+		return decorated
@@ -1,6 +1,5 @@
 from __future__ import absolute_import
-from .common_decorators import ViewDecorator
-from rdflib.graph import Graph
+from .common_decorators import ViewDecorator, NEGOTIATION_KEY
 
 
 class Decorator(ViewDecorator):
@@ -11,16 +10,78 @@ class Decorator(ViewDecorator):
 		bottle.response.set_header('Vary', 'Accept')
 		return serialized
 
+	@classmethod
+	def update_response(cls, response, headers=(), status=None):
+		import bottle
+		if status is not None:
+			bottle.response.status = status
+		for header, value in headers:
+			bottle.response.set_header(header, value)
+		return response
+
+	@classmethod
+	def make_304_response(cls, view, headers=()):
+		import bottle
+		bottle.response.status = 304
+		bottle.response.set_header('Vary', 'Accept')
+		for header, value in headers:
+			bottle.response.set_header(header, value)
+		return ''
+
 	@classmethod
 	def make_406_response(cls):
 		import bottle
 		bottle.abort(406, '406 Not Acceptable')
 
+	@classmethod
+	def make_503_response(cls):
+		import bottle
+		bottle.abort(503, '503 Service Unavailable')
+
 	@classmethod
 	def get_accept(cls):
 		import bottle
 		return bottle.request.headers.get('Accept', '')
 
+	@classmethod
+	def get_accept_encoding(cls):
+		import bottle
+		return bottle.request.headers.get('Accept-Encoding', '')
+
+	@classmethod
+	def get_if_none_match(cls):
+		import bottle
+		if bottle.request.method not in ('GET', 'HEAD'):
+			return None
+		return bottle.request.headers.get('If-None-Match')
+
+	@classmethod
+	def get_range(cls):
+		import bottle
+		if bottle.request.method != 'GET':
+			return (None, None)
+		return (bottle.request.headers.get('Range'), bottle.request.headers.get('If-Range'))
+
+	@classmethod
+	def get_query_string(cls):
+		import bottle
+		return bottle.request.query_string
+
+	@classmethod
+	def set_negotiation(cls, negotiation):
+		import bottle
+		bottle.request.environ[NEGOTIATION_KEY] = negotiation
+
+	@classmethod
+	def in_background(cls, func):
+		import bottle
+		environ = bottle.request.environ.copy()
+		def bound():
+			# bottle.request is local to each thread
+			bottle.request.bind(environ)
+			return func()
+		return bound
+
 
 _implicit_instance = Decorator()
 
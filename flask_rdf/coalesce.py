@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+import threading
+
+
+class Flight(object):
+	""" One response being built, that other requests can wait for
+	    result is None until it is finished, and stays None if building it failed
+	"""
+	__slots__ = ('done', 'result', 'callbacks')
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.callbacks = []
+
+
+class SingleFlight(object):
+	""" Lets one thread at a time build the response for each key, while
+	    the other threads with the same key wait for its result
+	    led counts the responses that were built for waiting threads to
+	    share, coalesced the requests that were answered from one of them,
+	    and timeouts the requests that stopped waiting after timeout seconds,
+	    or whose response failed, and built their own
+	"""
+	def __init__(self, timeout=10.0):
+		self.timeout = timeout
+		self.led = 0
+		self.coalesced = 0
+		self.timeouts = 0
+		self._flights = {}
+		self._lock = threading.Lock()
+
+	def begin(self, key):
+		""" Returns (flight, leader), where leader is whether this thread
+		    has to build the response and finish() the flight
+		"""
+		with self._lock:
+			flight = self._flights.get(key)
+			if flight is not None:
+				return (flight, False)
+			flight = self._flights[key] = Flight()
+			self.led += 1
+			return (flight, True)
+
+	def finish(self, key, flight, result):
+		""" Hands the result to the waiting threads, None if it failed """
+		flight.result = result
+		with self._lock:
+			if self._flights.get(key) is flight:
+				del self._flights[key]
+			flight.done.set()
+			(callbacks, flight.callbacks) = (flight.callbacks, [])
+		for callback in callbacks:
+			callback()
+
+	def notify(self, flight, callback):
+		""" Calls callback() once the flight is finished, maybe right away
+		    It is called on the thread that finished it
+		"""
+		with self._lock:
+			if not flight.done.is_set():
+				flight.callbacks.append(callback)
+				return
+		callback()
+
+	def wait(self, flight):
+		""" Waits for another thread to finish the flight
+		    Returns its result, or None if the thread should build its own
+		"""
+		flight.done.wait(self.timeout)
+		return self.collect(flight)
+
+	def collect(self, flight):
+		""" Returns the result of a flight that was waited for, like wait() """
+		result = flight.result
+		with self._lock:
+			if result is None:
+				self.timeouts += 1
+			else:
+				self.coalesced += 1
+		return result
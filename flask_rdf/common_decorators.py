@@ -1,24 +1,563 @@
 from __future__ import absolute_import
-from .format import decide, FormatSelector
-from rdflib.graph import Graph
+from .format import FormatSelector
+from .streaming import serialize_stream, encode_body, DEFAULT_CHUNK_SIZE, COMPRESS_MIN_SIZE
+from .instrumentation import start_stats, NULL_STATS
+from .lazy import LazyGraph
+from .snapshot import Snapshot, Rendition, resolve_graph, prerendered
+from .coalesce import SingleFlight
+from collections import OrderedDict
+from six.moves.urllib.parse import parse_qsl, urlencode
+import hashlib
+import six
+import struct
+import sys
+import threading
+import time
+
+
+# WSGI environ key of the Prenegotiation of a request, in prenegotiate mode
+NEGOTIATION_KEY = 'flask_rdf.negotiation'
+
+
+def is_rdflib_graph(obj):
+	""" Returns whether this object is an rdflib Graph, without importing rdflib
+	    Nothing can be a Graph until rdflib.graph has been imported
+	"""
+	graph = sys.modules.get('rdflib.graph')
+	return graph is not None and isinstance(obj, graph.Graph)
+
+
+def is_graph(obj):
+	""" Returns whether this object is a graph that the decorators serialize:
+	    an rdflib Graph, a LazyGraph, or a Snapshot
+	    A Snapshot that isn't published yet is answered with a 503
+	"""
+	return is_rdflib_graph(obj) or isinstance(obj, (LazyGraph, Rendition, Snapshot))
+
+
+def graph_fingerprint(graph):
+	""" Returns a fingerprint of the contents of a graph
+	    It combines the number of triples with an order-independent sum of
+	    per-triple digests, so it is stable across processes and doesn't
+	    depend on the store's iteration order
+	    Quads are hashed with their context for context-aware graphs
+	    Blank nodes are relabelled canonically with rdflib.compare, so that
+	    graphs built the same way get the same fingerprint
+	    Hashing every triple costs more than serializing the graph in
+	    N-Triples, so the decorators only use known_fingerprint(), and a
+	    Snapshot calls this once per version, in the background
+	"""
+	if isinstance(graph, Rendition):
+		if graph.fingerprint is not None:
+			return graph.fingerprint
+		graph = graph.graph
+	if graph.context_aware:
+		contexts = [(context.identifier, context) for context in graph.contexts()]
+	else:
+		contexts = [(None, graph)]
+	count = 0
+	total = 0
+	for (identifier, triples) in contexts:
+		context = ''
+		if identifier is not None:
+			context = ' ' + _canonical_n3(identifier)
+		for triple in _canonical_triples(triples):
+			line = ' '.join(term.n3() for term in triple) + context
+			total += int(hashlib.md5(line.encode('utf-8')).hexdigest(), 16)
+			count += 1
+	return '%d-%032x' % (count, total % (1 << 128))
+
+
+def _canonical_triples(graph):
+	""" Returns the triples of a graph, with canonical blank node labels if it has any """
+	from rdflib.term import BNode
+	for triple in graph:
+		if any(isinstance(term, BNode) for term in triple):
+			from rdflib.compare import to_canonical_graph
+			return to_canonical_graph(graph)
+	return graph
+
+
+def _canonical_n3(term):
+	""" Returns the n3 of a context identifier, without the label of a blank node """
+	from rdflib.term import BNode
+	if isinstance(term, BNode):
+		return '_:'
+	return term.n3()
+
+
+def known_fingerprint(graph, key=None):
+	""" Returns a fingerprint of the graph that is known without reading
+	    its triples, for ETags: the fingerprint of a Rendition, from a
+	    Snapshot or versioned(), or else the key that the view gave to
+	    identify the graph, or None
+	"""
+	if isinstance(graph, Rendition) and graph.fingerprint is not None:
+		return graph.fingerprint
+	if key is not None:
+		return 'k-%s' % (key,)
+	return None
+
+
+def make_etag(fingerprint, mimetype, encoding=None, page=None):
+	""" Returns a strong ETag for a graph fingerprint in a mimetype
+	    and content coding, or for one page of it
+	"""
+	tag = '%s %s %s' % (fingerprint, mimetype, encoding)
+	if page is not None:
+		tag = '%s %d' % (tag, page)
+	return '"%s"' % hashlib.md5(tag.encode('utf-8')).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+	""" Returns whether an If-None-Match header matches the ETag
+	    Uses the weak comparison, as RFC 7232 asks for If-None-Match
+	"""
+	if not if_none_match:
+		return False
+	if if_none_match.strip() == '*':
+		return True
+	for candidate in if_none_match.split(','):
+		candidate = candidate.strip()
+		if candidate.startswith('W/'):
+			candidate = candidate[2:]
+		if candidate == etag:
+			return True
+	return False
+
+
+def select_range(serialized, range_header):
+	""" Applies a Range header to a serialized body
+	    Only a single range of bytes is supported, and any other Range
+	    header is ignored, which RFC 7233 allows
+	    Returns (status, body, content_range), where status is None
+	    for the whole body, 206 for a part of it or 416 if the range
+	    is past its end
+	"""
+	if not range_header or not isinstance(serialized, six.binary_type):
+		return (None, serialized, None)
+	unit, _, spec = range_header.partition('=')
+	first, dash, last = spec.strip().partition('-')
+	if unit.strip().lower() != 'bytes' or ',' in spec or not dash:
+		return (None, serialized, None)
+	size = len(serialized)
+	try:
+		if first:
+			start = int(first)
+			stop = int(last) + 1 if last else size
+			if last and stop <= start:
+				return (None, serialized, None)
+		else:	# the last bytes
+			start = max(size - int(last), 0) if int(last) else size
+			stop = size
+	except ValueError:
+		return (None, serialized, None)
+	if start >= size:
+		return (416, b'', 'bytes */%d' % size)
+	stop = min(stop, size)
+	return (206, serialized[start:stop], 'bytes %d-%d/%d' % (start, stop - 1, size))
+
+
+def parse_page(query, parameter='page'):
+	""" Returns the page number in a query string, counting from 1 """
+	for (name, value) in parse_qsl(query or ''):
+		if name == parameter:
+			try:
+				return max(int(value), 1)
+			except ValueError:
+				return 1
+	return 1
+
+
+def page_link(query, parameter, page, rel='next'):
+	""" Returns the Link header value of another page of this resource
+	    The link is relative to the request URL, and keeps its other
+	    query parameters
+	"""
+	pairs = [(name, value) for (name, value) in parse_qsl(query or '', keep_blank_values=True)
+	         if name != parameter]
+	pairs.append((parameter, str(page)))
+	return '<?%s>; rel="%s"' % (urlencode(pairs), rel)
+
+
+def make_cache_key(graph, format, key=None):
+	""" Returns the cache key for a graph serialized in a format
+	    Uses the given key to identify the graph, or else the fingerprint
+	    of a Rendition, from a Snapshot or versioned()
+	    Returns None for other graphs, which aren't cached, since hashing
+	    their triples would cost more than serializing them
+	"""
+	if key is None:
+		if not isinstance(graph, Rendition) or graph.fingerprint is None:
+			return None
+		key = graph.fingerprint
+	return '%s %s' % (key, format)
+
+
+class ResponseCache(object):
+	""" Interface of a store of serialized responses
+	    Keys are strings, and values are the serialized bytes
+	"""
+	def get(self, key):
+		""" Returns the cached bytes for this key, or None """
+		raise NotImplementedError
+
+	def set(self, key, value):
+		""" Stores the serialized bytes for this key """
+		raise NotImplementedError
+
+
+class DictResponseCache(ResponseCache):
+	""" Unbounded cache kept in any mapping, such as a dict or a shelf """
+	def __init__(self, store=None):
+		self.store = store
+		if self.store is None:
+			self.store = {}
+
+	def get(self, key):
+		return self.store.get(key)
+
+	def set(self, key, value):
+		self.store[key] = value
+
+
+class LRUResponseCache(ResponseCache):
+	""" In-process cache that evicts the least recently used responses
+	    once the cached bytes add up to more than max_bytes
+	"""
+	def __init__(self, max_bytes=64 * 1024 * 1024):
+		self.max_bytes = max_bytes
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		with self._lock:
+			value = self._data.pop(key, None)
+			if value is None:
+				self.misses += 1
+				return None
+			self._data[key] = value
+			self.hits += 1
+			return value
+
+	def set(self, key, value):
+		if len(value) > self.max_bytes:
+			return
+		with self._lock:
+			old = self._data.pop(key, None)
+			if old is not None:
+				self.size -= len(old)
+			self._data[key] = value
+			self.size += len(value)
+			while self.size > self.max_bytes:
+				(old_key, old) = self._data.popitem(last=False)
+				self.size -= len(old)
+
+	def __len__(self):
+		return len(self._data)
+
+
+# prefix of the entries of a TTLResponseCache: a marker and the time they were set
+_TTL_STAMP = struct.Struct('!4sd')
+_TTL_MARKER = b'ttl:'
+
+
+class TTLResponseCache(ResponseCache):
+	""" Wraps another ResponseCache to expire its entries ttl seconds after
+	    they were set, or never if ttl is None
+	    The time is stored in front of the bytes, so it is evicted along
+	    with them, and entries of a shared store that another process set
+	    expire by the same clock
+	    Entries that weren't set through a TTLResponseCache are expired
+	"""
+	def __init__(self, cache=None, ttl=None, clock=time.time):
+		self.cache = cache
+		if self.cache is None:
+			self.cache = LRUResponseCache()
+		self.ttl = ttl
+		self.clock = clock
+
+	def lookup(self, key):
+		""" Returns (bytes, age) of the entry for this key, in seconds,
+		    or (None, None) if it is missing or expired
+		"""
+		stamped = self.cache.get(key)
+		if stamped is None or len(stamped) < _TTL_STAMP.size or stamped[:len(_TTL_MARKER)] != _TTL_MARKER:
+			return (None, None)
+		(marker, stored) = _TTL_STAMP.unpack_from(stamped)
+		age = self.clock() - stored
+		if self.ttl is not None and age > self.ttl:
+			return (None, None)
+		return (stamped[_TTL_STAMP.size:], age)
+
+	def get(self, key):
+		return self.lookup(key)[0]
+
+	def set(self, key, value):
+		self.cache.set(key, _TTL_STAMP.pack(_TTL_MARKER, self.clock()) + value)
+
+
+class Revalidator(object):
+	""" Runs the background refreshes of cached serializations, with at
+	    most one running at a time for each cache key
+	"""
+	def __init__(self):
+		self._running = {}
+		self._lock = threading.Lock()
+
+	def start(self, key, refresh):
+		""" Calls refresh() on a new thread, unless key is being refreshed
+		    Returns the thread, or None if one was already running
+		"""
+		with self._lock:
+			if key in self._running:
+				return None
+			thread = threading.Thread(target=self._run, args=(key, refresh))
+			thread.daemon = True
+			self._running[key] = thread
+		thread.start()
+		return thread
+
+	def _run(self, key, refresh):
+		try:
+			refresh()
+		finally:
+			with self._lock:
+				self._running.pop(key, None)
+
+	def wait(self, timeout=None):
+		""" Waits for the refreshes that are running to finish """
+		with self._lock:
+			threads = list(self._running.values())
+		for thread in threads:
+			thread.join(timeout)
+
+
+def cache_control(max_age, stale_while_revalidate=0):
+	""" Returns the Cache-Control header value of a graph response """
+	if stale_while_revalidate:
+		return 'max-age=%d, stale-while-revalidate=%d' % (max_age, stale_while_revalidate)
+	return 'max-age=%d' % max_age
+
+
+def share_graph(graph, format, serialize):
+	""" Returns the graph to answer coalesced requests with
+	    Its serialization in the format, if it is given, is kept in a
+	    Rendition with serialize(graph), for the requests to reuse
+	    A LazyGraph is loaded first, since it can only be read once
+	"""
+	if isinstance(graph, LazyGraph):
+		graph = graph.materialize()
+	if format is None or prerendered(graph, format) is not None:
+		return graph
+	serialized = serialize(graph)
+	if not isinstance(serialized, six.binary_type):
+		return graph
+	if isinstance(graph, Rendition):
+		# such as a versioned graph, whose fingerprint is kept
+		bodies = dict(graph.bodies)
+		bodies[format] = serialized
+		return Rendition(graph.graph, graph.version, graph.fingerprint, bodies)
+	return Rendition(graph, 0, bodies={format: serialized})
+
+
+def stored_serialization(graph, format, cache=None, key=None):
+	""" Looks up a serialization of the graph that was already made, in
+	    its Rendition or in the cache
+	    key identifies the graph in the cache, like in make_cache_key
+	    Returns (serialized, cache_key), where serialized is None if there
+	    is none, and cache_key is the key to cache a new one with, if any
+	"""
+	serialized = prerendered(graph, format)
+	if serialized is not None or cache is None:
+		return (serialized, None)
+	cache_key = make_cache_key(graph, format, key)
+	if cache_key is None:
+		return (None, None)
+	return (cache.get(cache_key), cache_key)
+
+
+def render_graph(graph, format, cache=None, cache_key=None, chunk_size=None, serializer=None, parallel=None):
+	""" Serializes a graph that stored_serialization didn't find
+	    If chunk_size is given, the serialization is streamed as an
+	    iterator of chunks, and is not added to the cache
+	    serializer is a function of the graph to use instead of graph.serialize
+	    parallel is a ParallelSerializer, used instead if it applies to the graph
+	"""
+	if parallel is not None and not parallel.applies(graph, format):
+		parallel = None
+	if chunk_size is not None:
+		if parallel is not None:
+			return parallel.stream(graph, format, chunk_size)
+		return serialize_stream(graph, format, chunk_size)
+	if parallel is not None:
+		serialized = parallel.serialize(graph, format)
+	elif serializer is not None:
+		serialized = serializer(graph)
+	else:
+		serialized = graph.serialize(format=format)
+	if cache is not None and cache_key is not None:
+		cache.set(cache_key, serialized)
+	return serialized
+
+
+def serialize_graph(graph, format, cache=None, key=None, chunk_size=None, serializer=None, parallel=None):
+	""" Serializes a graph, reusing the cached serialization if possible
+	    key identifies the graph in the cache, like in make_cache_key
+	    The other arguments are passed on to render_graph
+	"""
+	(serialized, cache_key) = stored_serialization(graph, format, cache, key)
+	if serialized is not None:
+		return serialized
+	return render_graph(graph, format, cache, cache_key, chunk_size, serializer, parallel)
+
+
+class ViewResponse(object):
+	""" A view response that holds a graph, along with the status and
+	    headers that the view returned with it, if any
+	    ViewDecorator.classify finds it once, and the later steps reuse it
+	    A Snapshot is held as its current Rendition, so that the whole
+	    response comes from the same version, or None until it is published
+	    response is what the view returned, for make_new_response
+	"""
+	__slots__ = ('graph', 'status', 'headers', 'response')
+
+	def __init__(self, graph, status=None, headers=None, response=None):
+		self.graph = resolve_graph(graph)
+		self.status = status
+		self.headers = headers
+		self.response = response if response is not None else graph
+
+
+class Negotiated(object):
+	""" The outcome of content negotiation for a graph response
+	    Carries what was decided from ViewDecorator.negotiate
+	    through serialize to respond
+	"""
+	__slots__ = ('graph', 'mimetype', 'format', 'encoding', 'headers', 'cache_key', 'view',
+	             'range_header', 'page', 'query', 'stored', 'status')
+
+	def __init__(self, graph, mimetype, format, encoding=None, headers=None, cache_key=None, view=None):
+		self.graph = graph
+		self.mimetype = mimetype
+		self.format = format
+		self.encoding = encoding
+		self.headers = headers if headers is not None else []
+		self.cache_key = cache_key
+		# the ViewResponse that the graph came in
+		self.view = view if view is not None else ViewResponse(graph)
+		# the Range header to answer, if ranges are enabled and If-Range matched
+		self.range_header = None
+		# the page of triples to send, and the query string to link the next one
+		self.page = None
+		self.query = None
+		# whether the body was made before this request, and is the same
+		# bytes that a resumed download started with
+		self.stored = False
+		# the status to send instead of the view's, such as a 206
+		self.status = None
+
+
+class Prenegotiation(object):
+	""" The formats decided from a request's Accept header before the view runs
+	    The view can't have returned a graph yet, so the decision is made
+	    for both kinds of graphs: mimetype and format for graphs that aren't
+	    context-aware, and context_mimetype and context_format for those
+	    that are, which may allow more formats
+	"""
+	__slots__ = ('mimetype', 'format', 'context_mimetype', 'context_format')
+
+	def __init__(self, format_selector, accepts):
+		(self.mimetype, self.format) = format_selector.decide(accepts, False)
+		(self.context_mimetype, self.context_format) = format_selector.decide(accepts, True)
+
+	def decide(self, context_aware=False):
+		""" Returns the (mimetype, format) that a graph will be sent in,
+		    like FormatSelector.decide
+		"""
+		if context_aware:
+			return (self.context_mimetype, self.context_format)
+		return (self.mimetype, self.format)
+
+	def acceptable(self):
+		""" Returns whether some graph could be sent to this client at all """
+		return self.context_mimetype is not None
 
 
 class ViewDecorator(object):
-	def __init__(self, format_selector=None):
+	def __init__(self, format_selector=None, streaming=False, chunk_size=DEFAULT_CHUNK_SIZE,
+	             cache=None, cache_key=None, etags=False,
+	             compress=False, compress_min_size=COMPRESS_MIN_SIZE, instrumentation=None,
+	             parallel=None, ranges=False, page_size=None, page_parameter='page',
+	             prenegotiate=False, max_age=None, stale_while_revalidate=0,
+	             coalesce_key=None, coalesce_timeout=10.0):
 		self.format_selector = format_selector
 		if self.format_selector is None:
 			self.format_selector = FormatSelector()
+		# whether to send the serialization in chunks as it is generated
+		self.streaming = streaming
+		self.chunk_size = chunk_size
+		# ResponseCache of serialized graphs
+		self.cache = cache
+		# function of the view's arguments that identifies its graph
+		self.cache_key = cache_key
+		# whether to send ETags and answer If-None-Match with 304s
+		self.etags = etags
+		# whether to negotiate Accept-Encoding and compress big enough bodies
+		self.compress = compress
+		self.compress_min_size = compress_min_size
+		# Instrumentation to record the ResponseStats of graph responses
+		self.instrumentation = instrumentation
+		# ParallelSerializer for big graphs, or None to serialize on one core
+		self.parallel = parallel
+		# whether to answer Range requests for serialized bodies
+		self.ranges = ranges
+		# triples per page of line-based formats, or None to send whole graphs
+		self.page_size = page_size
+		self.page_parameter = page_parameter
+		# whether to negotiate before the view runs, answering 406s and
+		# cache hits without it
+		self.prenegotiate = prenegotiate
+		# seconds that cached serializations are fresh for, and then
+		# sent stale for while the view runs again in the background
+		self.max_age = max_age
+		self.stale_while_revalidate = stale_while_revalidate
+		if max_age is not None and cache is not None and not isinstance(cache, TTLResponseCache):
+			self.cache = TTLResponseCache(cache, max_age + stale_while_revalidate)
+		self.revalidator = Revalidator()
+		# function of the view's arguments that identifies the requests
+		# whose concurrent view calls and serializations are shared
+		self.coalesce_key = coalesce_key
+		self.flights = SingleFlight(coalesce_timeout)
 
 	@classmethod
 	def is_graph(cls, obj):
-		""" Check whether this object is an rdflib Graph """
-		return isinstance(obj, Graph)
+		""" Check whether this object is an rdflib Graph, or a LazyGraph """
+		return is_graph(obj)
 
 	@classmethod
-	def get_graph(cls, response):
-		""" Given a view response, find the rdflib Graph, or None """
+	def classify(cls, response):
+		""" Given a view response, return its ViewResponse if it holds an
+		    rdflib Graph, or else None
+		"""
 		if cls.is_graph(response):	# single graph object
+			return ViewResponse(response)
+
+	def _classified(self, response):
+		""" Returns the ViewResponse of a response, unless decorate() already found it """
+		if isinstance(response, ViewResponse):
 			return response
+		return self.classify(response)
+
+	@classmethod
+	def get_graph(cls, response):
+		""" Given a view response, find the rdflib Graph, or None """
+		view = cls.classify(response)
+		if view is not None:
+			return view.graph
 
 	@classmethod
 	def replace_graph(cls, response, serialized):
@@ -29,7 +568,29 @@ class ViewDecorator(object):
 
 	@classmethod
 	def make_new_response(cls, old_response, mimetype, serialized):
-		""" Return a new framework-specific response with the seralized data """
+		""" Return a new framework-specific response with the seralized data
+		    old_response is what the view returned, or None for a response
+		    from the cache, before the view ran
+		    In streaming mode, serialized is an iterator of byte chunks
+		"""
+		raise NotImplementedError
+
+	@classmethod
+	def update_response(cls, response, headers=(), status=None):
+		""" Set extra headers on a response from make_new_response, and
+		    the status instead of the view's, if there is one
+		    headers is a list of (header, value) pairs, and the response
+		    is only updated when an option such as etags or compress
+		    adds some
+		"""
+		raise NotImplementedError
+
+	@classmethod
+	def make_304_response(cls, view, headers=()):
+		""" Return the framework-specific HTTP 304 Not Modified response
+		    view is the ViewResponse that the view returned
+		    headers is a list of extra (header, value) pairs to set
+		"""
 		raise NotImplementedError
 
 	@classmethod
@@ -37,48 +598,418 @@ class ViewDecorator(object):
 		""" Return the framework-specific HTTP 406 error """
 		raise NotImplementedError
 
+	@classmethod
+	def make_503_response(cls):
+		""" Return the framework-specific HTTP 503 error, for a Snapshot
+		    that has no published version to send yet
+		"""
+		raise NotImplementedError
+
 	@classmethod
 	def get_accept(cls):
 		""" Load the framework-specific Accept header """
 		raise NotImplementedError
 
-	def output(self, response, accepts):
+	@classmethod
+	def get_accept_encoding(cls):
+		""" Load the framework-specific Accept-Encoding header """
+		raise NotImplementedError
+
+	@classmethod
+	def get_if_none_match(cls):
+		""" Load the framework-specific If-None-Match header of a GET or HEAD """
+		raise NotImplementedError
+
+	@classmethod
+	def get_range(cls):
+		""" Load the framework-specific (Range, If-Range) headers of a GET """
+		raise NotImplementedError
+
+	@classmethod
+	def get_query_string(cls):
+		""" Load the framework-specific query string of the request """
+		raise NotImplementedError
+
+	@classmethod
+	def set_negotiation(cls, negotiation):
+		""" Store the Prenegotiation in the framework-specific request context """
+		raise NotImplementedError
+
+	@classmethod
+	def in_background(cls, func):
+		""" Wrap a function to run on another thread with the framework-specific
+		    context of this request
+		"""
+		return func
+
+	def negotiate(self, response, accepts, cache_key=None, if_none_match=None, accept_encoding=None,
+	              range_header=None, if_range=None, query=None):
+		""" Decides how to answer a view response
+		    Returns a Negotiated if the response holds a graph to serialize,
+		    or else the final response: the unmodified view response,
+		    a 406, a 503 for an unpublished Snapshot, or a 304 if
+		    if_none_match matches the ETag
+		"""
+		view = self._classified(response)
+		if view is None:
+			return response
+		graph = view.graph
+		if graph is None:
+			return self.make_503_response()
+
+		# decide the format
+		mimetype, format = self.format_selector.decide(accepts, graph.context_aware)
+
+		# requested content couldn't find anything
+		if mimetype is None:
+			return self.make_406_response()
+
+		# explicitly mark text mimetypes as utf-8
+		if 'text' in mimetype:
+			mimetype = mimetype + '; charset=utf-8'
+
+		negotiated = Negotiated(graph, mimetype, format, cache_key=cache_key, view=view)
+		headers = negotiated.headers
+		if self.page_size is not None:
+			from .ntriples import line_formats
+			if format in line_formats:
+				negotiated.page = parse_page(query, self.page_parameter)
+				negotiated.query = query
+		if self.compress:
+			negotiated.encoding = self.format_selector.decide_encoding(accept_encoding)
+			headers.append(('Vary', 'Accept, Accept-Encoding'))
+		if self.max_age is not None:
+			headers.append(('Cache-Control', cache_control(self.max_age, self.stale_while_revalidate)))
+		etag = None
+		fingerprint = known_fingerprint(graph, cache_key) if self.etags else None
+		if fingerprint is not None:
+			etag = make_etag(fingerprint, mimetype, negotiated.encoding, negotiated.page)
+			headers.append(('ETag', etag))
+			if etag_matches(if_none_match, etag):
+				return self.make_304_response(view, headers)
+		if self.ranges and (if_range is None or if_range == etag):
+			# If-Range only matches a strong ETag, so without ETags the whole body is sent
+			negotiated.range_header = range_header
+		return negotiated
+
+	def get_serializer(self, format):
+		""" Returns the function that serializes a graph to bytes in this
+		    format, or None to use the graph's own serialize()
+		"""
+		return self.format_selector.get_serializer(format)
+
+	def serialize(self, negotiated):
+		""" Serializes the negotiated graph, or loads it from the cache
+		    Only the negotiated page is serialized, if there is one
+		"""
+		if negotiated.page is not None:
+			from .ntriples import serialize_page
+			return self.add_page_link(negotiated, serialize_page(negotiated.graph, negotiated.format,
+			                          (negotiated.page - 1) * self.page_size, self.page_size))
+		(serialized, cache_key) = stored_serialization(negotiated.graph, negotiated.format, self.cache,
+		                                               negotiated.cache_key)
+		if serialized is not None:
+			negotiated.stored = True
+			return serialized
+		chunk_size = self.chunk_size if self.streaming else None
+		serializer = self.get_serializer(negotiated.format)
+		return render_graph(negotiated.graph, negotiated.format, self.cache, cache_key, chunk_size,
+		                    serializer, self.parallel)
+
+	def compress_body(self, negotiated, serialized):
+		""" Compresses the serialized graph with the negotiated encoding
+		    Adds the Content-Encoding to the negotiated headers if it was compressed
+		"""
+		if negotiated.encoding is not None:
+			return self.encoded(negotiated, encode_body(serialized, negotiated.encoding, self.compress_min_size))
+		return serialized
+
+	def encoded(self, negotiated, encoded):
+		""" Takes the (body, encoding) of encode_body as the negotiated body
+		    Adds the Content-Encoding to the negotiated headers if it was compressed
+		"""
+		(serialized, encoding) = encoded
+		negotiated.encoding = None
+		if encoding is not None:
+			negotiated.headers = negotiated.headers + [('Content-Encoding', encoding)]
+		return serialized
+
+	def add_page_link(self, negotiated, page):
+		""" Links the next page of a (serialized, more) page, and returns the serialized page """
+		(serialized, more) = page
+		if more:
+			link = page_link(negotiated.query, self.page_parameter, negotiated.page + 1)
+			negotiated.headers = negotiated.headers + [('Link', link)]
+		return serialized
+
+	def range_body(self, negotiated, serialized):
+		""" Selects the requested range of a serialized body, if ranges are enabled
+		    Only stored bodies, from the cache or a Snapshot, are sliced, since
+		    serializing the graph again may order its triples differently
+		    Bodies that are streamed aren't seekable, and are sent whole
+		    Adds Accept-Ranges and Content-Range to the negotiated headers, and
+		    the 206 or 416 status to the negotiated view
+		"""
+		if not self.ranges or not isinstance(serialized, six.binary_type):
+			return serialized
+		if not negotiated.stored:
+			if self.cache is not None:
+				# the next request can resume from the cached body
+				negotiated.headers = negotiated.headers + [('Accept-Ranges', 'bytes')]
+			return serialized
+		(status, serialized, content_range) = select_range(serialized, negotiated.range_header)
+		headers = negotiated.headers + [('Accept-Ranges', 'bytes')]
+		if status is not None:
+			headers.append(('Content-Range', content_range))
+			negotiated.status = status
+		negotiated.headers = headers
+		return serialized
+
+	def respond(self, response, negotiated, serialized, stats=NULL_STATS):
+		""" Compresses the serialized graph and builds the framework response
+		    stats times the compress and respond phases, and is recorded
+		"""
+		serialized = self.compress_body(negotiated, serialized)
+		serialized = self.range_body(negotiated, serialized)
+		stats.lap('compress')
+		serialized = stats.measure(serialized)
+		view = negotiated.view
+		old_response = view.response if view is not None else None
+		new_response = self.make_new_response(old_response, negotiated.mimetype, serialized)
+		if negotiated.headers or negotiated.status is not None:
+			new_response = self.update_response(new_response, negotiated.headers, negotiated.status)
+		stats.lap('respond')
+		stats.record()
+		return new_response
+
+	def start_negotiation(self, response, *request):
+		""" Negotiates a view response like negotiate(), while timing it
+		    Returns (stats, negotiated), where stats is the ResponseStats
+		    to keep timing the response with, or NULL_STATS without an
+		    instrumentation, and negotiated is None if the response
+		    doesn't hold a graph
+		    Responses other than Negotiated ones are already recorded
+		"""
+		view = self._classified(response)
+		if view is None:
+			return (NULL_STATS, None)
+		if view.graph is None:
+			# an unpublished Snapshot has no triples to time
+			return (NULL_STATS, self.negotiate(view, *request))
+		stats = start_stats(view.graph, self.instrumentation)
+		negotiated = self.negotiate(view, *request)
+		stats.lap('negotiate')
+		if isinstance(negotiated, Negotiated):
+			stats.set_format(negotiated.format, negotiated.mimetype)
+		else:
+			stats.record()
+		return (stats, negotiated)
+
+	def output(self, response, accepts, cache_key=None, if_none_match=None, accept_encoding=None,
+	           range_header=None, if_range=None, query=None):
 		""" Formats a response from a view to handle any RDF graphs
 		    If a view function returns an RDF graph, serialize it based on Accept header
 		    If it's not an RDF graph, return it without any special handling
+		    cache_key identifies the graph in the cache and its ETag
+		    if_none_match is checked against the ETag, if they are enabled
+		    accept_encoding picks the compression, if it is enabled
+		    range_header selects the bytes to send, if ranges are enabled,
+		    unless if_range doesn't match the ETag
+		    query holds the page to send, if pagination is enabled
+		    The phases are timed if there is an instrumentation
 		"""
-		graph = self.get_graph(response)
-		if graph is not None:
-			# decide the format
-			mimetype, format = self.format_selector.decide(accepts, graph.context_aware)
+		(stats, negotiated) = self.start_negotiation(response, accepts, cache_key, if_none_match,
+		                                             accept_encoding, range_header, if_range, query)
+		if negotiated is None:
+			return response
+		if not isinstance(negotiated, Negotiated):
+			return negotiated
+		serialized = self.serialize(negotiated)
+		stats.lap('serialize')
+		return self.respond(response, negotiated, serialized, stats)
 
-			# requested content couldn't find anything
-			if mimetype is None:
+	def prenegotiate_request(self, accepts, cache_key=None, if_none_match=None, accept_encoding=None,
+	                         range_header=None, if_range=None, query=None, refresh=None):
+		""" Negotiates a request before its view runs, in prenegotiate
+		    mode or with a max_age
+		    In prenegotiate mode, stores the Prenegotiation for the view
+		    with set_negotiation, and returns a 406 if no graph could be sent
+		    Returns a response from the cache if there is one, or else
+		    None to run the view
+		"""
+		negotiation = Prenegotiation(self.format_selector, accepts)
+		if self.prenegotiate:
+			if not negotiation.acceptable():
 				return self.make_406_response()
+			self.set_negotiation(negotiation)
+		return self.respond_cached(negotiation, cache_key, accept_encoding, range_header, if_range, query,
+		                           refresh)
 
-			# explicitly mark text mimetypes as utf-8
-			if 'text' in mimetype:
-				mimetype = mimetype + '; charset=utf-8'
-
-			# format the new response
-			serialized = graph.serialize(format=format)
-			response = self.make_new_response(response, mimetype, serialized)
-			return response
+	def respond_cached(self, negotiation, cache_key, accept_encoding=None, range_header=None, if_range=None,
+	                   query=None, refresh=None):
+		""" Answers a prenegotiated request from the cache, without a graph
+		    Needs a cache_key, since there's no graph to take one from, and
+		    isn't used with ETags, which a Rendition's fingerprint may give
+		    The cached body is sent with a 200, without any status or
+		    headers that the view would have returned
+		    A stale body is sent too, and refresh() is started in the
+		    background to cache a new one, unless it is already running
+		    Returns None if the request can't be answered from the cache
+		"""
+		if self.cache is None or cache_key is None or self.etags:
+			return None
+		# the context-aware format is either the same as the other one,
+		# or one that only context-aware graphs are cached in, so it
+		# matches whichever graph the view would return
+		(mimetype, format) = negotiation.decide(True)
+		if format is None:
+			return None
+		if self.page_size is not None:
+			from .ntriples import line_formats
+			if format in line_formats:
+				return None
+		key = make_cache_key(None, format, cache_key)
+		if self.max_age is not None:
+			(serialized, age) = self.cache.lookup(key)
+			if serialized is not None and age > self.max_age and refresh is not None:
+				self.revalidator.start(key, self.in_background(refresh))
 		else:
-			return response
+			serialized = self.cache.get(key)
+		if serialized is None:
+			return None
+		if 'text' in mimetype:
+			mimetype = mimetype + '; charset=utf-8'
+		negotiated = Negotiated(None, mimetype, format, cache_key=cache_key)
+		negotiated.stored = True
+		if self.compress:
+			negotiated.encoding = self.format_selector.decide_encoding(accept_encoding)
+			negotiated.headers.append(('Vary', 'Accept, Accept-Encoding'))
+		if self.max_age is not None:
+			negotiated.headers.append(('Cache-Control', cache_control(self.max_age, self.stale_while_revalidate)))
+		if self.ranges and if_range is None:
+			negotiated.range_header = range_header
+		return self.respond(None, negotiated, serialized)
+
+	def read_request(self, *args, **kwargs):
+		""" Loads the request details that output() needs for a view call
+		    Returns (accepts, cache_key, if_none_match, accept_encoding,
+		    range_header, if_range, query)
+		"""
+		accept = self.get_accept()
+		cache_key = None
+		if self.cache_key is not None:
+			cache_key = self.cache_key(*args, **kwargs)
+		if_none_match = None
+		if self.etags:
+			if_none_match = self.get_if_none_match()
+		accept_encoding = None
+		if self.compress:
+			accept_encoding = self.get_accept_encoding()
+		(range_header, if_range) = (None, None)
+		if self.ranges:
+			(range_header, if_range) = self.get_range()
+		query = None
+		if self.page_size is not None:
+			query = self.get_query_string()
+		return (accept, cache_key, if_none_match, accept_encoding, range_header, if_range, query)
+
+	def run_view(self, view, args, kwargs):
+		""" Calls the view to refresh its cached serialization """
+		return view(*args, **kwargs)
+
+	def refresh(self, view, args, kwargs, accepts, cache_key):
+		""" Runs the view again and caches its graph in the negotiated format,
+		    replacing a stale serialization
+		"""
+		classified = self.classify(self.run_view(view, args, kwargs))
+		if classified is None or classified.graph is None:
+			return
+		graph = classified.graph
+		(mimetype, format) = self.format_selector.decide(accepts, graph.context_aware)
+		if format is None:
+			return
+		serializer = self.get_serializer(format)
+		serialized = serialize_graph(graph, format, serializer=serializer, parallel=self.parallel)
+		self.cache.set(make_cache_key(graph, format, cache_key), serialized)
+
+	def flight_key(self, accepts, *args, **kwargs):
+		""" Returns the key of the requests that a view response is shared by:
+		    the coalesce_key and the formats that the Accept header decides
+		"""
+		negotiation = Prenegotiation(self.format_selector, accepts)
+		return '%s %s %s' % (self.coalesce_key(*args, **kwargs), negotiation.format, negotiation.context_format)
+
+	def share(self, view, accepts, cache_key=None):
+		""" Serializes a ViewResponse's graph in the negotiated format, for
+		    the requests that are coalesced with this one
+		    Returns a ViewResponse of the graph with its serialization
+		"""
+		graph = view.graph
+		if graph is None:
+			return view
+		(mimetype, format) = self.format_selector.decide(accepts, graph.context_aware)
+		if format is not None and self.page_size is not None:
+			from .ntriples import line_formats
+			if format in line_formats:
+				format = None
+		serializer = self.get_serializer(format)
+		serialize = lambda graph: serialize_graph(graph, format, self.cache, cache_key, None, serializer, self.parallel)
+		return ViewResponse(share_graph(graph, format, serialize), view.status, view.headers, view.response)
+
+	def run_coalesced(self, view, args, kwargs, accepts, cache_key=None):
+		""" Runs the view once for the concurrent requests with the same
+		    flight_key, and serializes its graph once for them
+		    Returns the ViewResponse, or the view's response if it isn't a graph
+		"""
+		key = self.flight_key(accepts, *args, **kwargs)
+		(flight, leader) = self.flights.begin(key)
+		if not leader:
+			shared = self.flights.wait(flight)
+			if shared is not None:
+				return shared
+			response = self.run_view(view, args, kwargs)
+			return self.classify(response) or response
+		shared = None
+		try:
+			response = self.run_view(view, args, kwargs)
+			classified = self.classify(response)
+			if classified is None:
+				return response
+			shared = self.share(classified, accepts, cache_key)
+			return shared
+		finally:
+			self.flights.finish(key, flight, shared)
 
 	def decorate(self, view):
 		""" Wraps a view function to return formatted RDF graphs
 		    Uses content negotiation to serialize the graph to the client-preferred format
 		    Passes other content through unmodified
 		"""
-		from functools import wraps
+		from functools import partial, wraps
 
 		@wraps(view)
 		def decorated(*args, **kwargs):
+			request = None
+			if self.prenegotiate or self.max_age is not None:
+				request = self.read_request(*args, **kwargs)
+				refresh = partial(self.refresh, view, args, kwargs, request[0], request[1])
+				early = self.prenegotiate_request(*request, refresh=refresh)
+				if early is not None:
+					return early
+			if self.coalesce_key is not None:
+				if request is None:
+					request = self.read_request(*args, **kwargs)
+				classified = self.run_coalesced(view, args, kwargs, request[0], request[1])
+				if not isinstance(classified, ViewResponse):
+					return classified
+				return self.output(classified, *request)
 			response = view(*args, **kwargs)
-			accept = self.get_accept()
-			return self.output(response, accept)
+			classified = self.classify(response)
+			if classified is None:
+				return response
+			if request is None:
+				request = self.read_request(*args, **kwargs)
+			return self.output(classified, *request)
 		return decorated
 
 	def __call__(self, view):
@@ -1,19 +1,32 @@
 from __future__ import absolute_import
-from .common_decorators import ViewDecorator
-from rdflib.graph import Graph
+from .common_decorators import ViewDecorator, ViewResponse, NEGOTIATION_KEY
+import six
+import sys
 
 
 class Decorator(ViewDecorator):
 	@classmethod
-	def get_graph(cls, response):
-		""" Given a Flask response, find the rdflib Graph """
+	def classify(cls, response):
+		""" Given a Flask response, find the rdflib Graph with the
+		    status and headers of a (body, status, headers),
+		    (body, status) or (body, headers) tuple
+		"""
+		if type(response) is tuple:
+			if not response or not cls.is_graph(response[0]):
+				return None
+			size = len(response)
+			if size == 3:
+				return ViewResponse(response[0], response[1], response[2], response)
+			if size == 2:
+				# like Flask, anything but a status is taken as headers
+				if isinstance(response[1], six.integer_types + six.string_types):
+					return ViewResponse(response[0], response[1], response=response)
+				return ViewResponse(response[0], headers=response[1], response=response)
+			if size == 1:
+				return ViewResponse(response[0], response=response)
+			return None
 		if cls.is_graph(response):	# single graph object
-			return response
-
-		if hasattr(response, '__getitem__'):	# indexable tuple
-			if len(response) > 0 and \
-			   cls.is_graph(response[0]):	# graph object
-				return response[0]
+			return ViewResponse(response)
 
 	@classmethod
 	def replace_graph(cls, response, serialized):
@@ -21,30 +34,111 @@ class Decorator(ViewDecorator):
 		if cls.is_graph(response):	# single graph object
 			return serialized
 
-		if hasattr(response, '__getitem__'):	# indexable tuple
-			if len(response) > 0 and \
-			   cls.is_graph(response[0]):	# graph object
-				return (serialized,) + response[1:]
+		if type(response) is tuple and cls.classify(response) is not None:
+			return (serialized,) + response[1:]
 		return response
 
 	@classmethod
 	def make_new_response(cls, old_response, mimetype, serialized):
 		from flask import make_response
-		final_output = cls.replace_graph(old_response, serialized)
+		final_output = serialized
+		if old_response is not None:
+			final_output = cls.replace_graph(old_response, serialized)
+		if type(final_output) is tuple and len(final_output) == 1:
+			# Flask only takes tuples of two or three
+			final_output = final_output[0]
 		response = make_response(final_output)
 		response.headers['Content-Type'] = mimetype
 		response.headers['Vary'] = 'Accept'
 		return response
 
+	@classmethod
+	def update_response(cls, response, headers=(), status=None):
+		if status is not None:
+			response.status_code = status
+		for header, value in headers:
+			response.headers[header] = value
+		return response
+
+	@classmethod
+	def make_304_response(cls, view, headers=()):
+		from flask import current_app
+		response = current_app.response_class(b'', status=304, headers=view.headers)
+		response.headers['Vary'] = 'Accept'
+		for header, value in headers:
+			response.headers[header] = value
+		return response
+
 	@classmethod
 	def make_406_response(cls):
 		return '406 Not Acceptable', 406
 
+	@classmethod
+	def make_503_response(cls):
+		return '503 Service Unavailable', 503
+
 	@classmethod
 	def get_accept(cls):
 		from flask import request
 		return request.headers.get('Accept', '')
 
+	@classmethod
+	def get_accept_encoding(cls):
+		from flask import request
+		return request.headers.get('Accept-Encoding', '')
+
+	@classmethod
+	def get_if_none_match(cls):
+		from flask import request
+		if request.method not in ('GET', 'HEAD'):
+			return None
+		return request.headers.get('If-None-Match')
+
+	@classmethod
+	def get_range(cls):
+		from flask import request
+		if request.method != 'GET':
+			return (None, None)
+		return (request.headers.get('Range'), request.headers.get('If-Range'))
+
+	@classmethod
+	def get_query_string(cls):
+		from flask import request
+		return request.query_string.decode('latin-1')
+
+	@classmethod
+	def set_negotiation(cls, negotiation):
+		from flask import request
+		request.environ[NEGOTIATION_KEY] = negotiation
+
+	@classmethod
+	def in_background(cls, func):
+		from flask import copy_current_request_context
+		return copy_current_request_context(func)
+
+
+def _make_async_decorator():
+	""" Defines AsyncDecorator, which loads asyncio, on first use """
+	from .async_decorators import AsyncViewDecorator
+
+	class AsyncDecorator(AsyncViewDecorator, Decorator):
+		""" Decorator for async Flask views, which serializes on an executor """
+		pass
+	AsyncDecorator.__qualname__ = 'AsyncDecorator'
+	return AsyncDecorator
+
+
+def __getattr__(name):
+	""" Defines the lazy AsyncDecorator (PEP 562) """
+	if name == 'AsyncDecorator':
+		value = globals()[name] = _make_async_decorator()
+		return value
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+if (3, 5) <= sys.version_info < (3, 7):	# no module __getattr__
+	AsyncDecorator = _make_async_decorator()
+
 
 _implicit_instance = Decorator()
 
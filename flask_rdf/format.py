@@ -1,4 +1,5 @@
-import mimeparse
+from collections import OrderedDict
+import os
 
 
 DEFAULT_MIMETYPE = 'application/rdf+xml'	# default mimetype to return
@@ -13,6 +14,7 @@ formats = {
    'application/rdf+xml': 'xml',
    'application/trix': 'trix',
    'application/n-quads': 'nquads',
+   'application/trig': 'trig',
    'application/n-triples': 'nt',
    'text/n-triples': 'nt',
    'text/rdf+nt': 'nt',
@@ -20,14 +22,267 @@ formats = {
    'text/n3': 'n3',
    'text/rdf+n3': 'n3'
 }
+# the formats that only make sense for a context-aware graph
+context_formats = ('nquads', 'trig')
+
+
+def has_jsonld():
+	""" Returns whether rdflib can serialize JSON-LD, without importing rdflib
+	    It is built into rdflib 6, and the rdflib-jsonld plugin before that
+	"""
+	try:
+		from importlib.util import find_spec
+	except ImportError:	# Python 2
+		return False
+	if find_spec('rdflib_jsonld') is not None:
+		return True
+	spec = find_spec('rdflib')
+	if spec is None or spec.origin is None:
+		return False
+	return os.path.exists(os.path.join(os.path.dirname(spec.origin), 'plugins', 'serializers', 'jsonld.py'))
+
+if has_jsonld():
+	formats['application/ld+json'] = 'json-ld'
+
 # the list of any mimetypes, unlocked if we have a context
 all_mimetypes = list(formats.keys())
 # the list of mimetypes that don't require a context
-ctxless_mimetypes = [m for m in all_mimetypes if 'n-quads' not in m]
+ctxless_mimetypes = [m for m in all_mimetypes if formats[m] not in context_formats]
+# bumped whenever the module-level formats change, to invalidate caches
+_registry_version = 0
+# content codings that responses can be compressed with, by preference
+ENCODINGS = ('gzip', 'deflate')
+
+_MISSING = object()	# cache sentinel, since None is a valid cached result
+
+
+def parse_mime_type(mimetype):
+	""" Parses a mimetype or media range into (type, subtype, params)
+	    params is a dict of the ;key=value parameters
+	    Returns None if the mimetype is malformed
+	"""
+	parts = mimetype.split(';')
+	full_type = parts[0].strip()
+	if full_type == '*':
+		full_type = '*/*'
+	pieces = full_type.split('/')
+	if len(pieces) != 2:
+		return None
+	params = {}
+	for param in parts[1:]:
+		pair = param.split('=', 1)
+		if len(pair) != 2:
+			return None
+		params[pair[0].strip()] = pair[1].strip()
+	return (pieces[0].strip(), pieces[1].strip(), params)
+
+
+def parse_media_range(media_range):
+	""" Parses one Accept media range into (type, subtype, params, q)
+	    Like python-mimeparse 0.1.4, a missing, invalid, zero or
+	    out-of-range q counts as 1
+	    Returns None if the media range is malformed
+	"""
+	parsed = parse_mime_type(media_range)
+	if parsed is None:
+		return None
+	type, subtype, params = parsed
+	try:
+		q = float(params.get('q') or 1)
+	except ValueError:
+		q = 1.0
+	if not q or q > 1 or q < 0:
+		q = 1.0
+	return (type, subtype, params, q)
+
+
+def parse_accept(accepts):
+	""" Parses an Accept header into a list of (type, subtype, params, q)
+	    The ranges are kept in header order, because the first of
+	    several equally specific ranges decides the quality
+	    Malformed ranges are skipped
+	"""
+	ranges = []
+	for media_range in accepts.split(','):
+		if media_range.strip():
+			parsed = parse_media_range(media_range)
+			if parsed is not None:
+				ranges.append(parsed)
+	return ranges
+
+
+def _fitness_and_quality(type, subtype, params, ranges):
+	""" Scores one candidate against every parsed range
+	    Returns (fitness, q) of the most specific matching range,
+	    or (-1, 0) if none match
+	"""
+	best_fitness = -1
+	best_q = 0
+	for (rtype, rsubtype, rparams, q) in ranges:
+		if (rtype == type or rtype == '*' or type == '*') and \
+		   (rsubtype == subtype or rsubtype == '*' or subtype == '*'):
+			fitness = 0
+			if rtype == type:
+				fitness += 100
+			if rsubtype == subtype:
+				fitness += 10
+			for key, value in params.items():
+				if key != 'q' and rparams.get(key) == value:
+					fitness += 1
+			if fitness > best_fitness:
+				best_fitness = fitness
+				best_q = q
+	return (best_fitness, best_q)
+
+
+def best_match(table, accepts):
+	""" Picks the best candidate from a table of parsed mimetypes
+	    The table holds (mimetype, type, subtype, params) entries, where
+	    params is None for plain mimetypes, in increasing preference
+	    Candidates are ranked by how specifically the Accept header matched
+	    them, then by q, then by table position, the same as
+	    python-mimeparse 0.1.4's best_match
+	    Returns '' if nothing matched
+	"""
+	ranges = parse_accept(accepts)
+	# the first range wins among several with the same type and subtype
+	index = {}
+	for media_range in ranges:
+		key = (media_range[0], media_range[1])
+		if key not in index:
+			index[key] = media_range[3]
+
+	best = ''
+	best_fitness = -1
+	best_q = 0
+	for (mimetype, type, subtype, params) in table:
+		if params is None:
+			# a plain mimetype only depends on the most specific range
+			q = index.get((type, subtype))
+			fitness = 110
+			if q is None:
+				q = index.get((type, '*'))
+				fitness = 100
+			if q is None:
+				q = index.get(('*', subtype))
+				fitness = 10
+			if q is None:
+				q = index.get(('*', '*'))
+				fitness = 0
+			if q is None:
+				continue
+		else:
+			fitness, q = _fitness_and_quality(type, subtype, params, ranges)
+			if fitness < 0:
+				continue
+		if fitness > best_fitness or (fitness == best_fitness and q >= best_q):
+			best = mimetype
+			best_fitness = fitness
+			best_q = q
+	return best
+
+
+def parse_accept_encoding(accept_encoding):
+	""" Parses an Accept-Encoding header into a dict of coding -> q
+	    Unlike media ranges, q=0 here means the coding is not acceptable
+	"""
+	codings = {}
+	for item in accept_encoding.split(','):
+		parts = item.split(';')
+		coding = parts[0].strip().lower()
+		if not coding:
+			continue
+		q = 1.0
+		for param in parts[1:]:
+			pair = param.split('=', 1)
+			if len(pair) == 2 and pair[0].strip() == 'q':
+				try:
+					q = float(pair[1])
+				except ValueError:
+					pass
+		codings.setdefault(coding, q)
+	return codings
+
+
+def compile_table(mimetypes):
+	""" Pre-parses mimetypes into a table for best_match
+	    Mimetypes without parameters or wildcards get the fast lookup path
+	"""
+	table = []
+	for mimetype in mimetypes:
+		parsed = parse_mime_type(mimetype)
+		if parsed is None:
+			continue
+		type, subtype, params = parsed
+		params = dict((k, v) for (k, v) in params.items() if k != 'q')
+		if not params and type != '*' and subtype != '*':
+			params = None
+		table.append((mimetype, type, subtype, params))
+	return tuple(table)
+
+
+class NegotiationCache(object):
+	""" Bounded LRU cache of Accept header negotiation results
+	    Keeps hit and miss counters, like functools.lru_cache
+	"""
+	def __init__(self, maxsize=128):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._data = OrderedDict()
+
+	def get(self, key, default=None):
+		""" Returns the cached value and marks it as recently used """
+		try:
+			value = self._data.pop(key)
+		except KeyError:
+			self.misses += 1
+			return default
+		self._data[key] = value
+		self.hits += 1
+		return value
+
+	def put(self, key, value):
+		""" Stores a value, evicting the least recently used entries """
+		if self.maxsize <= 0:
+			return
+		self._data[key] = value
+		while len(self._data) > self.maxsize:
+			try:
+				self._data.popitem(last=False)
+			except KeyError:	# emptied by another thread
+				break
+
+	def clear(self):
+		""" Forgets all cached values, but keeps the counters """
+		self._data.clear()
+
+	def __len__(self):
+		return len(self._data)
+
+
+class CompiledRegistry(object):
+	""" Immutable snapshot of the module-level and instance formats
+	    Holds the precomputed candidate tuples, their parsed media ranges
+	    as best_match tables, and one merged mimetype->format map
+	    FormatSelector rebuilds it only after add_format changes a registry
+	"""
+	__slots__ = ('version', 'formats', 'candidates', 'ctxless_candidates',
+	             'ranges', 'ctxless_ranges')
+
+	def __init__(self, selector):
+		self.version = _registry_version
+		merged = dict(formats)
+		merged.update(selector.formats)	# instance formats take priority
+		self.formats = merged
+		self.candidates = tuple(all_mimetypes + selector.all_mimetypes + [WILDCARD])
+		self.ctxless_candidates = tuple(ctxless_mimetypes + selector.ctxless_mimetypes + [WILDCARD])
+		self.ranges = compile_table(self.candidates)
+		self.ctxless_ranges = compile_table(self.ctxless_candidates)
 
 
 class FormatSelector(object):
-	def __init__(self):
+	def __init__(self, cache_size=128, builtin_serializers=True, learn=0):
 		# any extra formats that we support
 		self.formats = {}
 		# the list of any mimetypes, unlocked if we have a context
@@ -38,6 +293,18 @@ class FormatSelector(object):
 		self.default_mimetype = None
 		# the wildcard mimetype to use
 		self.wildcard_mimetype = None
+		# memoized Accept header negotiation results, by context_aware
+		self._caches = (NegotiationCache(cache_size), NegotiationCache(cache_size))
+		# precompiled formats, rebuilt when the registries change
+		self._registry = None
+		# memoized Accept-Encoding negotiation results
+		self._encoding_cache = NegotiationCache(cache_size)
+		# whether to serialize N-Triples and N-Quads without rdflib's plugins
+		self.builtin_serializers = builtin_serializers
+		# precomputed decide() results by exact Accept header, by context_aware
+		self._tables = ({}, {})
+		# how many Accept headers to add to the tables as they are seen
+		self.learn = learn
 
 	def add_format(self, mimetype, format, requires_context=False):
 		""" Registers a new format to be used in a graph's serialize call
@@ -49,6 +316,94 @@ class FormatSelector(object):
 		if not requires_context:
 			self.ctxless_mimetypes.append(mimetype)
 		self.all_mimetypes.append(mimetype)
+		self._registry = None
+
+	def cache_info(self):
+		""" Returns (hits, misses, maxsize, currsize) of the negotiation cache """
+		ctxless, ctx = self._caches
+		return (ctxless.hits + ctx.hits, ctxless.misses + ctx.misses,
+		        ctxless.maxsize + ctx.maxsize, len(ctxless) + len(ctx))
+
+	def cache_clear(self):
+		""" Empties the negotiation cache """
+		for cache in self._caches:
+			cache.clear()
+
+	def get_registry(self):
+		""" Returns the CompiledRegistry of all the usable formats
+		    Recompiles it, and drops cached negotiations, if the formats changed
+		"""
+		registry = self._registry
+		if registry is None or registry.version != _registry_version:
+			registry = CompiledRegistry(self)
+			self.cache_clear()
+			self._registry = registry
+			# renegotiate the precomputed headers with the new formats
+			accepts = set(self._tables[0]) | set(self._tables[1])
+			if accepts:
+				self._tables = ({}, {})
+				self.warm(accepts)
+		return registry
+
+	def warm(self, accepts):
+		""" Precomputes decide() for each of these Accept headers
+		    Deciding one of them afterwards is a single dict lookup, for
+		    either context_aware value, until the formats change and the
+		    headers are negotiated again
+		    The default and wildcard mimetypes should be set beforehand
+		"""
+		for accept in accepts:
+			for context_aware in (False, True):
+				self._tables[context_aware][accept] = self._decide(accept, context_aware)
+
+	def export_table(self):
+		""" Returns the precomputed Accept headers and their results as a JSON-able dict
+		    import_table() loads it, to start other workers warm
+		"""
+		return {
+			'formats': self._table_formats(),
+			'ctxless': dict((a, list(d)) for (a, d) in self._tables[0].items()),
+			'context_aware': dict((a, list(d)) for (a, d) in self._tables[1].items()),
+		}
+
+	def import_table(self, table):
+		""" Loads the precomputed results from export_table()
+		    If they were computed with other formats, the headers are
+		    negotiated again instead
+		"""
+		if table.get('formats') != self._table_formats():
+			self.warm(set(table.get('ctxless', ())) | set(table.get('context_aware', ())))
+			return
+		for (context_aware, name) in ((False, 'ctxless'), (True, 'context_aware')):
+			for (accept, decided) in table.get(name, {}).items():
+				self._tables[context_aware][accept] = tuple(decided)
+
+	def _table_formats(self):
+		""" Describes everything that the precomputed results depend on """
+		registry = self.get_registry()
+		return {
+			'formats': sorted([m, f] for (m, f) in registry.formats.items()),
+			'candidates': list(registry.candidates),
+			'ctxless_candidates': list(registry.ctxless_candidates),
+			'default': self.get_default_mimetype(),
+			'wildcard': self.get_wildcard_mimetype(),
+		}
+
+	def _match(self, accepts, context_aware):
+		""" Returns the best registered mimetype for this Accept header
+		    The result may be WILDCARD, or '' if nothing matched
+		    Results are memoized until the registered formats change
+		"""
+		registry = self.get_registry()
+		cache = self._caches[1 if context_aware else 0]
+		mimetype = cache.get(accepts, _MISSING)
+		if mimetype is _MISSING:
+			if context_aware:
+				mimetype = best_match(registry.ranges, accepts)
+			else:
+				mimetype = best_match(registry.ctxless_ranges, accepts)
+			cache.put(accepts, mimetype)
+		return mimetype
 
 	def get_default_mimetype(self):
 		""" Returns the default mimetype """
@@ -83,10 +438,7 @@ class FormatSelector(object):
 			return mimetype
 
 		# pick the mimetype
-		if context_aware:
-			mimetype = mimeparse.best_match(all_mimetypes + self.all_mimetypes + [WILDCARD], accepts)
-		else:
-			mimetype = mimeparse.best_match(ctxless_mimetypes + self.ctxless_mimetypes + [WILDCARD], accepts)
+		mimetype = self._match(accepts, context_aware)
 		if mimetype == '':
 			mimetype = None
 
@@ -98,10 +450,18 @@ class FormatSelector(object):
 
 	def get_serialize_format(self, mimetype):
 		""" Get the serialization format for the given mimetype """
-		format = self.formats.get(mimetype, None)
-		if format is None:
-			format = formats.get(mimetype, None)
-		return format
+		return self.get_registry().formats.get(mimetype, None)
+
+	def get_serializer(self, format):
+		""" Returns a function that serializes a graph to bytes in this format,
+		    or None if the graph's own serialize() should be used
+		    Prefers flask_rdf's N-Triples and N-Quads serializers, which
+		    write the same bytes as rdflib's
+		"""
+		if not self.builtin_serializers:
+			return None
+		from .ntriples import serializers
+		return serializers.get(format)
 
 	def decide(self, accepts, context_aware=False):
 		""" Returns what (mimetype,format) the client wants to receive
@@ -112,7 +472,21 @@ class FormatSelector(object):
 		    An Accept with */* use rdf+xml unless a better match is found
 		    An Accept that doesn't match anything will return (None,None)
 		    context_aware=True will allow nquad serialization
+		    Headers given to warm() are looked up in the precomputed table
 		"""
+		table = self._tables[1 if context_aware else 0]
+		decided = table.get(accepts)
+		if decided is not None:
+			registry = self._registry
+			if registry is not None and registry.version == _registry_version:
+				return decided
+		decided = self._decide(accepts, context_aware)
+		if len(table) < self.learn and accepts is not None:
+			table[accepts] = decided
+		return decided
+
+	def _decide(self, accepts, context_aware):
+		""" Negotiates the (mimetype,format) for decide() """
 		mimetype = self.decide_mimetype(accepts, context_aware)
 		# return what format to serialize as
 		if mimetype is not None:
@@ -125,9 +499,33 @@ class FormatSelector(object):
 		""" Returns whether this client's Accept header indicates
 		    that the client wants to receive RDF
 		"""
-		mimetype = mimeparse.best_match(all_mimetypes + self.all_mimetypes + [WILDCARD], accepts)
+		mimetype = self._match(accepts, True)
 		return mimetype and mimetype != WILDCARD
 
+	def decide_encoding(self, accept_encoding):
+		""" Returns which content coding the client prefers, from ENCODINGS
+		    Returns None if the body should be sent uncompressed
+		"""
+		if not accept_encoding:
+			return None
+		encoding = self._encoding_cache.get(accept_encoding, _MISSING)
+		if encoding is _MISSING:
+			codings = parse_accept_encoding(accept_encoding)
+			wildcard = codings.get('*')
+			encoding = None
+			best_q = 0
+			for coding in ENCODINGS:
+				q = codings.get(coding, wildcard or 0)
+				if q > best_q:
+					encoding = coding
+					best_q = q
+			# identity is acceptable unless excluded, and wins if preferred
+			identity_q = codings.get('identity', 1 if wildcard is None else wildcard)
+			if identity_q > best_q:
+				encoding = None
+			self._encoding_cache.put(accept_encoding, encoding)
+		return encoding
+
 
 _implicit_instance = FormatSelector()
 
@@ -141,10 +539,12 @@ def add_format(mimetype, format, requires_context=False):
 	global formats
 	global ctxless_mimetypes
 	global all_mimetypes
+	global _registry_version
 	formats[mimetype] = format
 	if not requires_context:
 		ctxless_mimetypes.append(mimetype)
 	all_mimetypes.append(mimetype)
+	_registry_version += 1
 
 def decide(accepts, context_aware=False):
 	return _implicit_instance.decide(accepts, context_aware)
@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+import threading
+from timeit import default_timer as timer
+import six
+from .lazy import graph_size
+
+
+class ResponseStats(object):
+	""" Measurements of one graph response
+	    timings maps each phase to the seconds it took: negotiate,
+	    serialize, compress and respond, and stream for the time a
+	    streamed body took to be sent
+	    format is None if the negotiation answered with a 406 or 304,
+	    and size counts the bytes of the body as it was sent
+	    triples is None for a LazyGraph, which isn't counted up front
+	    The decorators pass them to the instrumentation's record() once
+	    the response is sent
+	"""
+	__slots__ = ('triples', 'format', 'mimetype', 'size', 'timings', 'instrumentation', '_last', '_streamed')
+
+	def __init__(self, graph, instrumentation=None):
+		self._last = timer()
+		self.triples = graph_size(graph)
+		self.format = None
+		self.mimetype = None
+		self.size = None
+		self.timings = {}
+		self.instrumentation = instrumentation
+		self._streamed = False
+
+	def lap(self, phase):
+		""" Records the time since the previous lap as this phase """
+		now = timer()
+		self.timings[phase] = self.timings.get(phase, 0) + now - self._last
+		self._last = now
+
+	def set_format(self, format, mimetype):
+		""" Records the negotiated format and mimetype """
+		self.format = format
+		self.mimetype = mimetype
+
+	def measure(self, serialized):
+		""" Records the size of the body to send, and returns it
+		    A streamed body is wrapped to be recorded once it ends
+		"""
+		self.size = body_size(serialized)
+		if self.size is None:
+			self._streamed = True
+			return record_stream(serialized, self, self.instrumentation)
+		return serialized
+
+	def record(self):
+		""" Passes the stats to the instrumentation, unless the body is
+		    streamed, which records them once it ends
+		"""
+		if not self._streamed:
+			self.instrumentation.record(self)
+
+
+class NullStats(object):
+	""" Stands in for ResponseStats when there's no instrumentation,
+	    without measuring anything
+	"""
+	__slots__ = ()
+
+	def lap(self, phase):
+		pass
+
+	def set_format(self, format, mimetype):
+		pass
+
+	def measure(self, serialized):
+		return serialized
+
+	def record(self):
+		pass
+
+
+NULL_STATS = NullStats()
+
+
+def start_stats(graph, instrumentation):
+	""" Returns the ResponseStats to time a graph response with, or
+	    NULL_STATS if there's no instrumentation
+	"""
+	if instrumentation is None:
+		return NULL_STATS
+	return ResponseStats(graph, instrumentation)
+
+
+class Instrumentation(object):
+	""" Receives the ResponseStats of graph responses
+	    Subclasses override record(), which this base class ignores
+	    Decorators without any instrumentation skip the measurements
+	"""
+	def record(self, stats):
+		pass
+
+
+def body_size(serialized):
+	""" Returns the size of a serialized body, or None for a stream """
+	if isinstance(serialized, six.text_type):
+		return len(serialized.encode('utf-8'))
+	if isinstance(serialized, six.binary_type):
+		return len(serialized)
+	return None
+
+
+def record_stream(chunks, stats, instrumentation):
+	""" Passes a streamed body through, recording its stats once it ends """
+	size = 0
+	try:
+		for chunk in chunks:
+			size += len(chunk)
+			yield chunk
+	finally:
+		close = getattr(chunks, 'close', None)
+		if close is not None:
+			close()
+		stats.size = size
+		stats.lap('stream')
+		instrumentation.record(stats)
+
+
+DEFAULT_TIME_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+DEFAULT_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+DEFAULT_TRIPLE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+
+class Histogram(object):
+	""" Cumulative histogram with fixed bucket bounds """
+	__slots__ = ('buckets', 'counts', 'sum', 'count')
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.sum = 0
+		self.count = 0
+
+	def observe(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+		self.sum += value
+		self.count += 1
+
+
+def _format_labels(labels):
+	return ','.join('%s="%s"' % (name, value) for (name, value) in labels)
+
+
+def _format_bound(bound):
+	return repr(float(bound))
+
+
+class HistogramCollector(Instrumentation):
+	""" Keeps histograms of the ResponseStats in memory
+	    exposition() dumps them in the Prometheus text format
+	"""
+	metrics = (
+		('flask_rdf_phase_seconds', 'Seconds spent in each phase of a graph response'),
+		('flask_rdf_response_bytes', 'Size of the serialized graph responses'),
+		('flask_rdf_response_triples', 'Number of triples in the graph responses'),
+	)
+
+	def __init__(self, time_buckets=DEFAULT_TIME_BUCKETS, size_buckets=DEFAULT_SIZE_BUCKETS,
+	             triple_buckets=DEFAULT_TRIPLE_BUCKETS):
+		self.time_buckets = time_buckets
+		self.size_buckets = size_buckets
+		self.triple_buckets = triple_buckets
+		# metric name -> labels -> Histogram
+		self.histograms = dict((name, {}) for (name, help) in self.metrics)
+		self._lock = threading.Lock()
+
+	def _observe(self, name, labels, buckets, value):
+		histograms = self.histograms[name]
+		histogram = histograms.get(labels)
+		if histogram is None:
+			histogram = histograms[labels] = Histogram(buckets)
+		histogram.observe(value)
+
+	def record(self, stats):
+		format = stats.format or 'none'
+		with self._lock:
+			for phase, seconds in stats.timings.items():
+				self._observe('flask_rdf_phase_seconds', (('phase', phase), ('format', format)),
+				              self.time_buckets, seconds)
+			if stats.size is not None:
+				self._observe('flask_rdf_response_bytes', (('format', format),),
+				              self.size_buckets, stats.size)
+			if stats.triples is not None:
+				self._observe('flask_rdf_response_triples', (('format', format),),
+				              self.triple_buckets, stats.triples)
+
+	def exposition(self):
+		""" Returns the histograms in the Prometheus text exposition format """
+		lines = []
+		with self._lock:
+			for name, help in self.metrics:
+				lines.append('# HELP %s %s' % (name, help))
+				lines.append('# TYPE %s histogram' % name)
+				for labels in sorted(self.histograms[name]):
+					histogram = self.histograms[name][labels]
+					label_text = _format_labels(labels)
+					for bound, count in zip(histogram.buckets, histogram.counts):
+						lines.append('%s_bucket{%s,le="%s"} %d' % (name, label_text, _format_bound(bound), count))
+					lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, label_text, histogram.count))
+					lines.append('%s_sum{%s} %r' % (name, label_text, float(histogram.sum)))
+					lines.append('%s_count{%s} %d' % (name, label_text, histogram.count))
+		return '\n'.join(lines) + '\n'
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+
+class LazyGraph(object):
+	""" A view response of triples, or quads, that are only read as they
+	    are serialized, such as a generator over a database cursor
+	    Quads are (subject, predicate, object, context identifier) tuples,
+	    and make the graph context_aware
+	    N-Triples and N-Quads are written straight from the iterable, which
+	    is read once, in constant memory. Anything else that needs the whole
+	    graph, such as other formats, ETags or fingerprinted cache keys,
+	    loads the triples into an in-memory rdflib Graph first, and uses it
+	    from then on
+	"""
+	__slots__ = ('source', 'context_aware', 'store', '_graph')
+
+	def __init__(self, triples, context_aware=False, store='IOMemory'):
+		self.source = triples
+		self.context_aware = context_aware
+		# the rdflib store plugin to materialize the graph in
+		self.store = store
+		self._graph = None
+
+	def materialized(self):
+		""" Returns whether the triples were loaded into a Graph """
+		return self._graph is not None
+
+	def materialize(self):
+		""" Returns the rdflib Graph of the triples, loading them the first time """
+		if self._graph is None:
+			self._graph = self._load(self._take_source())
+		return self._graph
+
+	def _take_source(self):
+		""" Returns the source iterable, which can only be read once """
+		source = self.source
+		if source is None:
+			raise ValueError('The triples of this LazyGraph were already read')
+		self.source = None
+		return source
+
+	def _load(self, source):
+		if self.context_aware:
+			from rdflib import ConjunctiveGraph
+			graph = ConjunctiveGraph(self.store)
+			graph.addN((s, p, o, graph.get_context(c)) for (s, p, o, c) in source)
+			return graph
+		from rdflib import Graph
+		graph = Graph(self.store)
+		add = graph.add
+		for triple in source:
+			add(triple)
+		return graph
+
+	def stream(self):
+		""" Yields the triples, or quads, in one pass
+		    Reads the source iterable without keeping it, unless the
+		    triples were already loaded into a Graph
+		"""
+		if self._graph is None:
+			return iter(self._take_source())
+		if self.context_aware:
+			return ((s, p, o, c.identifier) for (s, p, o, c) in self._graph.quads((None, None, None)))
+		return iter(self._graph)
+
+	def __len__(self):
+		return len(self.materialize())
+
+	def __iter__(self):
+		return iter(self.materialize())
+
+	def serialize(self, *args, **kwargs):
+		return self.materialize().serialize(*args, **kwargs)
+
+	def __getattr__(self, name):
+		""" Reads anything else, such as contexts(), from the loaded Graph """
+		if name.startswith('__'):
+			raise AttributeError(name)
+		return getattr(self.materialize(), name)
+
+
+def stream_triples(graph):
+	""" Returns the triples of a graph or LazyGraph, for a single pass """
+	if isinstance(graph, LazyGraph):
+		return graph.stream()
+	return iter(graph)
+
+
+def graph_size(graph):
+	""" Returns the number of triples of a graph, or None for a LazyGraph
+	    whose triples haven't been read yet
+	"""
+	if isinstance(graph, LazyGraph) and not graph.materialized():
+		return None
+	return len(graph)
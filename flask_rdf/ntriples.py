@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+import itertools
+from rdflib.term import Literal
+# also registers the _rdflib_nt_escape codec error handler
+from rdflib.plugins.serializers.nt import _quoteLiteral
+from .lazy import LazyGraph, stream_triples
+
+
+BATCH_SIZE = 64 * 1024	# characters of lines to encode at once
+MEMO_SIZE = 100000	# terms to remember before starting over
+
+
+class TermMemo(object):
+	""" Memo table of the N-Triples form of each term
+	    Stores like IOMemory hand out the same term objects for every
+	    triple they appear in, so terms are looked up by identity:
+	    rdflib's __hash__ is too slow to win anything back, and Literals
+	    that compare equal, such as "a"@en and "a"@EN, are written
+	    differently
+	    Each entry keeps a reference to its term, so that its id isn't
+	    reused while it is in the table, and the tables are emptied when
+	    they hold more than maxsize terms, to bound their memory
+	"""
+	__slots__ = ('terms', 'objects', 'maxsize')
+
+	def __init__(self, maxsize=MEMO_SIZE):
+		self.terms = {}
+		self.objects = {}
+		self.maxsize = maxsize
+
+	def term(self, term):
+		""" Returns the form of a subject, predicate or context """
+		entry = self.terms.get(id(term))
+		if entry is not None and entry[0] is term:
+			return entry[1]
+		n3 = self.render_term(term)
+		if len(self.terms) >= self.maxsize:
+			self.terms.clear()
+		self.terms[id(term)] = (term, n3)
+		return n3
+
+	def object(self, term):
+		""" Returns the form of an object, which quotes Literals like rdflib's nt """
+		entry = self.objects.get(id(term))
+		if entry is not None and entry[0] is term:
+			return entry[1]
+		n3 = self.render_object(term)
+		if len(self.objects) >= self.maxsize:
+			self.objects.clear()
+		self.objects[id(term)] = (term, n3)
+		return n3
+
+	def render_term(self, term):
+		return term.n3()
+
+	def render_object(self, term):
+		if isinstance(term, Literal):
+			return _quoteLiteral(term)
+		return term.n3()
+
+
+def nt_rows(graph, memo=None):
+	""" Yields the N-Triples line of each triple, as text """
+	memo = memo if memo is not None else TermMemo()
+	term = memo.term
+	object = memo.object
+	for (s, p, o) in stream_triples(graph):
+		yield u'%s %s %s .\n' % (term(s), term(p), object(o))
+
+
+def nquads_rows(graph, memo=None):
+	""" Yields the N-Quads line of each quad of a context-aware graph, as text """
+	memo = memo if memo is not None else TermMemo()
+	term = memo.term
+	object = memo.object
+	if isinstance(graph, LazyGraph):
+		for (s, p, o, c) in graph.stream():
+			yield u'%s %s %s %s .\n' % (term(s), term(p), object(o), term(c))
+		return
+	for context in graph.contexts():
+		c = context.identifier.n3()
+		for (s, p, o) in context:
+			yield u'%s %s %s %s .\n' % (term(s), term(p), object(o), c)
+
+
+def encode_rows(rows, encoding, errors, batch_size=BATCH_SIZE):
+	""" Joins the rows into batches of about batch_size characters,
+	    and yields each batch encoded in one call
+	    Ends with the blank line that rdflib's serializers write
+	"""
+	batch = []
+	size = 0
+	for row in rows:
+		batch.append(row)
+		size += len(row)
+		if size >= batch_size:
+			yield u''.join(batch).encode(encoding, errors)
+			batch = []
+			size = 0
+	batch.append(u'\n')
+	yield u''.join(batch).encode(encoding, errors)
+
+
+def nt_chunks(graph, chunk_size=BATCH_SIZE):
+	""" Serializes a graph as N-Triples, in chunks of about chunk_size bytes
+	    The output is identical to rdflib's nt serializer
+	"""
+	return encode_rows(nt_rows(graph), 'ascii', '_rdflib_nt_escape', chunk_size)
+
+
+def nquads_chunks(graph, chunk_size=BATCH_SIZE):
+	""" Serializes a context-aware graph as N-Quads, in chunks of about chunk_size bytes
+	    The output is identical to rdflib's nquads serializer
+	"""
+	return encode_rows(nquads_rows(graph), 'utf-8', 'replace', chunk_size)
+
+
+def serialize_nt(graph):
+	""" Returns the N-Triples bytes of a graph """
+	return b''.join(nt_chunks(graph))
+
+
+def serialize_nquads(graph):
+	""" Returns the N-Quads bytes of a context-aware graph """
+	if not graph.context_aware:
+		raise Exception("NQuads serialization only makes sense for context-aware stores!")
+	return b''.join(nquads_chunks(graph))
+
+
+def serialize_page(graph, format, start, size):
+	""" Serializes size triples of a graph as N-Triples, or quads as N-Quads,
+	    starting from the triple at index start in the store's order
+	    The skipped triples are iterated, but not serialized
+	    Returns (bytes, more), where more tells whether triples follow
+	    The last page ends with rdflib's blank line, so that the pages
+	    concatenate into the whole serialization
+	"""
+	memo = TermMemo()
+	term = memo.term
+	object = memo.object
+	if format == 'nquads':
+		if not graph.context_aware:
+			raise Exception("NQuads serialization only makes sense for context-aware stores!")
+		if isinstance(graph, LazyGraph):
+			quads = graph.stream()
+		else:
+			quads = ((s, p, o, context.identifier) for context in graph.contexts() for (s, p, o) in context)
+		rows = [u'%s %s %s %s .\n' % (term(s), term(p), object(o), term(c))
+		        for (s, p, o, c) in itertools.islice(quads, start, start + size + 1)]
+		(encoding, errors) = ('utf-8', 'replace')
+	else:
+		rows = [u'%s %s %s .\n' % (term(s), term(p), object(o))
+		        for (s, p, o) in itertools.islice(stream_triples(graph), start, start + size + 1)]
+		(encoding, errors) = ('ascii', '_rdflib_nt_escape')
+	more = len(rows) > size
+	if more:
+		rows[size:] = [u'']
+	else:
+		rows.append(u'\n')
+	return (u''.join(rows).encode(encoding, errors), more)
+
+
+# formats that can be paginated by triples
+line_formats = ('nt', 'nquads')
+
+# serializers of whole graphs, by rdflib format name
+serializers = {
+	'nt': serialize_nt,
+	'nquads': serialize_nquads,
+}
+
+# serializers to chunks of about chunk_size bytes, by rdflib format name
+chunk_serializers = {
+	'nt': nt_chunks,
+	'nquads': nquads_chunks,
+}
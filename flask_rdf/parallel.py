@@ -0,0 +1,146 @@
+from __future__ import absolute_import
+import itertools
+from collections import deque
+import six
+from rdflib.term import BNode, Literal, URIRef, _is_valid_uri
+from rdflib.plugins.serializers.nt import _quote_encode
+from .ntriples import TermMemo
+from .lazy import LazyGraph
+
+
+PARALLEL_THRESHOLD = 200000	# triples below which a graph is serialized on one core
+PARTITION_SIZE = 25000	# triples sent to a worker at once
+WINDOW = 16	# partitions being serialized at once, which bounds the memory
+
+
+class WireMemo(TermMemo):
+	""" Memo table of the picklable wire form of each term
+	    Unpickling rdflib terms costs more than serializing them, so
+	    the workers get tuples of plain strings instead:
+	    ('<', uri), ('_', bnode id), ('"', lexical, language, datatype),
+	    or ('n3', form) for anything else, written by rdflib here
+	    Repeated terms share the same tuple, which pickle sends once
+	"""
+	__slots__ = ()
+
+	def render_term(self, term):
+		if isinstance(term, URIRef):
+			return ('<', six.text_type(term))
+		if isinstance(term, BNode):
+			return ('_', six.text_type(term))
+		return ('n3', term.n3())
+
+	def render_object(self, term):
+		if isinstance(term, Literal):
+			datatype = six.text_type(term.datatype) if term.datatype is not None else None
+			return ('"', six.text_type(term), term.language, datatype)
+		return self.render_term(term)
+
+
+def render_wire(wire):
+	""" Returns the N-Triples form of a wire term, like rdflib would write it """
+	kind = wire[0]
+	if kind == '<':
+		if not _is_valid_uri(wire[1]):
+			raise Exception('"%s" does not look like a valid URI, I cannot serialize this as N3/Turtle. Perhaps you wanted to urlencode it?' % wire[1])
+		return u'<%s>' % wire[1]
+	if kind == '_':
+		return u'_:%s' % wire[1]
+	if kind == '"':
+		(kind, lexical, language, datatype) = wire
+		encoded = _quote_encode(lexical)
+		if language:
+			if datatype:
+				raise Exception("Literal has datatype AND language!")
+			return u'%s@%s' % (encoded, language)
+		if datatype:
+			return u'%s^^<%s>' % (encoded, datatype)
+		return encoded
+	return wire[1]
+
+
+def serialize_partition(format, rows, context=None):
+	""" Serializes a partition of wire triples to bytes, in a worker
+	    Quads are written with the wire context
+	    Defined at the module level so that process pools can pickle it
+	"""
+	memo = {}
+	def render(wire):
+		form = memo.get(wire)
+		if form is None:
+			form = memo[wire] = render_wire(wire)
+		return form
+	if format == 'nquads':
+		c = render(context)
+		lines = [u'%s %s %s %s .\n' % (render(s), render(p), render(o), c) for (s, p, o) in rows]
+		return u''.join(lines).encode('utf-8', 'replace')
+	lines = [u'%s %s %s .\n' % (render(s), render(p), render(o)) for (s, p, o) in rows]
+	return u''.join(lines).encode('ascii', '_rdflib_nt_escape')
+
+
+class ParallelSerializer(object):
+	""" Serializes big graphs in N-Triples or N-Quads across an executor
+	    The triples are split into partitions of partition_size, which
+	    are serialized by the executor's workers and joined in order
+	    Graphs smaller than threshold triples aren't worth the overhead,
+	    and applies() tells the decorators to serialize them on one core
+	    Use a ProcessPoolExecutor, since the serialization holds the GIL
+	"""
+	formats = ('nt', 'nquads')
+
+	def __init__(self, executor, threshold=PARALLEL_THRESHOLD, partition_size=PARTITION_SIZE, window=WINDOW):
+		self.executor = executor
+		self.threshold = threshold
+		self.partition_size = partition_size
+		self.window = window
+
+	def applies(self, graph, format):
+		""" Returns whether this graph should be serialized in parallel """
+		if format not in self.formats:
+			return False
+		if format == 'nquads' and not graph.context_aware:
+			return False
+		if isinstance(graph, LazyGraph) and not graph.materialized():
+			return False	# streamed on one core, rather than loaded to be counted
+		return len(graph) >= self.threshold
+
+	def partitions(self, graph, format):
+		""" Yields (rows, context) partitions of wire triples """
+		memo = WireMemo()
+		term = memo.term
+		object = memo.object
+		if format == 'nquads':
+			sources = ((context, memo.term(context.identifier)) for context in graph.contexts())
+		else:
+			sources = [(graph, None)]
+		for (triples, context) in sources:
+			triples = iter(triples)
+			while True:
+				rows = [(term(s), term(p), object(o)) for (s, p, o)
+				        in itertools.islice(triples, self.partition_size)]
+				if not rows:
+					break
+				yield (rows, context)
+
+	def stream(self, graph, format, chunk_size=None):
+		""" Serializes the graph as an iterator of byte chunks, one per partition
+		    At most window partitions are serialized ahead of the consumer,
+		    and closing the iterator early cancels them
+		"""
+		pending = deque()
+		partitions = self.partitions(graph, format)
+		try:
+			for (rows, context) in partitions:
+				pending.append(self.executor.submit(serialize_partition, format, rows, context))
+				if len(pending) >= self.window:
+					yield pending.popleft().result()
+			while pending:
+				yield pending.popleft().result()
+			yield b'\n'
+		finally:
+			for future in pending:
+				future.cancel()
+
+	def serialize(self, graph, format):
+		""" Returns the serialized bytes of the graph """
+		return b''.join(self.stream(graph, format))
@@ -0,0 +1,151 @@
+from __future__ import absolute_import
+import threading
+from .format import FormatSelector
+
+
+class Rendition(object):
+	""" One published version of a Snapshot's graph, with its serializations
+	    bodies maps rdflib format names to the serialized bytes, and is
+	    empty until the version has been rendered
+	    The decorators serve a view's Snapshot from the Rendition that was
+	    current when the view returned, which acts like its graph
+	"""
+	__slots__ = ('graph', 'version', 'fingerprint', 'bodies')
+
+	def __init__(self, graph, version, fingerprint=None, bodies=None):
+		self.graph = graph
+		self.version = version
+		self.fingerprint = fingerprint
+		self.bodies = bodies if bodies is not None else {}
+
+	@property
+	def context_aware(self):
+		return self.graph.context_aware
+
+	def __len__(self):
+		return len(self.graph)
+
+	def __iter__(self):
+		return iter(self.graph)
+
+	def serialize(self, *args, **kwargs):
+		return self.graph.serialize(*args, **kwargs)
+
+	def __getattr__(self, name):
+		""" Reads anything else, such as contexts(), from the graph """
+		if name.startswith('__'):
+			raise AttributeError(name)
+		return getattr(self.graph, name)
+
+
+class Snapshot(object):
+	""" A frozen graph that is serialized once into every format that
+	    the format_selector could negotiate for it, on a background thread
+	    Views return the Snapshot, and the decorators send the precomputed
+	    bytes of the negotiated format, with a Content-Length
+	    publish() renders a new version of the graph, and swaps it in once
+	    all its formats are serialized, while requests keep getting the
+	    previous version; the first version is served live until then
+	    The graphs must not change once they are published
+	"""
+	def __init__(self, graph=None, format_selector=None, background=True):
+		self.format_selector = format_selector
+		if self.format_selector is None:
+			self.format_selector = FormatSelector()
+		# whether publish() renders on a background thread
+		self.background = background
+		self._current = None
+		self._version = 0
+		self._lock = threading.Lock()
+		if graph is not None:
+			self.publish(graph)
+
+	def current(self):
+		""" Returns the Rendition to serve now """
+		return self._current
+
+	@property
+	def version(self):
+		""" The version number of the current Rendition, counting from 1 """
+		current = self._current
+		return current.version if current is not None else 0
+
+	def formats(self, graph):
+		""" Returns the rdflib formats that could be negotiated for the graph """
+		registry = self.format_selector.get_registry()
+		candidates = registry.candidates if graph.context_aware else registry.ctxless_candidates
+		found = []
+		for mimetype in candidates:
+			format = registry.formats.get(mimetype)
+			if format is not None and format not in found:
+				found.append(format)
+		return found
+
+	def render(self, rendition):
+		""" Serializes the rendition's graph into every format, and fingerprints it
+		    Formats whose serializer fails are left out, and are
+		    serialized for each request instead
+		"""
+		from .common_decorators import graph_fingerprint
+		graph = rendition.graph
+		bodies = {}
+		for format in self.formats(graph):
+			serializer = self.format_selector.get_serializer(format)
+			try:
+				if serializer is not None:
+					bodies[format] = serializer(graph)
+				else:
+					bodies[format] = graph.serialize(format=format)
+			except Exception:
+				pass
+		rendition.fingerprint = graph_fingerprint(graph)
+		rendition.bodies = bodies
+
+	def publish(self, graph):
+		""" Publishes a new version of the graph
+		    Returns the thread that renders it, or None if it was rendered
+		    before returning
+		"""
+		with self._lock:
+			self._version += 1
+			rendition = Rendition(graph, self._version)
+			if self._current is None:
+				# serve the first version live while it renders
+				self._current = Rendition(graph, self._version)
+		if not self.background:
+			self._render_and_swap(rendition)
+			return None
+		thread = threading.Thread(target=self._render_and_swap, args=(rendition,))
+		thread.daemon = True
+		thread.start()
+		return thread
+
+	def _render_and_swap(self, rendition):
+		self.render(rendition)
+		with self._lock:
+			# a later version may have been swapped in already
+			if self._current is None or self._current.version <= rendition.version:
+				self._current = rendition
+
+
+def versioned(graph, version):
+	""" Returns a graph response whose fingerprint is a version that the
+	    view already knows, such as a revision number or a modification time
+	    The decorators use it for ETags and cache keys instead of hashing
+	    every triple, so it must change whenever the triples do
+	"""
+	return Rendition(graph, version, fingerprint='v-%s' % (version,))
+
+
+def resolve_graph(obj):
+	""" Returns the current Rendition of a Snapshot, or else the object """
+	if isinstance(obj, Snapshot):
+		return obj.current()
+	return obj
+
+
+def prerendered(graph, format):
+	""" Returns the precomputed bytes of a Rendition in a format, or None """
+	if isinstance(graph, Rendition):
+		return graph.bodies.get(format)
+	return None
@@ -0,0 +1,218 @@
+from __future__ import absolute_import
+import sys
+import threading
+import zlib
+import six
+from six.moves.queue import Queue, Full
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024	# bytes per yielded chunk
+QUEUE_SIZE = 4	# chunks buffered between the serializer and the client
+COMPRESS_MIN_SIZE = 1024	# bodies smaller than this are sent uncompressed
+COMPRESS_LEVEL = 6
+
+
+class StreamCancelled(Exception):
+	""" Raised inside the serializer thread when the client went away """
+	pass
+
+
+_DONE = object()	# end of stream marker
+
+
+class _Failure(object):
+	""" Carries an exception from the serializer thread to the consumer """
+	def __init__(self, exc_info):
+		self.exc_info = exc_info
+
+
+class QueueWriter(object):
+	""" File-like object that hands written data over to a bounded queue
+	    Small writes are coalesced into chunks of chunk_size bytes, and
+	    the writer blocks while the queue is full, so memory use stays
+	    bounded by roughly chunk_size * (QUEUE_SIZE + 1)
+	"""
+	def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, queue_size=QUEUE_SIZE):
+		self.chunk_size = chunk_size
+		self.queue = Queue(queue_size)
+		self.cancelled = False
+		self._buffer = []
+		self._buffered = 0
+
+	def write(self, data):
+		if self.cancelled:
+			raise StreamCancelled()
+		self._buffer.append(data)
+		self._buffered += len(data)
+		if self._buffered >= self.chunk_size:
+			self.flush()
+
+	def flush(self):
+		""" Sends any buffered data to the queue """
+		if self._buffer:
+			chunk = b''.join(self._buffer)
+			self._buffer = []
+			self._buffered = 0
+			self.put(chunk)
+
+	def put(self, item):
+		""" Queues an item, giving up if the consumer cancels """
+		while True:
+			if self.cancelled:
+				raise StreamCancelled()
+			try:
+				self.queue.put(item, timeout=0.1)
+				return
+			except Full:
+				pass
+
+	def cancel(self):
+		""" Stops the producer at its next write """
+		self.cancelled = True
+
+
+def iter_chunks(lines, chunk_size=DEFAULT_CHUNK_SIZE):
+	""" Coalesces an iterable of byte strings into chunks of chunk_size """
+	buffer = []
+	buffered = 0
+	for line in lines:
+		buffer.append(line)
+		buffered += len(line)
+		if buffered >= chunk_size:
+			yield b''.join(buffer)
+			buffer = []
+			buffered = 0
+	if buffer:
+		yield b''.join(buffer)
+
+
+def write_trig(graph, destination):
+	""" Writes a context-aware graph as TriG, one named graph at a time
+	    rdflib's trig serializer analyzes every context before writing
+	    anything, while this only holds the largest context in memory
+	    Each named graph is a TriG document of its own, with the prefixes
+	    it uses, and the documents concatenate into a valid TriG document
+	"""
+	from rdflib.plugins.serializers.trig import TrigSerializer
+	default = graph.default_context.identifier
+	for context in graph.contexts():
+		serializer = TrigSerializer(context)
+		serializer.default_context = default	# written as an unnamed graph
+		serializer.serialize(destination)
+
+
+# writers of context-aware graphs by named graph, by rdflib format name
+# N-Quads are already generated one context at a time by flask_rdf.ntriples
+context_writers = {
+	'trig': write_trig,
+}
+
+
+def _threaded_stream(graph, format, chunk_size, write=None):
+	""" Runs graph.serialize, or write(graph, destination), in a thread,
+	    yielding the chunks it writes
+	"""
+	writer = QueueWriter(chunk_size)
+
+	def produce():
+		try:
+			if write is not None:
+				write(graph, writer)
+			else:
+				graph.serialize(destination=writer, format=format)
+			writer.flush()
+			writer.put(_DONE)
+		except StreamCancelled:
+			pass
+		except Exception:
+			try:
+				writer.put(_Failure(sys.exc_info()))
+			except StreamCancelled:
+				pass
+
+	thread = threading.Thread(target=produce)
+	thread.daemon = True
+	thread.start()
+	try:
+		while True:
+			item = writer.queue.get()
+			if item is _DONE:
+				break
+			if isinstance(item, _Failure):
+				six.reraise(*item.exc_info)
+			yield item
+	finally:
+		writer.cancel()
+
+
+def serialize_stream(graph, format, chunk_size=DEFAULT_CHUNK_SIZE):
+	""" Serializes a graph as an iterator of byte chunks
+	    N-Triples and N-Quads are generated in the calling thread by
+	    flask_rdf.ntriples; any other format runs rdflib's serializer in a background
+	    thread that writes into a bounded queue
+	    Context-aware graphs in TriG are written one named graph at a time
+	    Closing the iterator early stops the serializer
+	"""
+	from .ntriples import chunk_serializers
+	chunks = chunk_serializers.get(format)
+	if chunks is not None:
+		return chunks(graph, chunk_size)
+	write = context_writers.get(format) if graph.context_aware else None
+	return _threaded_stream(graph, format, chunk_size, write)
+
+
+def make_compressor(encoding):
+	""" Returns a zlib compressor for the gzip or deflate content coding """
+	if encoding == 'gzip':
+		return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS)
+
+
+def compress_chunks(chunks, encoding, head=()):
+	""" Compresses an iterator of byte chunks as it is consumed
+	    The head chunks, already taken from the iterator, are sent first
+	    Closing the result also closes the source iterator
+	"""
+	compressor = make_compressor(encoding)
+	try:
+		for chunk in head:
+			data = compressor.compress(chunk)
+			if data:
+				yield data
+		for chunk in chunks:
+			data = compressor.compress(chunk)
+			if data:
+				yield data
+		yield compressor.flush()
+	finally:
+		close = getattr(chunks, 'close', None)
+		if close is not None:
+			close()
+
+
+def encode_body(serialized, encoding, min_size=COMPRESS_MIN_SIZE):
+	""" Compresses a serialized body with a content coding
+	    serialized is a byte string or an iterator of byte chunks, which
+	    is compressed as it streams once its first min_size bytes arrive
+	    Bodies smaller than min_size are left alone
+	    Returns (body, encoding), where encoding is None if uncompressed
+	"""
+	if encoding is None:
+		return (serialized, None)
+	if isinstance(serialized, six.text_type):
+		serialized = serialized.encode('utf-8')
+	if isinstance(serialized, six.binary_type):
+		if len(serialized) < min_size:
+			return (serialized, None)
+		compressor = make_compressor(encoding)
+		return (compressor.compress(serialized) + compressor.flush(), encoding)
+
+	# read enough of the stream to decide
+	head = []
+	size = 0
+	for chunk in serialized:
+		head.append(chunk)
+		size += len(chunk)
+		if size >= min_size:
+			return (compress_chunks(serialized, encoding, head), encoding)
+	return (b''.join(head), None)
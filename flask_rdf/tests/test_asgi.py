@@ -0,0 +1,123 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+from flask_rdf.asgi import returns_rdf, Decorator
+
+
+def make_graph():
+	graph = Graph('IOMemory', BNode())
+	person = URIRef('http://example.com/#person')
+	graph.add((person, RDF.type, FOAF.Person))
+	graph.add((person, FOAF.age, Literal(15, datatype=XSD.integer)))
+	return graph
+graph = make_graph()
+
+def make_ctx_graph():
+	context = URIRef('http://example.com/#root')
+	graph = ConjunctiveGraph('IOMemory', context)
+	person = URIRef('http://example.com/#person')
+	graph.add((person, RDF.type, FOAF.Person))
+	graph.add((person, FOAF.age, Literal(15, datatype=XSD.integer)))
+	return graph
+ctx_graph = make_ctx_graph()
+
+
+@returns_rdf
+async def application(scope, receive, send):
+	path = scope.get('path', '/')
+	if path == '/test':
+		return graph
+	if path == '/ctx':
+		return ctx_graph
+	if path == '/text':
+		await send({'type': 'http.response.start', 'status': 200,
+		            'headers': [(b'content-type', b'text/plain')]})
+		await send({'type': 'http.response.body', 'body': b'This is a test string'})
+		return
+	if path == '/202':
+		await send({'type': 'http.response.start', 'status': 202,
+		            'headers': [(b'customheader', b'yes'), (b'vary', b'Cookie')]})
+		return graph
+
+
+def request(app, path, accept=None, type='http'):
+	""" Calls an ASGI app, returning (status, headers dict, body chunks) """
+	headers = []
+	if accept is not None:
+		headers.append((b'accept', accept.encode('latin-1')))
+	scope = {'type': type, 'path': path, 'headers': headers}
+	messages = []
+	async def receive():
+		return {'type': 'http.request', 'body': b'', 'more_body': False}
+	async def send(message):
+		messages.append(message)
+	asyncio.run(app(scope, receive, send))
+	start = messages[0]
+	response_headers = dict((h.decode('latin-1'), v.decode('latin-1')) for (h, v) in start['headers'])
+	chunks = [m['body'] for m in messages[1:]]
+	return start['status'], response_headers, chunks, messages
+
+
+class TestAsgi(unittest.TestCase):
+	def test_format_simple(self):
+		turtle = graph.serialize(format='turtle')
+		status, headers, chunks, messages = request(application, '/test', 'text/n3;q=0.5, text/turtle;q=0.9')
+		self.assertEqual(200, status)
+		self.assertEqual('text/turtle; charset=utf-8', headers['content-type'])
+		self.assertEqual('Accept', headers['vary'])
+		self.assertEqual(turtle, b''.join(chunks))
+		self.assertTrue(all(m['more_body'] for m in messages[1:-1]))
+		self.assertFalse(messages[-1]['more_body'])
+
+	def test_format_unacceptable(self):
+		status, headers, chunks, messages = request(application, '/test', 'text/html;q=0.9')
+		self.assertEqual(406, status)
+
+	def test_format_quads_context(self):
+		quads = ctx_graph.serialize(format='nquads')
+		status, headers, chunks, messages = request(application, '/ctx', 'application/n-quads')
+		self.assertEqual('application/n-quads', headers['content-type'])
+		self.assertEqual(quads, b''.join(chunks))
+
+	def test_empty_format_headers(self):
+		xml = graph.serialize(format='xml')
+		status, headers, chunks, messages = request(application, '/test')
+		self.assertEqual('application/rdf+xml', headers['content-type'])
+		self.assertEqual(xml, b''.join(chunks))
+
+	def test_text(self):
+		status, headers, chunks, messages = request(application, '/text', 'text/turtle')
+		self.assertEqual(200, status)
+		self.assertEqual('text/plain', headers['content-type'])
+		self.assertEqual([b'This is a test string'], chunks)
+
+	def test_custom_response(self):
+		turtle = graph.serialize(format='turtle')
+		status, headers, chunks, messages = request(application, '/202', 'text/turtle')
+		self.assertEqual(202, status)
+		self.assertEqual('yes', headers['customheader'])
+		self.assertEqual('Cookie, Accept', headers['vary'])
+		self.assertEqual(turtle, b''.join(chunks))
+
+	def test_chunks(self):
+		with ThreadPoolExecutor(1) as executor:
+			decorator = Decorator(chunk_size=16, executor=executor)
+			app = decorator(lambda scope, receive, send: asyncio.sleep(0, graph))
+			nt = graph.serialize(format='nt')
+			status, headers, chunks, messages = request(app, '/', 'application/n-triples')
+			self.assertTrue(len(chunks) > 2)
+			self.assertEqual(nt, b''.join(chunks))
+
+	def test_lifespan(self):
+		calls = []
+		async def app(scope, receive, send):
+			calls.append(scope['type'])
+			await send({'type': 'lifespan.startup.complete'})
+		sent = []
+		async def send(message):
+			sent.append(message)
+		asyncio.run(returns_rdf(app)({'type': 'lifespan'}, None, send))
+		self.assertEqual(['lifespan'], calls)
+		self.assertEqual([{'type': 'lifespan.startup.complete'}], sent)
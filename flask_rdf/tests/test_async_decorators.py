@@ -0,0 +1,150 @@
+import asyncio
+import unittest
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import webtest
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+import flask
+from flask_rdf.async_decorators import AsyncViewDecorator
+from flask_rdf.common_decorators import LRUResponseCache
+from flask_rdf.flask import AsyncDecorator
+from flask_rdf.snapshot import versioned
+
+
+def make_graph():
+	graph = Graph('IOMemory', BNode())
+	person = URIRef('http://example.com/#person')
+	graph.add((person, RDF.type, FOAF.Person))
+	graph.add((person, FOAF.age, Literal(15, datatype=XSD.integer)))
+	return graph
+graph = make_graph()
+
+
+class PlainDecorator(AsyncViewDecorator):
+	""" Framework-free decorator that returns (mimetype, body, headers) """
+	accept = 'text/turtle'
+	@classmethod
+	def make_new_response(cls, old_response, mimetype, serialized):
+		return (mimetype, serialized, [])
+	@classmethod
+	def update_response(cls, response, headers=(), status=None):
+		return (response[0], response[1], response[2] + list(headers))
+	@classmethod
+	def make_406_response(cls):
+		return 406
+	def get_accept(self):
+		return self.accept
+	@classmethod
+	def get_accept_encoding(cls):
+		return 'gzip'
+
+
+executor = ThreadPoolExecutor(2)
+application = flask.Flask(__name__)
+@application.route('/async')
+@AsyncDecorator(executor=executor)
+async def async_view():
+	await asyncio.sleep(0)
+	return graph, 202
+@application.route('/sync')
+@AsyncDecorator(executor=executor)
+def sync_view():
+	return graph
+@application.route('/etag')
+@AsyncDecorator(executor=executor, etags=True, cache_key=lambda: 'etag')
+async def etag_view():
+	return graph
+@application.route('/text')
+@AsyncDecorator(executor=executor)
+async def text_view():
+	return 'This is a test string'
+app = webtest.TestApp(application)
+
+
+class TestAsyncDecorators(unittest.TestCase):
+	def run_view(self, decorator, view):
+		return asyncio.run(decorator(view)())
+
+	def test_output_async(self):
+		turtle = graph.serialize(format='turtle')
+		decorator = PlainDecorator(executor=executor)
+		async def view():
+			return graph
+		(mimetype, body, headers) = self.run_view(decorator, view)
+		self.assertEqual('text/turtle; charset=utf-8', mimetype)
+		self.assertEqual(turtle, body)
+		self.assertEqual(406, asyncio.run(decorator.output_async(graph, 'text/html')))
+		self.assertEqual('text', asyncio.run(decorator.output_async('text', 'text/turtle')))
+
+	def test_coalesce(self):
+		turtle = graph.serialize(format='turtle')
+		decorator = PlainDecorator(executor=executor, coalesce_key=lambda: 'person')
+		calls = []
+		async def view():
+			calls.append(True)
+			await asyncio.sleep(0.05)
+			return graph
+		decorated = decorator(view)
+		async def run():
+			return await asyncio.gather(*[decorated() for i in range(4)])
+		for (mimetype, body, headers) in asyncio.run(run()):
+			self.assertEqual(turtle, body)
+		self.assertEqual(1, len(calls))
+		self.assertEqual(3, decorator.flights.coalesced)
+
+	def test_process_pool(self):
+		# the unpickled graph may iterate its triples in another order
+		nt = sorted(graph.serialize(format='nt').splitlines())
+		with ProcessPoolExecutor(1) as pool:
+			decorator = PlainDecorator(executor=pool, cache=LRUResponseCache(),
+			                           compress=True, compress_min_size=10)
+			decorator.accept = 'application/n-triples'
+			(mimetype, body, headers) = self.run_view(decorator, lambda: versioned(graph, 1))
+			self.assertEqual(nt, sorted(zlib.decompress(body, 16 + zlib.MAX_WBITS).splitlines()))
+			self.assertTrue(('Content-Encoding', 'gzip') in headers)
+			self.assertEqual(1, len(decorator.cache))
+			(mimetype, body, headers) = self.run_view(decorator, lambda: versioned(graph, 1))
+			self.assertEqual(1, decorator.cache.hits)
+
+	def test_executor_calls(self):
+		submitted = []
+		class RecordingExecutor(ThreadPoolExecutor):
+			def submit(self, func, *args, **kwargs):
+				submitted.append(getattr(func, '__name__', 'negotiate'))
+				return super(RecordingExecutor, self).submit(func, *args, **kwargs)
+		turtle = graph.serialize(format='turtle')
+		with RecordingExecutor(1) as pool:
+			decorator = PlainDecorator(executor=pool, cache=LRUResponseCache())
+			self.assertEqual(turtle, self.run_view(decorator, lambda: versioned(graph, 1))[1])
+			self.assertEqual(turtle, self.run_view(decorator, lambda: versioned(graph, 1))[1])
+		# a thread pool negotiates and serializes, or looks up the cache,
+		# without submitting the serializer again from its own thread
+		self.assertEqual(['negotiate', 'serialize'] * 2, submitted)
+		self.assertEqual(1, decorator.cache.hits)
+
+	def test_streaming(self):
+		nt = graph.serialize(format='nt')
+		decorator = PlainDecorator(streaming=True)
+		decorator.accept = 'application/n-triples'
+		(mimetype, body, headers) = self.run_view(decorator, lambda: graph)
+		self.assertEqual(nt, b''.join(body))
+
+	def test_flask(self):
+		turtle = graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle'}
+		response = app.get('/async', headers=headers)
+		self.assertEqual(turtle, response.body)
+		self.assertEqual('text/turtle; charset=utf-8', response.headers['content-type'])
+		self.assertEqual('Accept', response.headers['vary'])
+		self.assertEqual(202, response.status_int)
+		response = app.get('/sync', headers=headers)
+		self.assertEqual(turtle, response.body)
+		self.assertEqual(200, response.status_int)
+		response = app.get('/text', headers=headers)
+		self.assertEqual(b'This is a test string', response.body)
+		# the negotiation runs on the executor, in the request's context
+		etag = app.get('/etag', headers=headers).headers['ETag']
+		headers['If-None-Match'] = etag
+		response = app.get('/etag', headers=headers)
+		self.assertEqual(304, response.status_int)
@@ -1,4 +1,6 @@
 import unittest
+import zlib
+import webob
 import webtest
 from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
 from rdflib.namespace import RDF, RDFS, FOAF, XSD
@@ -56,6 +58,20 @@ def custom():
 	bottle.response.set_header('CustomHeader', 'yes')
 	bottle.response.status = '202 Custom'
 	return graph
+@application.route('/stream')
+@Decorator(streaming=True, chunk_size=16)
+def stream():
+	bottle.response.set_header('CustomHeader', 'yes')
+	bottle.response.status = '202 Custom'
+	return unicode_graph
+@application.route('/etag')
+@Decorator(etags=True, cache_key=lambda: 'etag')
+def etag():
+	return graph
+@application.route('/deflate')
+@Decorator(compress=True, compress_min_size=10)
+def deflate():
+	return graph
 app = webtest.TestApp(application)
 
 class TestCases(unittest.TestCase):
@@ -177,3 +193,37 @@ class TestCases(unittest.TestCase):
 		decorated = decorator(decoratee)
 		response = decorated()
 		self.assertEqual(turtle, response)
+
+	def test_streaming(self):
+		turtle = unicode_graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle'}
+		response = app.get('/stream', headers=headers)
+		self.assertEqual(turtle, response.body)
+		self.assertEqual('text/turtle; charset=utf-8', response.headers['content-type'])
+		self.assertEqual('Accept', response.headers['vary'])
+		self.assertEqual('yes', response.headers['CustomHeader'])
+		self.assertEqual(202, response.status_int)
+
+	def test_etag(self):
+		turtle = graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle'}
+		response = app.get('/etag', headers=headers)
+		self.assertEqual(turtle, response.body)
+		etag = response.headers['ETag']
+		headers['If-None-Match'] = etag
+		response = app.get('/etag', headers=headers)
+		self.assertEqual(304, response.status_int)
+		self.assertEqual(etag, response.headers['ETag'])
+		self.assertEqual('Accept', response.headers['vary'])
+		headers['If-None-Match'] = '"other"'
+		response = app.get('/etag', headers=headers)
+		self.assertEqual(200, response.status_int)
+		self.assertEqual(turtle, response.body)
+
+	def test_compress(self):
+		turtle = graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle', 'Accept-Encoding': 'deflate'}
+		response = webob.Request.blank('/deflate', headers=headers).get_response(application)
+		self.assertEqual('deflate', response.headers['Content-Encoding'])
+		self.assertEqual('Accept, Accept-Encoding', response.headers['vary'])
+		self.assertEqual(turtle, zlib.decompress(response.body))
@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+import webtest
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+import flask
+from flask_rdf.coalesce import SingleFlight
+from flask_rdf.common_decorators import LRUResponseCache
+from flask_rdf.flask import Decorator
+from flask_rdf import wsgi
+
+
+def make_graph():
+	graph = Graph('IOMemory', BNode())
+	person = URIRef('http://example.com/#person')
+	graph.add((person, RDF.type, FOAF.Person))
+	graph.add((person, FOAF.age, Literal(15, datatype=XSD.integer)))
+	return graph
+graph = make_graph()
+
+
+def get_concurrently(app, path, headers, count):
+	""" Sends count requests at once, returning the responses """
+	responses = [None] * count
+	def get(i):
+		responses[i] = app.get(path, headers=headers)
+	threads = [threading.Thread(target=get, args=(i,)) for i in range(count)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(5)
+	return responses
+
+
+class TestSingleFlight(unittest.TestCase):
+	def test_flight(self):
+		flights = SingleFlight(timeout=0.01)
+		(flight, leader) = flights.begin('key')
+		self.assertTrue(leader)
+		(same, leader) = flights.begin('key')
+		self.assertTrue(same is flight)
+		self.assertFalse(leader)
+		self.assertTrue(flights.begin('other')[1])
+		notified = []
+		flights.notify(flight, lambda: notified.append(True))
+		flights.finish('key', flight, 'result')
+		self.assertEqual([True], notified)
+		self.assertEqual('result', flights.wait(flight))
+		# the next request leads a new flight
+		(flight, leader) = flights.begin('key')
+		self.assertTrue(leader)
+		self.assertEqual(None, flights.wait(flight))
+		self.assertEqual(3, flights.led)
+		self.assertEqual(1, flights.coalesced)
+		self.assertEqual(1, flights.timeouts)
+
+	def test_flask(self):
+		calls = []
+		application = flask.Flask(__name__)
+		decorator = Decorator(coalesce_key=lambda: 'person', cache=LRUResponseCache(), cache_key=lambda: 'person')
+		@application.route('/person')
+		@decorator
+		def person():
+			calls.append(True)
+			time.sleep(0.2)
+			return graph, {'X-Custom': 'yes'}
+		app = webtest.TestApp(application)
+		responses = get_concurrently(app, '/person', {'Accept': 'text/turtle'}, 4)
+		turtle = graph.serialize(format='turtle')
+		for response in responses:
+			self.assertEqual(turtle, response.body)
+			self.assertEqual('yes', response.headers['X-Custom'])
+		self.assertEqual(len(calls), decorator.flights.led)
+		self.assertEqual(4, len(calls) + decorator.flights.coalesced)
+		self.assertTrue(decorator.flights.coalesced > 0)
+
+	def test_wsgi(self):
+		calls = []
+		def app(environ, start_response):
+			calls.append(True)
+			time.sleep(0.2)
+			start_response('200 OK', [('X-Custom', 'yes')])
+			return graph
+		decorator = wsgi.Decorator(coalesce_key=lambda environ: environ['PATH_INFO'], etags=True,
+		                           cache_key=lambda environ: environ['PATH_INFO'])
+		client = webtest.TestApp(decorator(app))
+		responses = get_concurrently(client, '/person', {'Accept': 'application/n-triples'}, 4)
+		nt = graph.serialize(format='nt')
+		for response in responses:
+			self.assertEqual(nt, response.body)
+			self.assertEqual('yes', response.headers['X-Custom'])
+			self.assertEqual(responses[0].headers['ETag'], response.headers['ETag'])
+		self.assertEqual(4, len(calls) + decorator.flights.coalesced)
+		self.assertTrue(decorator.flights.coalesced > 0)
+		# other formats aren't coalesced with these
+		client.get('/person', headers={'Accept': 'text/turtle'})
+		self.assertEqual(len(calls), decorator.flights.led)
@@ -1,7 +1,11 @@
 import unittest
 from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
 from rdflib.namespace import RDF, RDFS, FOAF, XSD
-from flask_rdf.common_decorators import ViewDecorator
+from flask_rdf.common_decorators import ViewDecorator, graph_fingerprint, known_fingerprint, make_cache_key
+from flask_rdf.common_decorators import DictResponseCache, LRUResponseCache, serialize_graph
+from flask_rdf.common_decorators import make_etag, etag_matches, select_range, parse_page, page_link
+from flask_rdf.common_decorators import TTLResponseCache, cache_control
+from flask_rdf.snapshot import versioned
 
 
 def make_graph():
@@ -31,3 +35,152 @@ class TestCommonDecorators(unittest.TestCase):
 		self.assertRaises(NotImplementedError, decorator.make_new_response, "response", "text/mimetype", "response")
 		self.assertRaises(NotImplementedError, decorator.make_406_response)
 		self.assertRaises(NotImplementedError, decorator.get_accept)
+		self.assertRaises(NotImplementedError, decorator.make_304_response, "response")
+		self.assertRaises(NotImplementedError, decorator.get_if_none_match)
+
+	def test_select_range(self):
+		body = b'0123456789'
+		self.assertEqual((206, b'0123', 'bytes 0-3/10'), select_range(body, 'bytes=0-3'))
+		self.assertEqual((206, b'56789', 'bytes 5-9/10'), select_range(body, 'bytes=5-'))
+		self.assertEqual((206, b'789', 'bytes 7-9/10'), select_range(body, 'bytes=-3'))
+		self.assertEqual((206, b'23456789', 'bytes 2-9/10'), select_range(body, 'bytes=2-100'))
+		self.assertEqual((416, b'', 'bytes */10'), select_range(body, 'bytes=10-'))
+		for header in [None, 'bytes=3-1', 'bytes=0-1,3-4', 'items=1-2', 'bytes=a-b', 'bytes=-']:
+			self.assertEqual((None, body, None), select_range(body, header))
+		chunks = iter([body])
+		self.assertEqual((None, chunks, None), select_range(chunks, 'bytes=0-3'))
+
+	def test_pages(self):
+		self.assertEqual(1, parse_page(None))
+		self.assertEqual(3, parse_page('a=b&page=3'))
+		self.assertEqual(1, parse_page('page=x'))
+		self.assertEqual(1, parse_page('page=-2'))
+		self.assertEqual(2, parse_page('p=2', 'p'))
+		self.assertEqual('<?page=2>; rel="next"', page_link(None, 'page', 2))
+		self.assertEqual('<?a=b&c=&page=4>; rel="next"', page_link('a=b&page=3&c=', 'page', 4))
+
+	def test_etags(self):
+		fingerprint = graph_fingerprint(graph)
+		etag = make_etag(fingerprint, 'text/turtle')
+		self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+		self.assertEqual(etag, make_etag(fingerprint, 'text/turtle'))
+		self.assertNotEqual(etag, make_etag(fingerprint, 'application/rdf+xml'))
+		self.assertTrue(etag_matches(etag, etag))
+		self.assertTrue(etag_matches('"other", W/%s' % etag, etag))
+		self.assertTrue(etag_matches('*', etag))
+		self.assertFalse(etag_matches('"other"', etag))
+		self.assertFalse(etag_matches(None, etag))
+
+
+class TestResponseCache(unittest.TestCase):
+	def test_fingerprint(self):
+		fingerprint = graph_fingerprint(graph)
+		self.assertTrue(fingerprint.startswith('2-'))
+		self.assertEqual(fingerprint, graph_fingerprint(graph))
+		# independent of insertion order and store
+		other = Graph()
+		for triple in reversed(list(graph)):
+			other.add(triple)
+		self.assertEqual(fingerprint, graph_fingerprint(other))
+		other.add((URIRef('http://example.com/#person'), FOAF.name, Literal('Person')))
+		self.assertNotEqual(fingerprint, graph_fingerprint(other))
+		# contexts are part of the fingerprint
+		ctx1 = ConjunctiveGraph()
+		ctx1.get_context(URIRef('http://example.com/#a')).add(list(graph)[0])
+		ctx2 = ConjunctiveGraph()
+		ctx2.get_context(URIRef('http://example.com/#b')).add(list(graph)[0])
+		self.assertNotEqual(graph_fingerprint(ctx1), graph_fingerprint(ctx2))
+		# blank nodes don't depend on their labels
+		def blank_graph(name):
+			blank = Graph()
+			node = BNode()
+			blank.add((URIRef('http://example.com/#person'), FOAF.knows, node))
+			blank.add((node, FOAF.name, Literal(name)))
+			return blank
+		self.assertEqual(graph_fingerprint(blank_graph('a')), graph_fingerprint(blank_graph('a')))
+		self.assertNotEqual(graph_fingerprint(blank_graph('a')), graph_fingerprint(blank_graph('b')))
+		# only the fingerprints that are known without hashing are used for ETags
+		self.assertEqual(None, known_fingerprint(graph))
+		self.assertEqual('k-person', known_fingerprint(graph, 'person'))
+		self.assertEqual('v-3', known_fingerprint(versioned(graph, 3), 'person'))
+
+	def test_cache_key(self):
+		self.assertEqual('custom turtle', make_cache_key(graph, 'turtle', 'custom'))
+		# plain graphs aren't hashed for a key, so they aren't cached without one
+		self.assertEqual(None, make_cache_key(graph, 'xml'))
+		# the version of a versioned graph is used, without reading its triples
+		self.assertEqual('v-3 xml', make_cache_key(versioned(None, 3), 'xml'))
+		cache = DictResponseCache({'v-3 xml': b'cached'})
+		self.assertEqual(b'cached', serialize_graph(versioned(None, 3), 'xml', cache))
+
+	def test_lru(self):
+		cache = LRUResponseCache(max_bytes=10)
+		cache.set('a', b'1234')
+		cache.set('b', b'1234')
+		self.assertEqual(b'1234', cache.get('a'))
+		cache.set('c', b'1234')	# evicts b
+		self.assertEqual(None, cache.get('b'))
+		self.assertEqual(b'1234', cache.get('a'))
+		self.assertEqual(8, cache.size)
+		cache.set('d', b'12345678901')	# too big to cache
+		self.assertEqual(None, cache.get('d'))
+		cache.set('a', b'12')
+		self.assertEqual(6, cache.size)
+		self.assertEqual(2, len(cache))
+		self.assertEqual(2, cache.hits)
+		self.assertEqual(2, cache.misses)
+
+	def test_ttl(self):
+		now = [0]
+		cache = TTLResponseCache(DictResponseCache(), ttl=10, clock=lambda: now[0])
+		cache.set('a', b'1234')
+		now[0] = 4
+		self.assertEqual((b'1234', 4), cache.lookup('a'))
+		now[0] = 11
+		self.assertEqual(None, cache.get('a'))
+		# entries that it didn't set are expired
+		cache.cache.set('b', b'1234')
+		self.assertEqual((None, None), cache.lookup('b'))
+		cache.cache.set('b', b'ttl:12345678901234')
+		self.assertEqual((None, None), cache.lookup('b'))
+		# the times are evicted along with the bytes
+		lru = LRUResponseCache(max_bytes=30)
+		cache = TTLResponseCache(lru, ttl=10, clock=lambda: now[0])
+		cache.set('a', b'1234')
+		cache.set('b', b'1234')
+		self.assertEqual(1, len(lru))
+		self.assertEqual(None, cache.get('a'))
+		self.assertEqual(b'1234', cache.get('b'))
+		cache.set('c', b'x' * 30)	# too big to cache
+		self.assertEqual(None, cache.get('c'))
+		self.assertEqual(1, len(lru))
+		self.assertEqual('max-age=10', cache_control(10))
+		self.assertEqual('max-age=10, stale-while-revalidate=30', cache_control(10, 30))
+
+	def test_serialize_graph(self):
+		store = {}
+		cache = DictResponseCache(store)
+		turtle = graph.serialize(format='turtle')
+		self.assertEqual(turtle, serialize_graph(graph, 'turtle', cache, 'person'))
+		self.assertEqual(['person turtle'], list(store.keys()))
+		store['person turtle'] = b'cached'
+		self.assertEqual(b'cached', serialize_graph(graph, 'turtle', cache, 'person'))
+		self.assertEqual(b'cached', serialize_graph(graph, 'turtle', cache, 'person', chunk_size=16))
+		# nor are graphs without a key
+		self.assertEqual(turtle, serialize_graph(graph, 'turtle', cache))
+		self.assertEqual(['person turtle'], list(store.keys()))
+		# streamed misses are not cached
+		chunks = serialize_graph(graph, 'xml', cache, 'person', chunk_size=16)
+		self.assertEqual(graph.serialize(format='xml'), b''.join(chunks))
+		self.assertEqual(None, cache.get('person xml'))
+
+	def test_decorator_cache(self):
+		cache = LRUResponseCache()
+		decorator = ViewDecorator(cache=cache, cache_key=lambda name: name)
+		decorator.make_new_response = lambda response, mimetype, serialized: serialized
+		decorator.get_accept = lambda: 'text/turtle'
+		view = decorator(lambda name: graph)
+		self.assertEqual(graph.serialize(format='turtle'), view('person'))
+		cache.set('person turtle', b'cached')
+		self.assertEqual(b'cached', view('person'))
+		self.assertEqual(graph.serialize(format='turtle'), view('other'))
@@ -1,9 +1,12 @@
 import unittest
+import zlib
+import webob
 import webtest
 from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
 from rdflib.namespace import RDF, RDFS, FOAF, XSD
 import flask
 from flask_rdf.flask import output, Decorator, returns_rdf
+from flask_rdf.common_decorators import LRUResponseCache, TTLResponseCache, NEGOTIATION_KEY
 
 
 def make_graph():
@@ -51,6 +54,65 @@ def unicode():
 @returns_rdf
 def custom():
 	return graph, 202, {'CustomHeader':'yes'}
+streaming = Decorator(streaming=True, chunk_size=16)
+@application.route('/stream')
+@streaming
+def stream():
+	return unicode_graph
+@application.route('/stream202')
+@streaming
+def stream_custom():
+	return graph, 202, {'CustomHeader':'yes'}
+@application.route('/etag', methods=['GET', 'POST'])
+@Decorator(etags=True, cache_key=lambda: 'etag')
+def etag():
+	return graph, 202, {'Cache-Control':'max-age=60'}
+@application.route('/gzip')
+@Decorator(compress=True, compress_min_size=10)
+def gzip():
+	return graph
+@application.route('/ranges')
+@Decorator(ranges=True, etags=True, cache=LRUResponseCache(), cache_key=lambda: 'ranges')
+def ranges():
+	return graph
+@application.route('/ranges/uncached')
+@Decorator(ranges=True, etags=True)
+def uncached_ranges():
+	return graph
+@application.route('/pages')
+@Decorator(page_size=1)
+def pages():
+	return paged_graph
+paged_graph = make_graph()
+prenegotiated = []
+@application.route('/prenegotiate')
+@Decorator(prenegotiate=True, cache=LRUResponseCache(), cache_key=lambda: 'prenegotiate')
+def prenegotiate():
+	prenegotiated.append(flask.request.environ[NEGOTIATION_KEY])
+	return graph
+now = [0]
+revalidated = []
+revalidating = Decorator(cache=TTLResponseCache(ttl=30, clock=lambda: now[0]), cache_key=lambda: 'revalidate',
+                         max_age=10, stale_while_revalidate=20)
+@application.route('/revalidate')
+@revalidating
+def revalidate():
+	revalidated.append(flask.request.path)
+	return graph if len(revalidated) < 2 else new_graph
+new_graph = make_graph()
+new_graph.add((URIRef('http://example.com/#person'), FOAF.name, Literal('new')))
+class LegacyDecorator(Decorator):
+	""" Overrides make_new_response with its original signature """
+	@classmethod
+	def make_new_response(cls, old_response, mimetype, serialized):
+		response = flask.make_response(cls.replace_graph(old_response, serialized))
+		response.headers['Content-Type'] = mimetype
+		response.headers['X-Legacy'] = 'yes'
+		return response
+@application.route('/legacy', methods=['GET', 'HEAD'])
+@LegacyDecorator()
+def legacy():
+	return graph, 201
 app = webtest.TestApp(application)
 
 
@@ -81,6 +143,34 @@ class TestFlaskInternally(unittest.TestCase):
 		self.assertEqual('Accept', response.headers['vary'])
 		self.assertEqual(202, response.status_code)
 
+	def test_format_tuple_headers(self):
+		turtle = graph.serialize(format='turtle')
+		accepts = 'text/turtle'
+		response = output((graph, {'CustomHeader': 'yes'}), accepts)
+		self.assertEqual(turtle, response.get_data())
+		self.assertEqual('yes', response.headers['CustomHeader'])
+		self.assertEqual(200, response.status_code)
+		response = output((graph, '201 CREATED', [('CustomHeader', 'yes')]), accepts)
+		self.assertEqual('yes', response.headers['CustomHeader'])
+		self.assertEqual('text/turtle; charset=utf-8', response.headers['content-type'])
+		self.assertEqual(201, response.status_code)
+
+	def test_classify(self):
+		headers = {'CustomHeader': 'yes'}
+		for (response, status, found) in [
+		    (graph, None, None),
+		    ((graph,), None, None),
+		    ((graph, 202), 202, None),
+		    ((graph, headers), None, headers),
+		    ((graph, 202, headers), 202, headers)]:
+			view = Decorator.classify(response)
+			self.assertTrue(view.graph is graph)
+			self.assertEqual(status, view.status)
+			self.assertEqual(found, view.headers)
+		for response in ['text', ('text', 202), (), [graph], (graph, 202, headers, None)]:
+			self.assertEqual(None, Decorator.classify(response))
+		self.assertEqual(('wrong', 202), Decorator.replace_graph((graph, 202), 'wrong'))
+
 	def test_format_quads_nocontext(self):
 		g = graph
 		self.assertFalse(g.context_aware)
@@ -299,3 +389,162 @@ class TestFlaskApp(unittest.TestCase):
 		self.assertEqual('yes', response.headers['CustomHeader'])
 		self.assertEqual(202, response.status_int)
 		self.assertEqual(turtle, response.body)
+
+	def test_streaming(self):
+		turtle = unicode_graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle'}
+		response = app.get('/stream', headers=headers)
+		self.assertEqual(turtle, response.body)
+		self.assertEqual('text/turtle; charset=utf-8', response.headers['content-type'])
+		self.assertEqual('Accept', response.headers['vary'])
+		self.assertEqual(200, response.status_int)
+
+	def test_streaming_custom_response(self):
+		nt = graph.serialize(format='nt')
+		headers = {'Accept': 'application/n-triples'}
+		response = app.get('/stream202', headers=headers)
+		self.assertEqual(nt, response.body)
+		self.assertEqual('application/n-triples', response.headers['content-type'])
+		self.assertEqual('Accept', response.headers['vary'])
+		self.assertEqual('yes', response.headers['CustomHeader'])
+		self.assertEqual(202, response.status_int)
+
+	def test_etag(self):
+		turtle = graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle'}
+		response = app.get('/etag', headers=headers)
+		self.assertEqual(turtle, response.body)
+		self.assertEqual(202, response.status_int)
+		etag = response.headers['ETag']
+		headers['If-None-Match'] = etag
+		response = app.get('/etag', headers=headers)
+		self.assertEqual(304, response.status_int)
+		self.assertEqual(b'', response.body)
+		self.assertEqual(etag, response.headers['ETag'])
+		self.assertEqual('Accept', response.headers['vary'])
+		self.assertEqual('max-age=60', response.headers['Cache-Control'])
+		# a different format has a different etag
+		headers['Accept'] = 'application/rdf+xml'
+		response = app.get('/etag', headers=headers)
+		self.assertEqual(202, response.status_int)
+		self.assertNotEqual(etag, response.headers['ETag'])
+		# only for safe methods
+		headers['Accept'] = 'text/turtle'
+		response = app.post('/etag', headers=headers)
+		self.assertEqual(202, response.status_int)
+		# plain graphs without a key aren't fingerprinted
+		response = app.get('/ranges/uncached', headers=headers)
+		self.assertFalse('ETag' in response.headers)
+
+	def test_compress(self):
+		turtle = graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle', 'Accept-Encoding': 'gzip'}
+		response = webob.Request.blank('/gzip', headers=headers).get_response(application)
+		self.assertEqual('gzip', response.headers['Content-Encoding'])
+		self.assertEqual('Accept, Accept-Encoding', response.headers['vary'])
+		self.assertEqual(turtle, zlib.decompress(response.body, 16 + zlib.MAX_WBITS))
+		headers = {'Accept': 'text/turtle'}
+		response = webob.Request.blank('/gzip', headers=headers).get_response(application)
+		self.assertFalse('Content-Encoding' in response.headers)
+		self.assertEqual('Accept, Accept-Encoding', response.headers['vary'])
+		self.assertEqual(turtle, response.body)
+
+	def test_legacy_response(self):
+		headers = {'Accept': 'text/turtle'}
+		response = app.get('/legacy', headers=headers)
+		self.assertEqual(201, response.status_int)
+		self.assertEqual('yes', response.headers['X-Legacy'])
+		self.assertEqual(graph.serialize(format='turtle'), response.body)
+		response = app.head('/legacy', headers=headers)
+		self.assertEqual(201, response.status_int)
+
+	def test_ranges(self):
+		nt = graph.serialize(format='nt')
+		headers = {'Accept': 'application/n-triples'}
+		response = app.get('/ranges', headers=headers)
+		self.assertEqual('bytes', response.headers['Accept-Ranges'])
+		self.assertEqual(nt, response.body)
+		etag = response.headers['ETag']
+		headers['Range'] = 'bytes=10-19'
+		response = app.get('/ranges', headers=headers)
+		self.assertEqual(206, response.status_int)
+		self.assertEqual('bytes 10-19/%d' % len(nt), response.headers['Content-Range'])
+		self.assertEqual(nt[10:20], response.body)
+		# If-Range sends the whole body for another version
+		headers['If-Range'] = '"old"'
+		response = app.get('/ranges', headers=headers)
+		self.assertEqual(200, response.status_int)
+		self.assertEqual(nt, response.body)
+		headers['If-Range'] = etag
+		response = app.get('/ranges', headers=headers)
+		self.assertEqual(206, response.status_int)
+		headers['Range'] = 'bytes=%d-' % len(nt)
+		response = app.get('/ranges', headers=headers, status=416)
+		self.assertEqual('bytes */%d' % len(nt), response.headers['Content-Range'])
+		# freshly serialized bodies may differ between requests, so aren't sliced
+		headers['Range'] = 'bytes=10-19'
+		del headers['If-Range']
+		response = app.get('/ranges/uncached', headers=headers)
+		self.assertEqual(200, response.status_int)
+		self.assertFalse('Accept-Ranges' in response.headers)
+		self.assertEqual(nt, response.body)
+
+	def test_pages(self):
+		nt = paged_graph.serialize(format='nt')
+		headers = {'Accept': 'application/n-triples'}
+		response = app.get('/pages?other=1', headers=headers)
+		self.assertEqual('<?other=1&page=2>; rel="next"', response.headers['Link'])
+		body = response.body
+		response = app.get('/pages?other=1&page=2', headers=headers)
+		self.assertFalse('Link' in response.headers)
+		self.assertEqual(nt, body + response.body)
+		# other formats aren't paged
+		response = app.get('/pages', headers={'Accept': 'text/turtle'})
+		self.assertFalse('Link' in response.headers)
+		self.assertEqual(paged_graph.serialize(format='turtle'), response.body)
+
+	def test_revalidate(self):
+		headers = {'Accept': 'application/n-triples'}
+		response = app.get('/revalidate', headers=headers)
+		nt = graph.serialize(format='nt')
+		self.assertEqual(nt, response.body)
+		self.assertEqual('max-age=10, stale-while-revalidate=20', response.headers['Cache-Control'])
+		# fresh entries are sent without running the view
+		now[0] = 5
+		response = app.get('/revalidate', headers=headers)
+		self.assertEqual(nt, response.body)
+		self.assertEqual('max-age=10, stale-while-revalidate=20', response.headers['Cache-Control'])
+		self.assertEqual(1, len(revalidated))
+		# stale entries are sent while the view runs in the background
+		now[0] = 15
+		response = app.get('/revalidate', headers=headers)
+		self.assertEqual(nt, response.body)
+		revalidating.revalidator.wait(5)
+		self.assertEqual(['/revalidate', '/revalidate'], revalidated)
+		response = app.get('/revalidate', headers=headers)
+		self.assertEqual(new_graph.serialize(format='nt'), response.body)
+		self.assertNotEqual(nt, response.body)
+		# expired entries are not sent
+		now[0] = 50
+		app.get('/revalidate', headers=headers)
+		self.assertEqual(3, len(revalidated))
+
+	def test_prenegotiate(self):
+		# the view doesn't run for a 406
+		app.get('/prenegotiate', headers={'Accept': 'image/png'}, status=406)
+		self.assertEqual([], prenegotiated)
+		turtle = graph.serialize(format='turtle')
+		headers = {'Accept': 'text/turtle, application/n-quads'}
+		response = app.get('/prenegotiate', headers=headers)
+		self.assertEqual(turtle, response.body)
+		self.assertEqual(('text/turtle', 'turtle'), prenegotiated[0].decide())
+		self.assertEqual(('application/n-quads', 'nquads'), prenegotiated[0].decide(True))
+		# nor for a cache hit
+		response = app.get('/prenegotiate', headers={'Accept': 'text/turtle'})
+		self.assertEqual(turtle, response.body)
+		self.assertEqual('text/turtle; charset=utf-8', response.headers['content-type'])
+		self.assertEqual(1, len(prenegotiated))
+		# unless a context-aware graph would be sent in another format
+		response = app.get('/prenegotiate', headers=headers)
+		self.assertEqual(turtle, response.body)
+		self.assertEqual(2, len(prenegotiated))
@@ -1,9 +1,29 @@
 import unittest
+import mimeparse
 from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
 from rdflib.namespace import RDF, RDFS, FOAF, XSD
 from flask_rdf.flask import output
 import flask_rdf.format
 from flask_rdf.format import add_format, decide, FormatSelector, wants_rdf
+from flask_rdf.format import best_match, compile_table, parse_accept, has_jsonld
+
+
+accept_corpus = [
+	'',
+	'*/*',
+	'*',
+	'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+	'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+	'application/rdf+xml, text/rdf+n3;q=0.9, text/turtle;q=0.8, */*;q=0.1',
+	'text/turtle,application/n-quads;q=0.9,application/rdf+xml;q=0.7,*/*;q=0.5',
+	'text/*;q=0.5, application/*;q=0.4',
+	'text/turtle;q=0.5, text/turtle;q=0.9',
+	'text/turtle;q=0, text/n3;q=0.5',
+	'text/turtle;q=2, text/n3;q=0.5',
+	'*/turtle;q=0.3, text/n3;q=0.2',
+	'text/html;level=1, text/*;level=1;q=0.3',
+	'text/strangerdf',
+]
 
 
 class TestFormat(unittest.TestCase):
@@ -146,3 +166,139 @@ class TestFormat(unittest.TestCase):
 		self.assertFalse(wants_rdf('text/html'))
 		self.assertFalse(wants_rdf('text/html, */*;q=0.2'))
 		self.assertFalse(wants_rdf('text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'))
+
+	def test_cache(self):
+		accepts = 'text/turtle;q=0.5, text/n3;q=0.9'
+		self.format.cache_clear()
+		(hits, misses, maxsize, currsize) = self.format.cache_info()
+		self.assertEqual(0, currsize)
+		self.assertEqual(('text/n3', 'n3'), self.format.decide(accepts))
+		self.assertEqual(('text/n3', 'n3'), self.format.decide(accepts))
+		(hits2, misses2, maxsize, currsize) = self.format.cache_info()
+		self.assertEqual(hits + 1, hits2)
+		self.assertEqual(misses + 1, misses2)
+		self.assertEqual(1, currsize)
+		# context awareness is part of the key
+		self.format.decide(accepts, context_aware=True)
+		self.assertEqual(2, self.format.cache_info()[3])
+
+	def test_cache_bounded(self):
+		selector = FormatSelector(cache_size=2)
+		selector.decide('text/turtle')
+		selector.decide('text/n3')
+		selector.decide('text/turtle')
+		selector.decide('application/rdf+xml')	# evicts text/n3
+		self.assertEqual(2, selector.cache_info()[3])
+		misses = selector.cache_info()[1]
+		selector.decide('text/turtle')
+		self.assertEqual(misses, selector.cache_info()[1])
+		selector.decide('text/n3')
+		self.assertEqual(misses + 1, selector.cache_info()[1])
+
+	def test_cache_invalidation(self):
+		accepts = 'text/turtle;q=0.5, test/cacheformat;q=1.0'
+		self.assertEqual('text/turtle', self.format.decide(accepts)[0])
+		self.format.add_format('test/cacheformat', 'test')
+		self.assertEqual('test/cacheformat', self.format.decide(accepts)[0])
+		accepts = 'text/turtle;q=0.5, test/cachemodule;q=1.0'
+		self.assertEqual('text/turtle', self.format.decide(accepts)[0])
+		self.assertFalse(self.format.wants_rdf('test/cachemodule'))
+		add_format('test/cachemodule', 'test')
+		self.assertEqual('test/cachemodule', self.format.decide(accepts)[0])
+		self.assertTrue(self.format.wants_rdf('test/cachemodule'))
+
+	def test_table(self):
+		import json
+		self.format.warm(accept_corpus)
+		for accepts in accept_corpus:
+			for context_aware in (False, True):
+				self.assertEqual(FormatSelector().decide(accepts, context_aware),
+				                 self.format.decide(accepts, context_aware))
+		# the table answers without negotiating
+		before = self.format.cache_info()
+		self.format.decide(accept_corpus[3])
+		self.assertEqual(before, self.format.cache_info())
+		# other workers start warm
+		exported = json.loads(json.dumps(self.format.export_table()))
+		worker = FormatSelector()
+		worker.import_table(exported)
+		worker.decide(accept_corpus[3], True)
+		self.assertEqual((0, 0), worker.cache_info()[:2])
+		self.assertEqual(self.format.decide('text/turtle'), worker.decide('text/turtle'))
+		# unless their formats differ
+		other = FormatSelector()
+		other.add_format('test/tableformat', 'test')
+		other.import_table(exported)
+		self.assertEqual(('test/tableformat', 'test'), other.decide('test/tableformat'))
+		self.assertEqual(self.format.decide(accept_corpus[3]), other.decide(accept_corpus[3]))
+
+	def test_table_invalidation(self):
+		accepts = 'text/turtle;q=0.5, test/tableinvalid;q=1.0'
+		self.format.warm([accepts])
+		self.assertEqual('text/turtle', self.format.decide(accepts)[0])
+		self.format.add_format('test/tableinvalid', 'test')
+		self.assertEqual('test/tableinvalid', self.format.decide(accepts)[0])
+		self.assertEqual('test/tableinvalid', self.format.decide(accepts, True)[0])
+
+	def test_table_learn(self):
+		selector = FormatSelector(learn=2)
+		for accepts in accept_corpus:
+			selector.decide(accepts)
+		self.assertEqual(accept_corpus[:2], sorted(selector.export_table()['ctxless']))
+		self.assertEqual({}, selector.export_table()['context_aware'])
+
+	def test_registry(self):
+		registry = self.format.get_registry()
+		self.assertTrue(registry is self.format.get_registry())
+		self.assertEqual('turtle', registry.formats['text/turtle'])
+		self.assertTrue('application/n-quads' in registry.candidates)
+		self.assertFalse('application/n-quads' in registry.ctxless_candidates)
+		self.assertTrue('application/trig' in registry.candidates)
+		self.assertFalse('application/trig' in registry.ctxless_candidates)
+		self.assertEqual(has_jsonld(), 'application/ld+json' in registry.ctxless_candidates)
+		self.assertEqual(len(registry.candidates), len(registry.ranges))
+		# instance formats override module formats
+		self.format.add_format('text/turtle', 'custom-turtle')
+		newregistry = self.format.get_registry()
+		self.assertFalse(registry is newregistry)
+		self.assertEqual('turtle', registry.formats['text/turtle'])
+		self.assertEqual('custom-turtle', newregistry.formats['text/turtle'])
+		self.assertEqual('custom-turtle', self.format.get_serialize_format('text/turtle'))
+		# module formats rebuild it too
+		add_format('test/registrymodule', 'test')
+		self.assertFalse(newregistry is self.format.get_registry())
+		self.assertTrue('test/registrymodule' in self.format.get_registry().ctxless_candidates)
+
+	def test_parse_accept(self):
+		ranges = parse_accept('text/turtle;q=0.5, , */*;level=1, broken, text/n3;q=abc')
+		self.assertEqual([
+			('text', 'turtle', {'q': '0.5'}, 0.5),
+			('*', '*', {'level': '1'}, 1.0),
+			('text', 'n3', {'q': 'abc'}, 1.0),
+		], ranges)
+
+	def test_best_match_mimeparse(self):
+		""" Test that the negotiation agrees with python-mimeparse """
+		candidates = ['text/turtle', 'application/rdf+xml', 'text/n3',
+		              'text/html;level=1', 'INVALID/MATCH']
+		table = compile_table(candidates)
+		for accepts in accept_corpus:
+			self.assertEqual(mimeparse.best_match(candidates, accepts),
+			                 best_match(table, accepts), accepts)
+		registry = self.format.get_registry()
+		for accepts in accept_corpus:
+			self.assertEqual(mimeparse.best_match(list(registry.candidates), accepts),
+			                 best_match(registry.ranges, accepts), accepts)
+			self.assertEqual(mimeparse.best_match(list(registry.ctxless_candidates), accepts),
+			                 best_match(registry.ctxless_ranges, accepts), accepts)
+
+	def test_decide_encoding(self):
+		self.assertEqual(None, self.format.decide_encoding(None))
+		self.assertEqual(None, self.format.decide_encoding(''))
+		self.assertEqual('gzip', self.format.decide_encoding('gzip, deflate, br'))
+		self.assertEqual('deflate', self.format.decide_encoding('deflate'))
+		self.assertEqual('deflate', self.format.decide_encoding('gzip;q=0.5, deflate'))
+		self.assertEqual(None, self.format.decide_encoding('gzip;q=0, br'))
+		self.assertEqual('gzip', self.format.decide_encoding('*'))
+		self.assertEqual(None, self.format.decide_encoding('identity, gzip;q=0.5'))
+		self.assertEqual('gzip', self.format.decide_encoding('GZIP;q=0.8, identity;q=0.5'))
@@ -0,0 +1,29 @@
+import subprocess
+import sys
+import unittest
+import flask_rdf
+from flask_rdf.common_decorators import is_rdflib_graph
+
+
+class TestImports(unittest.TestCase):
+	def test_lazy_attributes(self):
+		import flask_rdf.flask
+		import flask_rdf.wsgi
+		self.assertTrue(flask_rdf.flask_rdf is flask_rdf.flask.returns_rdf)
+		self.assertTrue(flask_rdf.wsgi_rdf is flask_rdf.wsgi.returns_rdf)
+		self.assertTrue('bottle_rdf' in dir(flask_rdf))
+		self.assertRaises(AttributeError, getattr, flask_rdf, 'missing')
+
+	@unittest.skipIf(sys.version_info < (3, 7), 'needs module __getattr__')
+	def test_no_rdflib(self):
+		code = ('import sys, flask_rdf, flask_rdf.wsgi, flask_rdf.flask, flask_rdf.bottle; '
+		        'flask_rdf.wsgi_rdf(lambda environ, start_response: [])({}, lambda *args: None); '
+		        'sys.stdout.write(str(sorted(m for m in sys.modules if m.startswith(("rdflib", "asyncio")))))')
+		output = subprocess.check_output([sys.executable, '-c', code])
+		self.assertEqual(b'[]', output.strip())
+
+	def test_is_rdflib_graph(self):
+		from rdflib import ConjunctiveGraph, Graph
+		self.assertTrue(is_rdflib_graph(Graph()))
+		self.assertTrue(is_rdflib_graph(ConjunctiveGraph()))
+		self.assertFalse(is_rdflib_graph('Graph'))
@@ -0,0 +1,109 @@
+import unittest
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+from flask_rdf.common_decorators import ViewDecorator
+from flask_rdf.instrumentation import Instrumentation, HistogramCollector, ResponseStats
+from flask_rdf.wsgi import Decorator
+
+
+def make_graph():
+	graph = Graph('IOMemory', BNode())
+	person = URIRef('http://example.com/#person')
+	graph.add((person, RDF.type, FOAF.Person))
+	graph.add((person, FOAF.age, Literal(15, datatype=XSD.integer)))
+	return graph
+graph = make_graph()
+
+
+class Recorder(Instrumentation):
+	def __init__(self):
+		self.stats = []
+	def record(self, stats):
+		self.stats.append(stats)
+
+
+class PlainDecorator(ViewDecorator):
+	@classmethod
+	def make_new_response(cls, old_response, mimetype, serialized):
+		return serialized
+	@classmethod
+	def update_response(cls, response, headers=(), status=None):
+		return response
+	@classmethod
+	def make_406_response(cls):
+		return '406'
+	@classmethod
+	def make_304_response(cls, view, headers=()):
+		return '304'
+
+
+class TestInstrumentation(unittest.TestCase):
+	def test_view_decorator(self):
+		recorder = Recorder()
+		decorator = PlainDecorator(instrumentation=recorder, etags=True)
+		nt = graph.serialize(format='nt')
+		self.assertEqual(nt, decorator.output(graph, 'application/n-triples'))
+		self.assertEqual('text', decorator.output('text', 'application/n-triples'))
+		self.assertEqual(1, len(recorder.stats))
+		stats = recorder.stats[0]
+		self.assertEqual('nt', stats.format)
+		self.assertEqual('application/n-triples', stats.mimetype)
+		self.assertEqual(2, stats.triples)
+		self.assertEqual(len(nt), stats.size)
+		self.assertEqual(['compress', 'negotiate', 'respond', 'serialize'], sorted(stats.timings))
+		# answered during the negotiation
+		self.assertEqual('406', decorator.output(graph, 'text/html'))
+		self.assertEqual(None, recorder.stats[-1].format)
+		self.assertEqual(['negotiate'], list(recorder.stats[-1].timings))
+
+	def test_streaming(self):
+		recorder = Recorder()
+		decorator = PlainDecorator(instrumentation=recorder, streaming=True, chunk_size=16)
+		chunks = decorator.output(graph, 'text/turtle')
+		self.assertEqual([], recorder.stats)
+		body = b''.join(chunks)
+		self.assertEqual(len(body), recorder.stats[0].size)
+		self.assertTrue('stream' in recorder.stats[0].timings)
+
+	def test_async(self):
+		import asyncio
+		from flask_rdf.async_decorators import AsyncViewDecorator
+		class AsyncPlainDecorator(AsyncViewDecorator, PlainDecorator):
+			pass
+		recorder = Recorder()
+		decorator = AsyncPlainDecorator(instrumentation=recorder, compress=True, compress_min_size=10)
+		body = asyncio.run(decorator.output_async(graph, 'application/n-triples', accept_encoding='gzip'))
+		stats = recorder.stats[0]
+		self.assertEqual('nt', stats.format)
+		self.assertEqual(len(body), stats.size)
+		self.assertEqual(['compress', 'negotiate', 'respond', 'serialize'], sorted(stats.timings))
+
+	def test_wsgi(self):
+		recorder = Recorder()
+		decorator = Decorator(instrumentation=recorder)
+		body = decorator(lambda environ, start_response: graph)({'HTTP_ACCEPT': 'text/turtle'}, lambda *args: None)
+		stats = recorder.stats[0]
+		self.assertEqual('turtle', stats.format)
+		self.assertEqual(len(body[0]), stats.size)
+		self.assertEqual(['compress', 'negotiate', 'serialize'], sorted(stats.timings))
+
+	def test_histograms(self):
+		collector = HistogramCollector(time_buckets=(0.5, 1), size_buckets=(100,), triple_buckets=(10,))
+		stats = ResponseStats(graph)
+		stats.format = 'turtle'
+		stats.size = 150
+		stats.timings = {'serialize': 0.75}
+		collector.record(stats)
+		stats.timings = {'serialize': 0.25}
+		collector.record(stats)
+		text = collector.exposition()
+		lines = text.splitlines()
+		self.assertTrue('# TYPE flask_rdf_phase_seconds histogram' in lines)
+		self.assertTrue('flask_rdf_phase_seconds_bucket{phase="serialize",format="turtle",le="0.5"} 1' in lines)
+		self.assertTrue('flask_rdf_phase_seconds_bucket{phase="serialize",format="turtle",le="1.0"} 2' in lines)
+		self.assertTrue('flask_rdf_phase_seconds_bucket{phase="serialize",format="turtle",le="+Inf"} 2' in lines)
+		self.assertTrue('flask_rdf_phase_seconds_sum{phase="serialize",format="turtle"} 1.0' in lines)
+		self.assertTrue('flask_rdf_phase_seconds_count{phase="serialize",format="turtle"} 2' in lines)
+		self.assertTrue('flask_rdf_response_bytes_bucket{format="turtle",le="100.0"} 0' in lines)
+		self.assertTrue('flask_rdf_response_triples_bucket{format="turtle",le="10.0"} 2' in lines)
+		self.assertTrue(text.endswith('\n'))
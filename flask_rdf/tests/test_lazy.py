@@ -0,0 +1,98 @@
+import unittest
+import webtest
+from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+from rdflib.compare import isomorphic
+import flask
+from flask_rdf.lazy import LazyGraph, graph_size
+from flask_rdf.ntriples import serialize_nt, serialize_nquads, serialize_page
+from flask_rdf.streaming import serialize_stream
+from flask_rdf.flask import Decorator
+from flask_rdf import wsgi
+
+
+def make_graph():
+	graph = Graph('IOMemory', BNode())
+	for i in range(3):
+		person = URIRef('http://example.com/#person%s' % i)
+		graph.add((person, RDF.type, FOAF.Person))
+		graph.add((person, FOAF.age, Literal(i, datatype=XSD.integer)))
+	return graph
+graph = make_graph()
+
+def make_ctx_graph():
+	graph = ConjunctiveGraph('IOMemory')
+	for i in range(2):
+		context = graph.get_context(URIRef('http://example.com/#ctx%s' % i))
+		context.add((URIRef('http://example.com/#person%s' % i), FOAF.name, Literal('☃')))
+	return graph
+ctx_graph = make_ctx_graph()
+
+def lazy_graph():
+	return LazyGraph(triple for triple in list(graph))
+
+def lazy_ctx_graph():
+	quads = [(s, p, o, c.identifier) for (s, p, o, c) in ctx_graph.quads((None, None, None))]
+	return LazyGraph((quad for quad in quads), context_aware=True)
+
+
+class TestLazyGraph(unittest.TestCase):
+	def test_line_formats(self):
+		lazy = lazy_graph()
+		self.assertEqual(None, graph_size(lazy))
+		self.assertEqual(serialize_nt(graph), serialize_nt(lazy))
+		self.assertFalse(lazy.materialized())
+		# the generator was read
+		self.assertRaises(ValueError, lazy.materialize)
+		lazy = lazy_ctx_graph()
+		self.assertEqual(sorted(ctx_graph.serialize(format='nquads').splitlines()),
+		                 sorted(serialize_nquads(lazy).splitlines()))
+		self.assertFalse(lazy.materialized())
+		lazy = lazy_graph()
+		chunks = list(serialize_stream(lazy, 'nt', chunk_size=16))
+		self.assertEqual(serialize_nt(graph), b''.join(chunks))
+		(page, more) = serialize_page(lazy_graph(), 'nt', 0, 2)
+		self.assertEqual(2, len(page.splitlines()))
+		self.assertTrue(more)
+
+	def test_materialize(self):
+		lazy = lazy_graph()
+		turtle = lazy.serialize(format='turtle')
+		self.assertTrue(lazy.materialized())
+		self.assertEqual(len(graph), graph_size(lazy))
+		self.assertTrue(isomorphic(graph, Graph().parse(data=turtle, format='turtle')))
+		# the line formats read the loaded graph from then on
+		self.assertEqual(sorted(serialize_nt(graph).splitlines()), sorted(serialize_nt(lazy).splitlines()))
+		lazy = lazy_ctx_graph()
+		self.assertEqual(2, len(list(lazy.contexts())))
+		self.assertEqual(sorted(ctx_graph.serialize(format='nquads').splitlines()),
+		                 sorted(serialize_nquads(lazy).splitlines()))
+
+	def test_flask(self):
+		application = flask.Flask(__name__)
+		@application.route('/lazy')
+		@Decorator()
+		def lazy():
+			return lazy_graph(), 202
+		@application.route('/etag')
+		@Decorator(etags=True, cache_key=lambda: 'lazy')
+		def etag():
+			return lazy_graph()
+		app = webtest.TestApp(application)
+		response = app.get('/lazy', headers={'Accept': 'application/n-triples'})
+		self.assertEqual(202, response.status_int)
+		self.assertEqual(serialize_nt(graph), response.body)
+		response = app.get('/lazy', headers={'Accept': 'text/turtle'})
+		self.assertTrue(isomorphic(graph, Graph().parse(data=response.body, format='turtle')))
+		# the ETag comes from the view's key, without loading the graph
+		response = app.get('/etag', headers={'Accept': 'application/n-triples'})
+		self.assertEqual(serialize_nt(graph), response.body)
+		self.assertTrue('ETag' in response.headers)
+
+	def test_wsgi(self):
+		decorator = wsgi.Decorator(streaming=True, chunk_size=16)
+		app = webtest.TestApp(decorator(lambda environ, start_response: lazy_graph()))
+		response = app.get('/', headers={'Accept': 'application/n-triples'})
+		self.assertEqual(serialize_nt(graph), response.body)
+		response = app.get('/', headers={'Accept': 'application/rdf+xml'})
+		self.assertTrue(isomorphic(graph, Graph().parse(data=response.body, format='xml')))
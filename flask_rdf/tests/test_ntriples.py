@@ -0,0 +1,83 @@
+import unittest
+from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+from flask_rdf.ntriples import TermMemo, nt_chunks, nquads_chunks, serialize_nt, serialize_nquads, serialize_page
+from flask_rdf.format import FormatSelector
+
+
+def add_people(graph, size):
+	for i in range(size):
+		person = URIRef('http://example.com/#person%s' % i)
+		graph.add((person, RDF.type, FOAF.Person))
+		graph.add((person, FOAF.age, Literal(i, datatype=XSD.integer)))
+		graph.add((person, FOAF.name, Literal('Snowman ☃ "%s"\n\\\r' % i, lang='en')))
+
+def make_graph():
+	graph = Graph('IOMemory', BNode())
+	add_people(graph, 3)
+	person = URIRef('http://example.com/#person0')
+	node = BNode()
+	graph.add((person, FOAF.knows, node))
+	graph.add((node, FOAF.name, Literal('Astral \U0001F600')))
+	# literals that compare equal, but are written differently
+	graph.add((node, FOAF.age, Literal('1', datatype=XSD.integer)))
+	graph.add((node, FOAF.age, Literal('01', datatype=XSD.integer)))
+	graph.add((node, FOAF.nick, Literal('a', lang='EN')))
+	graph.add((node, FOAF.nick, Literal('a', lang='en')))
+	graph.add((node, FOAF.nick, Literal('plain')))
+	graph.add((node, FOAF.homepage, URIRef('http://example.com/☃')))
+	graph.add((Literal('subject'), FOAF.nick, Literal('subject')))
+	return graph
+graph = make_graph()
+
+def make_ctx_graph():
+	graph = ConjunctiveGraph('IOMemory')
+	for i in range(3):
+		context = graph.get_context(URIRef('http://example.com/#ctx%s' % i))
+		add_people(context, 2)
+	graph.get_context(BNode()).add((BNode(), FOAF.name, Literal('☃')))
+	return graph
+ctx_graph = make_ctx_graph()
+
+
+class TestNTriples(unittest.TestCase):
+	def test_nt_identical(self):
+		self.assertEqual(graph.serialize(format='nt'), serialize_nt(graph))
+
+	def test_nquads_identical(self):
+		self.assertEqual(ctx_graph.serialize(format='nquads'), serialize_nquads(ctx_graph))
+		self.assertRaises(Exception, serialize_nquads, graph)
+
+	def test_chunks(self):
+		chunks = list(nt_chunks(graph, 64))
+		self.assertTrue(len(chunks) > 1)
+		self.assertEqual(graph.serialize(format='nt'), b''.join(chunks))
+		chunks = list(nquads_chunks(ctx_graph, 64))
+		self.assertTrue(len(chunks) > 1)
+		self.assertEqual(ctx_graph.serialize(format='nquads'), b''.join(chunks))
+
+	def test_page(self):
+		for (mygraph, format) in [(graph, 'nt'), (ctx_graph, 'nquads')]:
+			pages = []
+			more = True
+			while more:
+				(page, more) = serialize_page(mygraph, format, len(pages) * 4, 4)
+				pages.append(page)
+			self.assertTrue(len(pages) > 1)
+			self.assertEqual(mygraph.serialize(format=format), b''.join(pages))
+		self.assertRaises(Exception, serialize_page, graph, 'nquads', 0, 4)
+
+	def test_memo(self):
+		memo = TermMemo(maxsize=2)
+		for literal in [Literal('a', lang='en'), Literal('a', lang='EN'), Literal('a')]:
+			self.assertEqual(literal.n3(), memo.object(literal))
+		for i in range(5):
+			uri = URIRef('http://example.com/%s' % i)
+			self.assertEqual(uri.n3(), memo.term(uri))
+			self.assertTrue(len(memo.terms) <= 2)
+
+	def test_selector(self):
+		self.assertEqual(serialize_nt, FormatSelector().get_serializer('nt'))
+		self.assertEqual(serialize_nquads, FormatSelector().get_serializer('nquads'))
+		self.assertEqual(None, FormatSelector().get_serializer('turtle'))
+		self.assertEqual(None, FormatSelector(builtin_serializers=False).get_serializer('nt'))
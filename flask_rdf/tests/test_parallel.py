@@ -0,0 +1,70 @@
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.namespace import FOAF
+from flask_rdf.common_decorators import ViewDecorator, serialize_graph
+from flask_rdf.parallel import ParallelSerializer, WireMemo, render_wire
+from flask_rdf.tests.test_ntriples import graph, ctx_graph
+
+
+class PlainDecorator(ViewDecorator):
+	@classmethod
+	def make_new_response(cls, old_response, mimetype, serialized):
+		return serialized
+
+
+class TestParallel(unittest.TestCase):
+	def test_wire(self):
+		memo = WireMemo()
+		for (s, p, o) in graph:
+			self.assertEqual(s.n3(), render_wire(memo.term(s)))
+			self.assertEqual(p.n3(), render_wire(memo.term(p)))
+		person = URIRef('http://example.com/#person')
+		self.assertTrue(memo.term(person) is memo.term(person))
+		self.assertRaises(Exception, render_wire, memo.term(URIRef('http://example.com/<bad>')))
+
+	def test_identical(self):
+		with ThreadPoolExecutor(2) as pool:
+			parallel = ParallelSerializer(pool, threshold=0, partition_size=3, window=2)
+			self.assertEqual(graph.serialize(format='nt'), parallel.serialize(graph, 'nt'))
+			self.assertEqual(ctx_graph.serialize(format='nquads'), parallel.serialize(ctx_graph, 'nquads'))
+			chunks = list(parallel.stream(graph, 'nt'))
+			self.assertTrue(len(chunks) > 2)
+			self.assertEqual(graph.serialize(format='nt'), b''.join(chunks))
+
+	def test_process_pool(self):
+		with ProcessPoolExecutor(2) as pool:
+			parallel = ParallelSerializer(pool, threshold=0, partition_size=4)
+			self.assertEqual(graph.serialize(format='nt'), parallel.serialize(graph, 'nt'))
+
+	def test_applies(self):
+		parallel = ParallelSerializer(None, threshold=5)
+		self.assertTrue(parallel.applies(graph, 'nt'))
+		self.assertTrue(parallel.applies(ctx_graph, 'nquads'))
+		self.assertFalse(parallel.applies(graph, 'nquads'))
+		self.assertFalse(parallel.applies(graph, 'turtle'))
+		parallel.threshold = len(graph) + 1
+		self.assertFalse(parallel.applies(graph, 'nt'))
+
+	def test_decorator(self):
+		class Executor(object):
+			submitted = 0
+			def submit(self, func, *args):
+				Executor.submitted += 1
+				with ThreadPoolExecutor(1) as pool:
+					return pool.submit(func, *args)
+		parallel = ParallelSerializer(Executor(), threshold=5, partition_size=4)
+		decorator = PlainDecorator(parallel=parallel)
+		nt = graph.serialize(format='nt')
+		self.assertEqual(nt, decorator.output(graph, 'application/n-triples'))
+		self.assertEqual(4, Executor.submitted)
+		# below the threshold
+		small = Graph()
+		small.add((BNode(), FOAF.name, Literal('small')))
+		self.assertEqual(small.serialize(format='nt'), decorator.output(small, 'application/n-triples'))
+		self.assertEqual(4, Executor.submitted)
+		# streamed
+		decorator.streaming = True
+		self.assertEqual(nt, b''.join(decorator.output(graph, 'application/n-triples')))
+		self.assertEqual(8, Executor.submitted)
+		self.assertEqual(nt, b''.join(serialize_graph(graph, 'nt', chunk_size=16, parallel=parallel)))
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import unittest
+import webtest
+from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+import flask
+from flask_rdf.snapshot import Snapshot, versioned
+from flask_rdf.common_decorators import graph_fingerprint
+from flask_rdf.flask import Decorator
+from flask_rdf import wsgi
+from flask_rdf.asgi import returns_rdf
+
+
+def make_graph(age=15):
+	graph = Graph('IOMemory', BNode())
+	person = URIRef('http://example.com/#person')
+	graph.add((person, RDF.type, FOAF.Person))
+	graph.add((person, FOAF.age, Literal(age, datatype=XSD.integer)))
+	return graph
+graph = make_graph()
+
+
+def asgi_app(returned):
+	async def app(scope, receive, send):
+		return returned
+	return app
+
+
+def asgi_request(app):
+	""" Calls an ASGI app, returning the response status """
+	messages = []
+	async def receive():
+		return {'type': 'http.request', 'body': b'', 'more_body': False}
+	async def send(message):
+		messages.append(message)
+	scope = {'type': 'http', 'path': '/', 'headers': [(b'accept', b'text/turtle')]}
+	asyncio.run(app(scope, receive, send))
+	return messages[0]['status']
+
+
+class UnhashableGraph(Graph):
+	""" Fails if its triples are read to fingerprint it """
+	def __iter__(self):
+		raise AssertionError('fingerprinted')
+
+
+class SlowSnapshot(Snapshot):
+	""" Renders only once it is allowed to """
+	def __init__(self, *args, **kwargs):
+		self.allowed = threading.Event()
+		super(SlowSnapshot, self).__init__(*args, **kwargs)
+
+	def render(self, rendition):
+		self.allowed.wait(5)
+		super(SlowSnapshot, self).render(rendition)
+
+
+class TestSnapshot(unittest.TestCase):
+	def test_render(self):
+		snapshot = Snapshot(graph, background=False)
+		rendition = snapshot.current()
+		self.assertEqual(1, snapshot.version)
+		self.assertEqual(graph.serialize(format='turtle'), rendition.bodies['turtle'])
+		self.assertEqual(graph.serialize(format='xml'), rendition.bodies['xml'])
+		self.assertFalse('nquads' in rendition.bodies)
+		self.assertEqual(graph_fingerprint(graph), graph_fingerprint(rendition))
+		ctx_graph = ConjunctiveGraph('IOMemory')
+		ctx_graph.get_context(URIRef('http://example.com/#ctx')).add((BNode(), FOAF.name, Literal('x')))
+		snapshot.publish(ctx_graph)
+		self.assertEqual(2, snapshot.version)
+		self.assertEqual(ctx_graph.serialize(format='nquads'), snapshot.current().bodies['nquads'])
+		self.assertEqual(None, Snapshot().current())
+
+	def test_swap(self):
+		snapshot = SlowSnapshot(graph)
+		# the first version is served live while it renders
+		self.assertEqual({}, snapshot.current().bodies)
+		snapshot.allowed.set()
+		snapshot.publish(graph).join()
+		old = snapshot.current()
+		self.assertEqual(2, old.version)
+		snapshot.allowed.clear()
+		new_graph = make_graph(16)
+		thread = snapshot.publish(new_graph)
+		# the previous version is served until the new one is rendered
+		self.assertTrue(snapshot.current() is old)
+		snapshot.allowed.set()
+		thread.join()
+		self.assertEqual(3, snapshot.version)
+		self.assertEqual(new_graph.serialize(format='turtle'), snapshot.current().bodies['turtle'])
+
+	def test_flask(self):
+		snapshot = Snapshot(graph, background=False)
+		snapshot.current().bodies['turtle'] = b'prerendered'
+		application = flask.Flask(__name__)
+		@application.route('/snapshot')
+		@Decorator(etags=True)
+		def view():
+			return snapshot
+		app = webtest.TestApp(application)
+		response = app.get('/snapshot', headers={'Accept': 'text/turtle'})
+		self.assertEqual(b'prerendered', response.body)
+		self.assertEqual('11', response.headers['Content-Length'])
+		self.assertEqual('text/turtle; charset=utf-8', response.headers['Content-Type'])
+		etag = response.headers['ETag']
+		app.get('/snapshot', headers={'Accept': 'text/turtle', 'If-None-Match': etag}, status=304)
+
+	def test_wsgi(self):
+		snapshot = Snapshot(graph, background=False)
+		app = webtest.TestApp(wsgi.Decorator()(lambda environ, start_response: snapshot))
+		response = app.get('/', headers={'Accept': 'application/n-triples'})
+		nt = graph.serialize(format='nt')
+		self.assertEqual(nt, response.body)
+		self.assertEqual(str(len(nt)), response.headers['Content-Length'])
+
+	def test_unpublished(self):
+		snapshot = Snapshot()
+		application = flask.Flask(__name__)
+		@application.route('/snapshot')
+		@Decorator(etags=True)
+		def view():
+			return snapshot
+		app = webtest.TestApp(application)
+		response = app.get('/snapshot', headers={'Accept': 'text/turtle'}, status=503)
+		self.assertFalse('ETag' in response.headers)
+		app = webtest.TestApp(wsgi.Decorator()(lambda environ, start_response: snapshot))
+		response = app.get('/', headers={'Accept': 'text/turtle'}, status=503)
+		self.assertEqual(b'503 Service Unavailable', response.body)
+		status = asgi_request(returns_rdf(asgi_app(snapshot)))
+		self.assertEqual(503, status)
+		# it is sent once it is published
+		snapshot.publish(graph)
+		self.assertEqual(200, asgi_request(returns_rdf(asgi_app(snapshot))))
+		response = app.get('/', headers={'Accept': 'text/turtle'})
+		self.assertEqual(graph.serialize(format='turtle'), response.body)
+
+	def test_versioned(self):
+		unhashable = UnhashableGraph('IOMemory', BNode())
+		self.assertEqual('v-3', graph_fingerprint(versioned(unhashable, 3)))
+		application = flask.Flask(__name__)
+		@application.route('/versioned')
+		@Decorator(etags=True)
+		def view():
+			return versioned(unhashable, 3)
+		app = webtest.TestApp(application)
+		etag = app.get('/versioned', headers={'Accept': 'text/turtle'}).headers['ETag']
+		app.get('/versioned', headers={'Accept': 'text/turtle', 'If-None-Match': etag}, status=304)
+		# a new version gets a new ETag
+		app = webtest.TestApp(wsgi.Decorator(etags=True)(lambda environ, start_response: versioned(graph, 4)))
+		response = app.get('/', headers={'Accept': 'text/turtle', 'If-None-Match': etag})
+		self.assertEqual(graph.serialize(format='turtle'), response.body)
@@ -0,0 +1,106 @@
+import unittest
+import zlib
+from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
+from rdflib.namespace import RDF, FOAF, XSD
+from flask_rdf.streaming import serialize_stream, iter_chunks, QueueWriter, StreamCancelled
+from flask_rdf.streaming import encode_body
+
+
+def make_graph(size=2):
+	graph = Graph('IOMemory', BNode())
+	for i in range(size):
+		person = URIRef('http://example.com/#person%s' % i)
+		graph.add((person, RDF.type, FOAF.Person))
+		graph.add((person, FOAF.age, Literal(i, datatype=XSD.integer)))
+		graph.add((person, FOAF.name, Literal('Snowman ☃ "%s"\n' % i, lang='en')))
+	return graph
+graph = make_graph()
+big_graph = make_graph(500)
+
+def make_ctx_graph():
+	graph = ConjunctiveGraph('IOMemory')
+	for i in range(3):
+		context = graph.get_context(URIRef('http://example.com/#ctx%s' % i))
+		person = URIRef('http://example.com/#person%s' % i)
+		context.add((person, RDF.type, FOAF.Person))
+		context.add((person, FOAF.name, Literal('☃')))
+	return graph
+ctx_graph = make_ctx_graph()
+
+
+class TestStreaming(unittest.TestCase):
+	def test_line_formats(self):
+		for format in ['nt']:
+			expected = big_graph.serialize(format=format)
+			chunks = list(serialize_stream(big_graph, format, chunk_size=1024))
+			self.assertTrue(len(chunks) > 1)
+			self.assertEqual(expected, b''.join(chunks))
+		expected = ctx_graph.serialize(format='nquads')
+		self.assertEqual(expected, b''.join(serialize_stream(ctx_graph, 'nquads')))
+
+	def test_threaded_formats(self):
+		for format in ['xml', 'turtle', 'n3']:
+			expected = graph.serialize(format=format)
+			chunks = list(serialize_stream(graph, format, chunk_size=16))
+			self.assertTrue(len(chunks) > 1)
+			self.assertEqual(expected, b''.join(chunks))
+		expected = ctx_graph.serialize(format='trix')
+		self.assertEqual(expected, b''.join(serialize_stream(ctx_graph, 'trix')))
+
+	def test_trig_contexts(self):
+		mygraph = make_ctx_graph()
+		mygraph.add((URIRef('http://example.com/#default'), RDF.type, FOAF.Person))
+		chunks = list(serialize_stream(mygraph, 'trig', chunk_size=16))
+		self.assertTrue(len(chunks) > 1)
+		parsed = ConjunctiveGraph()
+		parsed.parse(data=b''.join(chunks), format='trig')
+		self.assertEqual(len(mygraph), len(parsed))
+		for i in range(3):
+			identifier = URIRef('http://example.com/#ctx%s' % i)
+			self.assertEqual(set(mygraph.get_context(identifier)), set(parsed.get_context(identifier)))
+		# the default graph is written unnamed
+		self.assertEqual(4, len(list(parsed.contexts())))
+
+	def test_threaded_error(self):
+		stream = serialize_stream(graph, 'nonexistent')
+		self.assertRaises(Exception, list, stream)
+
+	def test_threaded_cancel(self):
+		stream = serialize_stream(big_graph, 'xml', chunk_size=16)
+		self.assertTrue(len(next(stream)) >= 16)
+		stream.close()
+
+	def test_iter_chunks(self):
+		lines = [b'ab', b'cd', b'ef', b'g']
+		self.assertEqual([b'abcd', b'efg'], list(iter_chunks(lines, 4)))
+		self.assertEqual([b'abcdefg'], list(iter_chunks(lines, 100)))
+
+	def test_writer(self):
+		writer = QueueWriter(chunk_size=4)
+		writer.write(b'ab')
+		self.assertTrue(writer.queue.empty())
+		writer.write(b'cd')
+		self.assertEqual(b'abcd', writer.queue.get())
+		writer.write(b'e')
+		writer.flush()
+		self.assertEqual(b'e', writer.queue.get())
+		writer.cancel()
+		self.assertRaises(StreamCancelled, writer.write, b'f')
+
+	def test_encode_body(self):
+		body = big_graph.serialize(format='nt')
+		self.assertEqual((body, None), encode_body(body, None))
+		self.assertEqual((b'small', None), encode_body(b'small', 'gzip'))
+		compressed, encoding = encode_body(body, 'gzip')
+		self.assertEqual('gzip', encoding)
+		self.assertEqual(body, zlib.decompress(compressed, 16 + zlib.MAX_WBITS))
+		compressed, encoding = encode_body(body, 'deflate')
+		self.assertEqual('deflate', encoding)
+		self.assertEqual(body, zlib.decompress(compressed))
+		# streamed bodies
+		chunks, encoding = encode_body(serialize_stream(big_graph, 'nt', 1024), 'gzip')
+		self.assertEqual('gzip', encoding)
+		self.assertEqual(body, zlib.decompress(b''.join(chunks), 16 + zlib.MAX_WBITS))
+		small, encoding = encode_body(serialize_stream(graph, 'nt', 16), 'gzip', min_size=100000)
+		self.assertEqual(None, encoding)
+		self.assertEqual(graph.serialize(format='nt'), small)
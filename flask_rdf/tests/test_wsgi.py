@@ -1,8 +1,10 @@
 import unittest
+import zlib
+import webob
 import webtest
 from rdflib import BNode, ConjunctiveGraph, Graph, Literal, URIRef
 from rdflib.namespace import RDF, RDFS, FOAF, XSD
-from flask_rdf.wsgi import returns_rdf, output, Decorator
+from flask_rdf.wsgi import returns_rdf, output, Decorator, Headers, merge_vary
 
 
 def make_graph():
@@ -151,6 +153,46 @@ class TestCases(unittest.TestCase):
 		response = app.get('/sneaky', headers=headers)
 		self.assertEqual(test_str.encode('utf-8'), response.body)
 
+	def test_passthrough(self):
+		calls = []
+		def start_response(status, headers, exc_info=None):
+			calls.append((status, headers))
+			return calls.append
+		body = ['This is a test string'.encode('utf-8')]
+		headers = [('Content-Type', 'text/plain')]
+		def text_app(environ, start_response):
+			start_response('201 Created', headers)
+			return body
+		response = Decorator()(text_app)({'PATH_INFO': '/text'}, start_response)
+		self.assertTrue(response is body)
+		self.assertEqual([('201 Created', headers)], calls)
+		self.assertEqual([('Content-Type', 'text/plain')], headers)
+
+	def test_headers(self):
+		headers = Headers([('Content-Type', 'text/plain'), ('X-Test', 'a'), ('x-test', 'b')])
+		self.assertEqual('text/plain', headers.get('content-type'))
+		self.assertEqual(['a', 'b'], headers.get_all('X-TEST'))
+		self.assertEqual(None, headers.get('Vary'))
+		headers['content-type'] = 'text/turtle'
+		headers['X-Test'] = 'c'
+		headers['Vary'] = 'Accept'
+		self.assertEqual([('content-type', 'text/turtle'), ('X-Test', 'c'), ('Vary', 'Accept')],
+		                 headers.items)
+		headers['x-test'] = 'd'
+		self.assertEqual(['d'], headers.get_all('x-test'))
+
+	def test_merge_vary(self):
+		for existing, expected in [
+				([], ['Accept, Accept-Encoding']),
+				([('Vary', 'Cookie')], ['Cookie, Accept, Accept-Encoding']),
+				([('Vary', 'accept')], ['accept, Accept-Encoding']),
+				([('Vary', 'Accept, Accept-Encoding')], ['Accept, Accept-Encoding']),
+				([('Vary', 'Cookie'), ('Vary', 'Accept')], ['Cookie, Accept, Accept-Encoding']),
+				([('Vary', '*')], ['*'])]:
+			headers = Headers(existing)
+			merge_vary(headers, ('Accept', 'Accept-Encoding'))
+			self.assertEqual(expected, headers.get_all('Vary'))
+
 	def test_unicode(self):
 		mygraph = unicode_graph
 		turtle = mygraph.serialize(format='turtle')
@@ -215,3 +257,189 @@ class TestCases(unittest.TestCase):
 		decorated = decorator(decoratee)
 		response = decorated({}, lambda *args: None)
 		self.assertEqual(xml, response[0])
+
+	def test_streaming(self):
+		decorator = Decorator(streaming=True, chunk_size=16)
+		@decorator
+		def streaming_app(environ, start_response):
+			if environ.get('PATH_INFO') == '/text':
+				return ['This is a test string'.encode('utf-8')]
+			return unicode_graph
+		streaming_client = webtest.TestApp(streaming_app)
+		for accept, format in [('text/turtle', 'turtle'), ('application/n-triples', 'nt')]:
+			expected = unicode_graph.serialize(format=format)
+			response = streaming_client.get('/test', headers={'Accept': accept})
+			self.assertEqual(expected, response.body)
+			self.assertEqual('Accept', response.headers['vary'])
+			self.assertEqual(200, response.status_int)
+		response = streaming_client.get('/text')
+		self.assertEqual('This is a test string'.encode('utf-8'), response.body)
+		# the raw iterable is chunked
+		chunks = decorator.output(unicode_graph, 'text/turtle', lambda *args: None, lambda *args: None)
+		self.assertTrue(len(list(chunks)) > 1)
+
+	def test_cache(self):
+		from flask_rdf.common_decorators import LRUResponseCache
+		cache = LRUResponseCache()
+		decorator = Decorator(cache=cache, cache_key=lambda environ: environ.get('PATH_INFO'))
+		cached_client = webtest.TestApp(decorator(lambda environ, start_response: graph))
+		turtle = graph.serialize(format='turtle')
+		response = cached_client.get('/test', headers={'Accept': 'text/turtle'})
+		self.assertEqual(turtle, response.body)
+		self.assertEqual(turtle, cache.get('/test turtle'))
+		cache.set('/test turtle', b'cached')
+		response = cached_client.get('/test', headers={'Accept': 'text/turtle'})
+		self.assertEqual(b'cached', response.body)
+		self.assertEqual('text/turtle; charset=utf-8', response.headers['content-type'])
+
+	def test_etag(self):
+		class UnserializableGraph(Graph):
+			def serialize(self, *args, **kwargs):
+				raise AssertionError('serialized')
+		unserializable = UnserializableGraph()
+		for triple in graph:
+			unserializable.add(triple)
+		response = webtest.TestApp(Decorator(etags=True)(lambda environ, start_response: graph)).get('/test')
+		self.assertFalse('ETag' in response.headers)
+		decorator = Decorator(etags=True, cache_key=lambda environ: environ['PATH_INFO'])
+		etag_client = webtest.TestApp(decorator(lambda environ, start_response: graph))
+		response = etag_client.get('/test', headers={'Accept': 'text/turtle'})
+		etag = response.headers['ETag']
+		self.assertEqual(graph.serialize(format='turtle'), response.body)
+		# the 304 doesn't serialize at all
+		etag_client = webtest.TestApp(decorator(lambda environ, start_response: unserializable))
+		response = etag_client.get('/test', headers={'Accept': 'text/turtle', 'If-None-Match': etag})
+		self.assertEqual(304, response.status_int)
+		self.assertEqual(etag, response.headers['ETag'])
+		self.assertEqual('Accept', response.headers['vary'])
+
+	def test_compress(self):
+		decorator = Decorator(compress=True, compress_min_size=10, streaming=True, chunk_size=16)
+		def compressed_app(environ, start_response):
+			start_response('200 OK', [('Vary', 'Cookie')])
+			return graph
+		compressed_client = decorator(compressed_app)
+		nt = graph.serialize(format='nt')
+		headers = {'Accept': 'application/n-triples', 'Accept-Encoding': 'gzip'}
+		response = webob.Request.blank('/test', headers=headers).get_response(compressed_client)
+		self.assertEqual('gzip', response.headers['Content-Encoding'])
+		self.assertEqual(nt, zlib.decompress(response.body, 16 + zlib.MAX_WBITS))
+		vary = sorted(v.strip() for v in response.headers['vary'].split(','))
+		self.assertEqual(['Accept', 'Accept-Encoding', 'Cookie'], vary)
+		# below the threshold
+		decorator.compress_min_size = 100000
+		response = webob.Request.blank('/test', headers=headers).get_response(compressed_client)
+		self.assertFalse('Content-Encoding' in response.headers)
+		self.assertEqual(nt, response.body)
+
+	def test_ranges(self):
+		from flask_rdf.common_decorators import LRUResponseCache
+		class UnserializableGraph(Graph):
+			def serialize(self, *args, **kwargs):
+				raise AssertionError('serialized')
+		unserializable = UnserializableGraph()
+		decorator = Decorator(ranges=True, cache=LRUResponseCache(), cache_key=lambda environ: 'ranges')
+		headers = {'Accept': 'text/turtle'}
+		turtle = graph.serialize(format='turtle')
+		response = webtest.TestApp(decorator(lambda environ, start_response: graph)).get('/test', headers=headers)
+		self.assertEqual('bytes', response.headers['Accept-Ranges'])
+		self.assertEqual(turtle, response.body)
+		# ranges of the cached body don't serialize again
+		range_client = webtest.TestApp(decorator(lambda environ, start_response: unserializable))
+		headers['Range'] = 'bytes=-5'
+		response = range_client.get('/test', headers=headers)
+		self.assertEqual(206, response.status_int)
+		self.assertEqual(turtle[-5:], response.body)
+		self.assertEqual('bytes %d-%d/%d' % (len(turtle) - 5, len(turtle) - 1, len(turtle)), response.headers['Content-Range'])
+		headers['Range'] = 'bytes=100000-'
+		response = range_client.get('/test', headers=headers, status=416)
+		self.assertEqual('bytes */%d' % len(turtle), response.headers['Content-Range'])
+		# without a stored body, the whole body is sent
+		uncached = Decorator(ranges=True)
+		response = webtest.TestApp(uncached(lambda environ, start_response: graph)).get('/test', headers=headers)
+		self.assertEqual(200, response.status_int)
+		self.assertFalse('Accept-Ranges' in response.headers)
+		self.assertEqual(turtle, response.body)
+
+	def test_pages(self):
+		paged_graph = make_graph()
+		decorator = Decorator(page_size=1, page_parameter='p')
+		paged_client = webtest.TestApp(decorator(lambda environ, start_response: paged_graph))
+		headers = {'Accept': 'application/n-triples'}
+		response = paged_client.get('/test', headers=headers)
+		self.assertEqual('<?p=2>; rel="next"', response.headers['Link'])
+		body = response.body
+		response = paged_client.get('/test?p=2', headers=headers)
+		self.assertFalse('Link' in response.headers)
+		self.assertEqual(paged_graph.serialize(format='nt'), body + response.body)
+
+	def test_prenegotiate(self):
+		from flask_rdf.common_decorators import LRUResponseCache, NEGOTIATION_KEY
+		calls = []
+		def counted_app(environ, start_response):
+			calls.append(environ[NEGOTIATION_KEY].decide())
+			start_response('200 OK', [])
+			return graph
+		decorator = Decorator(prenegotiate=True, compress=True, compress_min_size=10,
+		                      cache=LRUResponseCache(), cache_key=lambda environ: 'prenegotiate')
+		client = webtest.TestApp(decorator(counted_app))
+		client.get('/test', headers={'Accept': 'image/png'}, status=406)
+		self.assertEqual([], calls)
+		nt = graph.serialize(format='nt')
+		headers = {'Accept': 'application/n-triples'}
+		self.assertEqual(nt, client.get('/test', headers=headers).body)
+		self.assertEqual([('application/n-triples', 'nt')], calls)
+		headers['Accept-Encoding'] = 'gzip'
+		response = webob.Request.blank('/test', headers=headers).get_response(decorator(counted_app))
+		self.assertEqual(1, len(calls))
+		self.assertEqual('gzip', response.headers['Content-Encoding'])
+		self.assertEqual('Accept, Accept-Encoding', response.headers['Vary'])
+		self.assertEqual(nt, zlib.decompress(response.body, 16 + zlib.MAX_WBITS))
+
+	def test_revalidate(self):
+		from flask_rdf.common_decorators import TTLResponseCache
+		now = [0]
+		new_graph = make_graph()
+		new_graph.add((URIRef('http://example.com/#person'), FOAF.name, Literal('new')))
+		graphs = [graph, new_graph]
+		calls = []
+		def counted_app(environ, start_response):
+			calls.append(environ['PATH_INFO'])
+			start_response('200 OK', [])
+			return graphs[len(calls) - 1]
+		decorator = Decorator(cache=TTLResponseCache(ttl=30, clock=lambda: now[0]),
+		                      cache_key=lambda environ: 'revalidate', max_age=10, stale_while_revalidate=20)
+		client = webtest.TestApp(decorator(counted_app))
+		headers = {'Accept': 'application/n-triples'}
+		nt = graph.serialize(format='nt')
+		response = client.get('/test', headers=headers)
+		self.assertEqual(nt, response.body)
+		self.assertEqual('max-age=10, stale-while-revalidate=20', response.headers['Cache-Control'])
+		now[0] = 15
+		response = client.get('/test', headers=headers)
+		self.assertEqual(nt, response.body)
+		self.assertEqual('max-age=10, stale-while-revalidate=20', response.headers['Cache-Control'])
+		decorator.revalidator.wait(5)
+		self.assertEqual(['/test', '/test'], calls)
+		self.assertEqual(new_graph.serialize(format='nt'), client.get('/test', headers=headers).body)
+		self.assertEqual(2, len(calls))
+
+	def test_content_length(self):
+		def sized_app(environ, start_response):
+			start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '5')])
+			return graph
+		turtle = graph.serialize(format='turtle')
+		for decorator in [Decorator(streaming=True, chunk_size=16),
+		                  Decorator(etags=True, cache_key=lambda environ: 'sized')]:
+			# webtest's lint checks the Content-Length against the body
+			client = webtest.TestApp(decorator(sized_app))
+			response = client.get('/test', headers={'Accept': 'text/turtle'})
+			self.assertEqual(turtle, response.body)
+			client.get('/test', headers={'Accept': 'image/png'}, status=406)
+		etag = response.headers['ETag']
+		response = client.get('/test', headers={'Accept': 'text/turtle', 'If-None-Match': etag}, status=304)
+		self.assertFalse('Content-Length' in response.headers)
+		headers = Headers([('Content-Length', '5'), ('Vary', 'Cookie'), ('content-length', '6')])
+		headers.remove('Content-Length')
+		self.assertEqual([('Vary', 'Cookie')], headers.items)
+		self.assertEqual(None, headers.get('content-length'))
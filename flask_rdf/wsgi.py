@@ -1,19 +1,195 @@
 from __future__ import absolute_import
-from .format import decide, FormatSelector
-from rdflib.graph import Graph
-from six import BytesIO
-import itertools
+from .format import FormatSelector
+from .streaming import encode_body, DEFAULT_CHUNK_SIZE, COMPRESS_MIN_SIZE
+from .common_decorators import serialize_graph, stored_serialization, render_graph, known_fingerprint, make_etag, etag_matches, is_graph
+from .common_decorators import select_range, parse_page, page_link, make_cache_key
+from .common_decorators import Prenegotiation, NEGOTIATION_KEY
+from .common_decorators import TTLResponseCache, Revalidator, cache_control, share_graph
+from .coalesce import SingleFlight
+from .snapshot import resolve_graph
+from .instrumentation import start_stats
+import io
+import six
+
+
+class Headers(object):
+	""" List of WSGI (header, value) pairs with case-insensitive lookups
+	    Setting a header replaces it in place, through an index of the
+	    first position of each header name
+	"""
+	__slots__ = ('items', '_index', '_repeated')
+
+	def __init__(self, items=None):
+		self.items = list(items) if items else []
+		self._index = {}
+		self._repeated = False
+		for position, (header, value) in enumerate(self.items):
+			key = header.lower()
+			if key in self._index:
+				self._repeated = True
+			else:
+				self._index[key] = position
+
+	def get(self, header, default=None):
+		""" Returns the first value of this header """
+		position = self._index.get(header.lower())
+		if position is None:
+			return default
+		return self.items[position][1]
+
+	def get_all(self, header):
+		""" Returns every value of this header """
+		key = header.lower()
+		if not self._repeated:
+			position = self._index.get(key)
+			return [] if position is None else [self.items[position][1]]
+		return [v for (h, v) in self.items if h.lower() == key]
+
+	def __contains__(self, header):
+		return header.lower() in self._index
+
+	def __setitem__(self, header, value):
+		key = header.lower()
+		position = self._index.get(key)
+		if position is None:
+			self._index[key] = len(self.items)
+			self.items.append((header, value))
+			return
+		self.items[position] = (header, value)
+		if self._repeated:
+			# drop any later copies of this header
+			items = [(h, v) for (i, (h, v)) in enumerate(self.items)
+			         if i == position or h.lower() != key]
+			self.__init__(items)
+
+	def remove(self, header):
+		""" Removes every value of this header """
+		key = header.lower()
+		if key in self._index:
+			self.__init__([(h, v) for (h, v) in self.items if h.lower() != key])
+
+
+def merge_vary(headers, varies):
+	""" Adds header names to the Vary header, unless it already varies on * """
+	existing = headers.get_all('Vary')
+	if not existing:
+		headers['Vary'] = ', '.join(varies)
+		return
+	elements = []
+	for value in existing:
+		for element in value.split(','):
+			element = element.strip()
+			if element and element not in elements:
+				elements.append(element)
+	if '*' in elements:
+		return
+	lowered = [e.lower() for e in elements]
+	missing = [v for v in varies if v.lower() not in lowered]
+	if missing or len(existing) > 1:
+		headers['Vary'] = ', '.join(elements + missing)
+
+
+class CapturedResponse(object):
+	""" The start_response given to a wrapped WSGI app
+	    Records the status and headers, to be replayed to the server once
+	    the app returns, and buffers write() data only if the app uses it
+	"""
+	__slots__ = ('start_response', 'status', 'headers', 'exc_info', 'written')
+
+	def __init__(self, start_response):
+		self.start_response = start_response
+		self.status = '200 OK'
+		self.headers = []
+		self.exc_info = None
+		self.written = None
+
+	def __call__(self, status, headers, exc_info=None):
+		self.status = status
+		self.headers = headers
+		self.exc_info = exc_info
+		return self.write
+
+	def write(self, data):
+		if self.written is None:
+			self.written = []
+		self.written.append(data)
+
+	def set_http_code(self, status):
+		self.status = str(status)
+
+	def set_header(self, header, value):
+		self.headers[header] = value
+
+	def set_content_type(self, content_type):
+		self.headers['Content-Type'] = content_type
+
+	def replay(self, headers):
+		""" Calls the server's start_response and sends any written data """
+		if self.exc_info is None:
+			write = self.start_response(self.status, headers)
+		else:
+			write = self.start_response(self.status, headers, self.exc_info)
+		if self.written:
+			for data in self.written:
+				write(data)
 
 
 class Decorator(object):
-	def __init__(self, format_selector=None):
+	def __init__(self, format_selector=None, streaming=False, chunk_size=DEFAULT_CHUNK_SIZE,
+	             cache=None, cache_key=None, etags=False,
+	             compress=False, compress_min_size=COMPRESS_MIN_SIZE, instrumentation=None,
+	             parallel=None, ranges=False, page_size=None, page_parameter='page',
+	             prenegotiate=False, max_age=None, stale_while_revalidate=0,
+	             coalesce_key=None, coalesce_timeout=10.0):
 		self.format_selector = format_selector
 		if self.format_selector is None:
 			self.format_selector = FormatSelector()
+		# whether to send the serialization in chunks as it is generated
+		self.streaming = streaming
+		self.chunk_size = chunk_size
+		# ResponseCache of serialized graphs
+		self.cache = cache
+		# function of the WSGI environ that identifies the app's graph
+		self.cache_key = cache_key
+		# whether to send ETags and answer If-None-Match with 304s
+		self.etags = etags
+		# whether to negotiate Accept-Encoding and compress big enough bodies
+		self.compress = compress
+		self.compress_min_size = compress_min_size
+		# Instrumentation to record the ResponseStats of graph responses
+		self.instrumentation = instrumentation
+		# ParallelSerializer for big graphs, or None to serialize on one core
+		self.parallel = parallel
+		# whether to answer Range requests for serialized bodies
+		self.ranges = ranges
+		# triples per page of line-based formats, or None to send whole graphs
+		self.page_size = page_size
+		self.page_parameter = page_parameter
+		# whether to negotiate before the app runs, answering 406s and
+		# cache hits without it
+		self.prenegotiate = prenegotiate
+		# seconds that cached serializations are fresh for, and then
+		# sent stale for while the app runs again in the background
+		self.max_age = max_age
+		self.stale_while_revalidate = stale_while_revalidate
+		if max_age is not None and cache is not None and not isinstance(cache, TTLResponseCache):
+			self.cache = TTLResponseCache(cache, max_age + stale_while_revalidate)
+		self.revalidator = Revalidator()
+		# function of the WSGI environ that identifies the requests whose
+		# concurrent app calls and serializations are shared
+		self.coalesce_key = coalesce_key
+		self.flights = SingleFlight(coalesce_timeout)
+
+	@property
+	def _graph_varies(self):
+		""" The request headers that graph responses vary on """
+		if self.compress:
+			return ('Accept', 'Accept-Encoding')
+		return ('Accept',)
 
 	@staticmethod
 	def _is_graph(obj):
-		return isinstance(obj, Graph)
+		return is_graph(obj)
 
 	@staticmethod
 	def _get_graph(output):
@@ -21,31 +197,236 @@ class Decorator(object):
 		if Decorator._is_graph(output):	# single graph object
 			return output
 
-	def output(self, output, accepts, set_http_code, set_content_type):
+	def output(self, output, accepts, set_http_code, set_content_type, cache_key=None,
+	           set_header=None, if_none_match=None, accept_encoding=None,
+	           range_header=None, if_range=None, query=None):
 		""" Formats a response from a WSGI app to handle any RDF graphs
 		    If a view function returns a single RDF graph, serialize it based on Accept header
 		    If it's not an RDF graph, return it without any special handling
+		    cache_key identifies the graph in the cache and its ETag
+		    set_header(header, value) is used to send the ETag, if they are enabled,
+		    and if_none_match is checked against it
+		    accept_encoding picks the compression, if it is enabled, and
+		    set_header sends the Content-Encoding
+		    range_header selects the bytes to send, if ranges are enabled,
+		    unless if_range doesn't match the ETag
+		    query holds the page to send, if pagination is enabled
+		    The phases are timed if there is an instrumentation
 		"""
 
-		graph = Decorator._get_graph(output)
+		graph = resolve_graph(Decorator._get_graph(output))
+		if graph is None and Decorator._is_graph(output):
+			# a Snapshot that isn't published yet
+			return self.error_body('503 Service Unavailable', set_http_code, set_content_type, set_header)
 		if graph is not None:
+			stats = start_stats(graph, self.instrumentation)
 			# decide the format
 			output_mimetype, output_format = self.format_selector.decide(accepts, graph.context_aware)
 			# requested content couldn't find anything
 			if output_mimetype is None:
-				set_http_code("406 Not Acceptable")
-				return ['406 Not Acceptable'.encode('utf-8')]
+				body = self.error_body('406 Not Acceptable', set_http_code, set_content_type, set_header)
+				stats.lap('negotiate')
+				stats.record()
+				return body
 			# explicitly mark text mimetypes as utf-8
 			if 'text' in output_mimetype:
 				output_mimetype = output_mimetype + '; charset=utf-8'
 
+			page = None
+			if self.page_size is not None and set_header is not None:
+				from .ntriples import line_formats
+				if output_format in line_formats:
+					page = parse_page(query, self.page_parameter)
+			encoding = None
+			if self.compress and set_header is not None:
+				encoding = self.format_selector.decide_encoding(accept_encoding)
+			if self.max_age is not None and set_header is not None:
+				set_header('Cache-Control', cache_control(self.max_age, self.stale_while_revalidate))
+			etag = None
+			fingerprint = known_fingerprint(graph, cache_key) if self.etags else None
+			if fingerprint is not None:
+				etag = make_etag(fingerprint, output_mimetype, encoding, page)
+				if set_header is not None:
+					set_header('ETag', etag)
+				if etag_matches(if_none_match, etag):
+					set_http_code("304 Not Modified")
+					stats.lap('negotiate')
+					stats.record()
+					return []
+			stats.lap('negotiate')
+			stats.set_format(output_format, output_mimetype)
+
 			# format the new response
-			serialized = graph.serialize(format=output_format)
 			set_content_type(output_mimetype)
-			return [serialized]
+			if page is not None:
+				from .ntriples import serialize_page
+				(serialized, more) = serialize_page(graph, output_format, (page - 1) * self.page_size,
+				                                    self.page_size)
+				if more:
+					set_header('Link', page_link(query, self.page_parameter, page + 1))
+			stored = False
+			if page is None:
+				(serialized, stored_key) = stored_serialization(graph, output_format, self.cache, cache_key)
+				stored = serialized is not None
+				if not stored:
+					chunk_size = self.chunk_size if self.streaming else None
+					serializer = self.format_selector.get_serializer(output_format)
+					serialized = render_graph(graph, output_format, self.cache, stored_key, chunk_size,
+					                          serializer, self.parallel)
+			stats.lap('serialize')
+			if set_header is not None:
+				serialized = self.finish_body(serialized, encoding, etag, set_http_code, set_header,
+				                              range_header, if_range, stored)
+			stats.lap('compress')
+			serialized = stats.measure(serialized)
+			stats.record()
+			if isinstance(serialized, (six.binary_type, six.text_type)):
+				return [serialized]
+			return serialized
 		else:
 			return output
 
+	@staticmethod
+	def error_body(status, set_http_code, set_content_type, set_header=None):
+		""" Sets an error status, and returns its plain text body """
+		set_http_code(status)
+		body = status.encode('utf-8')
+		if set_header is not None:
+			set_content_type('text/plain')
+			set_header('Content-Length', str(len(body)))
+		return [body]
+
+	def finish_body(self, serialized, encoding, etag, set_http_code, set_header, range_header=None, if_range=None,
+	                stored=False):
+		""" Compresses a serialized body with the negotiated encoding, and
+		    selects the requested range of it, if ranges are enabled
+		    Like ViewDecorator.range_body, only stored bodies, from the cache
+		    or a Snapshot, are sliced
+		"""
+		if encoding is not None:
+			serialized, encoding = encode_body(serialized, encoding, self.compress_min_size)
+			if encoding is not None:
+				set_header('Content-Encoding', encoding)
+		if self.ranges and isinstance(serialized, six.binary_type) and (stored or self.cache is not None):
+			set_header('Accept-Ranges', 'bytes')
+			if stored and (if_range is None or if_range == etag):
+				(status, serialized, content_range) = select_range(serialized, range_header)
+				if status == 206:
+					set_http_code('206 Partial Content')
+					set_header('Content-Range', content_range)
+				elif status == 416:
+					set_http_code('416 Range Not Satisfiable')
+					set_header('Content-Range', content_range)
+		if isinstance(serialized, six.binary_type):
+			set_header('Content-Length', str(len(serialized)))
+		return serialized
+
+	def cached_output(self, negotiation, environ, start_response, app=None):
+		""" Answers a prenegotiated request from the cache, without running the app
+		    Like ViewDecorator.respond_cached, it needs a cache_key and no
+		    ETags, and the body is sent with a 200 and none of the app's headers
+		    A stale body is sent too, while the app is run again in the
+		    background to cache a new one
+		    Returns None if the request can't be answered from the cache
+		"""
+		if self.cache is None or self.cache_key is None or self.etags:
+			return None
+		(mimetype, format) = negotiation.decide(True)
+		if format is None:
+			return None
+		if self.page_size is not None:
+			from .ntriples import line_formats
+			if format in line_formats:
+				return None
+		cache_key = self.cache_key(environ)
+		key = make_cache_key(None, format, cache_key)
+		if self.max_age is not None:
+			(serialized, age) = self.cache.lookup(key)
+			if serialized is not None and age > self.max_age and app is not None:
+				# the request's body is gone once it has been answered
+				refresh_environ = dict(environ, CONTENT_LENGTH='0')
+				refresh_environ['wsgi.input'] = io.BytesIO()
+				self.revalidator.start(key, lambda: self.refresh(app, refresh_environ, cache_key))
+		else:
+			serialized = self.cache.get(key)
+		if serialized is None:
+			return None
+		if 'text' in mimetype:
+			mimetype = mimetype + '; charset=utf-8'
+		captured = CapturedResponse(start_response)
+		headers = captured.headers = Headers([('Content-Type', mimetype)])
+		if self.max_age is not None:
+			headers['Cache-Control'] = cache_control(self.max_age, self.stale_while_revalidate)
+		encoding = None
+		if self.compress:
+			encoding = self.format_selector.decide_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+		(range_header, if_range) = (None, None)
+		if environ.get('REQUEST_METHOD', 'GET') == 'GET':
+			(range_header, if_range) = (environ.get('HTTP_RANGE'), environ.get('HTTP_IF_RANGE'))
+		serialized = self.finish_body(serialized, encoding, None, captured.set_http_code, captured.set_header,
+		                              range_header, if_range, True)
+		merge_vary(headers, self._graph_varies)
+		captured.replay(headers.items)
+		return [serialized]
+
+	def refresh(self, app, environ, cache_key):
+		""" Runs the app again and caches its graph in the negotiated format,
+		    replacing a stale serialization
+		"""
+		returned = app(environ, CapturedResponse(None))
+		graph = resolve_graph(Decorator._get_graph(returned))
+		if graph is None:
+			if hasattr(returned, 'close'):
+				returned.close()
+			return
+		(mimetype, format) = self.format_selector.decide(environ.get('HTTP_ACCEPT', ''), graph.context_aware)
+		if format is None:
+			return
+		serializer = self.format_selector.get_serializer(format)
+		serialized = serialize_graph(graph, format, serializer=serializer, parallel=self.parallel)
+		self.cache.set(make_cache_key(graph, format, cache_key), serialized)
+
+	def run_coalesced(self, app, environ, start_response):
+		""" Runs the app once for the concurrent requests with the same
+		    coalesce_key and the same formats decided from their Accept
+		    header, and serializes its graph once for them
+		    Returns the (CapturedResponse, returned) of the app's call
+		"""
+		accept = environ.get('HTTP_ACCEPT', '')
+		negotiation = Prenegotiation(self.format_selector, accept)
+		key = '%s %s %s' % (self.coalesce_key(environ), negotiation.format, negotiation.context_format)
+		(flight, leader) = self.flights.begin(key)
+		captured = CapturedResponse(start_response)
+		if not leader:
+			shared = self.flights.wait(flight)
+			if shared is None:
+				return (captured, app(environ, captured))
+			(captured.status, headers, captured.written, returned) = shared
+			captured.headers = list(headers)
+			return (captured, returned)
+		shared = None
+		try:
+			returned = app(environ, captured)
+			graph = resolve_graph(Decorator._get_graph(returned))
+			if graph is None:
+				return (captured, returned)
+			format = self.format_selector.decide(accept, graph.context_aware)[1]
+			if format is not None and self.page_size is not None:
+				from .ntriples import line_formats
+				if format in line_formats:
+					format = None
+			cache_key = None
+			if self.cache_key is not None:
+				cache_key = self.cache_key(environ)
+			serializer = self.format_selector.get_serializer(format)
+			serialize = lambda graph: serialize_graph(graph, format, self.cache, cache_key, None, serializer,
+			                                          self.parallel)
+			returned = share_graph(graph, format, serialize)
+			shared = (captured.status, list(captured.headers), captured.written, returned)
+			return (captured, returned)
+		finally:
+			self.flights.finish(key, flight, shared)
+
 	def decorate(self, app):
 		""" Wraps a WSGI application to return formatted RDF graphs
 		    Uses content negotiation to serialize the graph to the client-preferred format
@@ -55,48 +436,62 @@ class Decorator(object):
 
 		@wraps(app)
 		def decorated(environ, start_response):
+			if self.prenegotiate or self.max_age is not None:
+				negotiation = Prenegotiation(self.format_selector, environ.get('HTTP_ACCEPT', ''))
+				if self.prenegotiate:
+					if not negotiation.acceptable():
+						start_response('406 Not Acceptable', [('Content-Type', 'text/plain')])
+						return ['406 Not Acceptable'.encode('utf-8')]
+					environ[NEGOTIATION_KEY] = negotiation
+				cached = self.cached_output(negotiation, environ, start_response, app)
+				if cached is not None:
+					return cached
+
 			# capture any start_response from the app
-			app_response = {}
-			app_response['status'] = "200 OK"
-			app_response['headers'] = []
-			app_response['written'] = BytesIO()
-			def custom_start_response(status, headers, *args, **kwargs):
-				app_response['status'] = status
-				app_response['headers'] = headers
-				app_response['args'] = args
-				app_response['kwargs'] = kwargs
-				return app_response['written'].write
-			returned = app(environ, custom_start_response)
-
-			# callbacks from the serialization
-			def set_http_code(status):
-				app_response['status'] = str(status)
-			def set_header(header, value):
-				app_response['headers'] = [(h,v) for (h,v) in app_response['headers'] if h.lower() != header.lower()]
-				app_response['headers'].append((header, value))
-			def set_content_type(content_type):
-				set_header('Content-Type', content_type)
+			if self.coalesce_key is not None:
+				(captured, returned) = self.run_coalesced(app, environ, start_response)
+			else:
+				captured = CapturedResponse(start_response)
+				returned = app(environ, captured)
+
+			if not self._is_graph(returned):
+				# pass other responses straight through
+				captured.replay(captured.headers)
+				return returned
 
 			# do the serialization
+			headers = Headers(captured.headers)
+			captured.headers = headers
 			accept = environ.get('HTTP_ACCEPT', '')
-			new_return = self.output(returned, accept, set_http_code, set_content_type)
+			cache_key = None
+			if self.cache_key is not None:
+				cache_key = self.cache_key(environ)
+			if_none_match = None
+			if environ.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD'):
+				if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+			accept_encoding = None
+			if self.compress:
+				accept_encoding = environ.get('HTTP_ACCEPT_ENCODING', '')
+			(range_header, if_range) = (None, None)
+			if self.ranges and environ.get('REQUEST_METHOD', 'GET') == 'GET':
+				(range_header, if_range) = (environ.get('HTTP_RANGE'), environ.get('HTTP_IF_RANGE'))
+			query = environ.get('QUERY_STRING') if self.page_size is not None else None
+			new_return = self.output(returned, accept, captured.set_http_code, captured.set_content_type,
+			                         cache_key, captured.set_header, if_none_match, accept_encoding,
+			                         range_header, if_range, query)
 
-			# set the Vary header
-			vary_headers = (v for (h,v) in app_response['headers'] if h.lower() == 'vary')
-			vary_elements = list(itertools.chain(*[v.split(',') for v in vary_headers]))
-			vary_elements = list(set([v.strip() for v in vary_elements]))
-			if '*' not in vary_elements and 'accept' not in (v.lower() for v in vary_elements):
-				vary_elements.append('Accept')
-				set_header('Vary', ', '.join(vary_elements))
+			if not isinstance(new_return, list):
+				# the length of a streamed body isn't known up front, and
+				# any length the app set was for its own response
+				headers.remove('Content-Length')
+			elif captured.status.startswith('304'):
+				# nor is there a body to describe
+				headers.remove('Content-Length')
+				headers.remove('Content-Type')
 
 			# pass on the result to the parent WSGI server
-			parent_writer = start_response(app_response['status'],
-			                               app_response['headers'],
-			                               *app_response.get('args', []),
-			                               **app_response.get('kwargs', {}))
-			written = app_response['written'].getvalue()
-			if len(written) > 0:
-				parent_writer(written)
+			merge_vary(headers, self._graph_varies)
+			captured.replay(headers.items)
 			return new_return
 		return decorated
 